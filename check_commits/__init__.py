@@ -1 +1,22 @@
-__all__ = ["check_commits"]
+__all__ = [ "check_commits"
+           ,"batch"
+           ,"commit_store"
+           ,"writers"
+           ,"columnar"
+           ,"classifier"
+           ,"sha_index"
+           ,"parse_cache"
+           ,"sqlite_sink"
+           ,"rollups"
+           ,"bench"
+           ,"profiler"
+           ,"aio"
+           ,"git_workers"
+           ,"daemon"
+           ,"szz"
+           ,"hunks"
+           ,"compress"
+           ,"partitions"
+           ,"external_sort"
+           ,"branches"
+          ]
@@ -0,0 +1,200 @@
+"""aio.py produces the records of a repo from an asyncio event loop, for
+services that embed check_commits rather than running the check-commits
+script and reading back its outputs.
+
+iter_commit_recs() is an asynchronous generator:
+
+    async for rec in aio.iter_commit_recs("/src/repo_a", "team_a"):
+        ...
+
+git is run as an asyncio subprocess and its output is read as it arrives,
+in the "machine" format (see MACHINE_LOG_ARGS). Each chunk is parsed, with
+MachineLogParser, in the loop's default executor, so the loop keeps serving
+its other tasks while a large history is parsed, and any number of repos
+can be consumed concurrently on the same loop:
+
+    async def load(path, owner):
+        return [rec async for rec in aio.iter_commit_recs(path, owner)]
+
+    results = await asyncio.gather(load(a, "team_a"), load(b, "team_b"))
+
+The records are exactly those that the "machine" engine produces for the
+same repo. When the consumer stops early, by reaching the limit, by
+breaking out of the loop and closing the generator, or by being cancelled,
+the git subprocess is killed, rather than left to write the rest of the
+history into a pipe that nobody reads.
+
+Note that, as elsewhere in check_commits, malformed git output is a fatal
+error, which raises SystemExit.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import asyncio
+import subprocess
+
+from check_commits import check_commits
+from check_commits.check_commits import DefectCommits
+from check_commits.check_commits import MachineLogParser
+
+
+def _parse_chunk( parser
+                 ,chunk
+                 ,repo_name
+                 ,repo_owner
+                 ,defect_commits
+                 ,log_filter
+                ):
+    """Feeds a chunk of git log output to the parser, and converts the
+    commits it completes into records. Runs in the executor.
+
+    Args:
+        parser - the MachineLogParser object for the log
+        chunk - bytes with the next chunk of output, or None at the end of
+                the log
+        The remaining arguments are the same as for
+        check_commits.stream_machine_commits()
+    Returns:
+        List of the CommitRec objects, in log order
+    """
+    if chunk is None:
+        commits = parser.close()
+    else:
+        commits = parser.feed(chunk)
+    recs = []
+    for c in commits:
+        if (log_filter is not None and
+                not log_filter.keep(c.timestamp - c.utc_offset)):
+            continue
+        recs.extend(c.to_commit_recs(repo_name, repo_owner, defect_commits))
+    del commits[:]
+    return recs
+
+
+async def _git_output(cmd):
+    """Runs a short git command and returns its output as a str
+
+    Raises:
+        subprocess.CalledProcessError if git fails
+    """
+    proc = await asyncio.create_subprocess_exec( *cmd
+                                                ,stdout=subprocess.PIPE
+                                               )
+    out, _ = await proc.communicate()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return out.decode("utf-8")
+
+
+async def _kill(proc):
+    """Kills a subprocess that is still running, and reaps it"""
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+    # Reading the rest of the pipe, up to the end, closes it, which waiting
+    # alone wouldn't do
+    await proc.communicate()
+
+
+async def iter_commit_recs( repo_path
+                           ,repo_owner="unknown_owner"
+                           ,revs=None
+                           ,defects_file=None
+                           ,classifier=None
+                           ,log_filter=None
+                           ,limit=None
+                          ):
+    """Asynchronous generator that produces the records of a repo
+
+    Args:
+        repo_path - str with the filesystem pathname to the repo
+        repo_owner - str specifying the owner of the GitHub (or other shared
+                    system) repo
+        revs - optional list of strs with the revisions (or revision ranges)
+                    for git log to walk, defaults to HEAD
+        defects_file - str with the pathname of the defect commits file,
+                    text or index. Defaults to <repo_name>.dfx or, if there
+                    is no such index, <repo_name>.dft, in the current
+                    working directory
+        classifier - optional classifier.DefectClassifier, used in place of
+                    the built in heuristics to classify commit messages
+        log_filter - optional check_commits.LogFilter object that limits
+                    the commits and files
+        limit - optional int, the most records to produce. git is stopped
+                    as soon as they have been produced
+    Yields:
+        The CommitRec objects, in log order
+    Raises:
+        subprocess.CalledProcessError if git fails
+    """
+    loop = asyncio.get_running_loop()
+    cmd_root = ["git", "-C", repo_path]
+    out = await _git_output(cmd_root + ["rev-parse", "--show-toplevel"])
+    repo_name = os.path.basename(out.rstrip())
+
+    if defects_file is None:
+        defects_file = repo_name + ".dfx"
+        if not os.path.exists(defects_file):
+            defects_file = repo_name + ".dft"
+    # Large defect commits files take a while to read
+    defect_commits = await loop.run_in_executor(None, DefectCommits,
+                                                defects_file, classifier)
+    revs = revs if revs else []
+    if log_filter is not None:
+        await loop.run_in_executor(None, log_filter.resolve, cmd_root)
+        revs = log_filter.args(revs)
+
+    cmd = cmd_root + check_commits.MACHINE_LOG_ARGS + revs
+    proc = await asyncio.create_subprocess_exec( *cmd
+                                                ,stdout=subprocess.PIPE
+                                               )
+    parser = MachineLogParser()
+    count = 0
+    try:
+        while limit is None or count < limit:
+            chunk = await proc.stdout.read(check_commits.READ_CHUNK)
+            recs = await loop.run_in_executor( None
+                                              ,_parse_chunk
+                                              ,parser
+                                              ,chunk if chunk else None
+                                              ,repo_name
+                                              ,repo_owner
+                                              ,defect_commits
+                                              ,log_filter
+                                             )
+            for rec in recs:
+                if limit is not None and count >= limit:
+                    break
+                count += 1
+                yield rec
+            if not chunk:
+                # The end of the log
+                if await proc.wait():
+                    raise subprocess.CalledProcessError(proc.returncode,
+                                                        cmd)
+                break
+    finally:
+        await _kill(proc)
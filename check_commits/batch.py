@@ -0,0 +1,258 @@
+"""batch.py runs check_commits over a collection of repos, as listed in a
+manifest, with a bounded number of repos being processed concurrently.
+
+The manifest is either a JSON file (its name ending in ".json") holding a
+list of objects such as:
+
+    [{"path": "/src/repo_a", "owner": "team_a"}, ...]
+
+where "owner" is optional, and "dft" may name the repo's defect commits
+file. Or it is a plain text file with one repo per line, holding the
+pathname of the repo and, optionally, its owner, separated by a tab:
+
+    /src/repo_a<TAB>team_a
+
+Blank lines and lines starting with "#" are ignored.
+
+Each repo's outputs are written to a directory named for its owner below
+the batch output directory, so repos with the same name but different owners
+don't collide. Should two repos share both name and owner, the second is
+given a directory with a numeric suffix. To minimize the overall elapsed
+time, the repos with the most commits are started first. A repo that fails,
+whether git fails or parsing exits on malformed input, is recorded in the
+summary but doesn't stop the batch. The summary is written to:
+
+    <out_dir>/batch-summary.json
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import sys
+import os
+import subprocess
+import json
+import time
+import traceback
+import concurrent.futures
+
+from check_commits import check_commits
+
+DEFAULT_OWNER = "unknown_owner"
+SUMMARY_NAME = "batch-summary.json"
+
+
+class BatchEntry(object):
+    """Describes one repo in the batch, and the results of processing it
+
+    Attributes:
+        path - pathname to the repo
+        owner - owner of the repo on GitHub or other shared systems
+        dft - optional pathname of the repo's defect commits file
+        size - estimated amount of work, the number of commits reachable
+                from HEAD, or -1 if that couldn't be determined
+        status - "ok" or "failed", None until the repo has been processed
+        records - number of records written for the repo
+        seconds - elapsed time spent processing the repo
+        error - str describing the failure, for failed repos
+    """
+    __slots__ = [ "path"
+                 ,"owner"
+                 ,"dft"
+                 ,"size"
+                 ,"status"
+                 ,"records"
+                 ,"seconds"
+                 ,"error"
+                ]
+
+    def __init__(self, path, owner=DEFAULT_OWNER, dft=None):
+        self.path    = path
+        self.owner   = owner
+        self.dft     = dft
+        self.size    = -1
+        self.status  = None
+        self.records = 0
+        self.seconds = 0.0
+        self.error   = None
+
+    def to_dict(self):
+        """Produce a Python dictionary representation of this object
+
+        Returns:
+            A dictionary containing the attribute/value pairs contained in
+            this object
+        """
+        od = {}
+        for k in self.__slots__:
+            od[k] = getattr(self, k)
+        return od
+
+
+def read_manifest(manifest):
+    """Reads the list of repos to process
+
+    Args:
+        manifest - pathname to the manifest file, see the module description
+                    for the supported formats
+    Returns:
+        List of BatchEntry objects, in manifest order
+    """
+    entries = []
+    with open(manifest, 'r') as f:
+        if manifest.endswith(".json"):
+            for e in json.load(f):
+                entries.append(BatchEntry( e["path"]
+                                          ,e.get("owner", DEFAULT_OWNER)
+                                          ,e.get("dft")
+                                         ))
+        else:
+            for l in f:
+                l = l.strip()
+                if not l or l.startswith("#"):
+                    continue
+                fields = l.split("\t")
+                owner = fields[1].strip() if len(fields) > 1 else ""
+                entries.append(BatchEntry( fields[0].strip()
+                                          ,owner if owner else DEFAULT_OWNER
+                                         ))
+    return entries
+
+
+def estimate_size(path):
+    """Estimates the work needed for a repo from its number of commits
+
+    Args:
+        path - pathname to the repo
+    Returns:
+        int with the number of commits reachable from HEAD, or -1 if git
+        couldn't count them
+    """
+    cmd = ["git", "-C", path, "rev-list", "--count", "HEAD"]
+    try:
+        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+        return int(out)
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return -1
+
+
+def _run_repo(args):
+    """Process pool worker that runs check_commits on a single repo
+
+    Any failure, including the sys.exit() calls made when parsing fails, is
+    caught and reported back, rather than being allowed to escape.
+
+    Args:
+        args - tuple of the repo path, owner, defect commits file, output
+                    directory and the options for process_commits()
+    Returns:
+        Tuple of the status, number of records, elapsed seconds and error
+        description (None on success)
+    """
+    path, owner, dft, out_dir, options = args
+    start = time.time()
+    try:
+        os.makedirs(out_dir, exist_ok=True)
+        records = check_commits.process_commits( path
+                                                ,owner
+                                                ,out_dir=out_dir
+                                                ,defects_file=dft
+                                                ,**options
+                                               )
+        return ("ok", records, time.time() - start, None)
+    except SystemExit as e:
+        error = "exited with status {0}".format(e.code)
+    except Exception as e:
+        error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+    return ("failed", 0, time.time() - start, error)
+
+
+def run_batch(manifest, out_dir=".", concurrency=0, options=None):
+    """Processes every repo in the manifest and writes a summary
+
+    Args:
+        manifest - pathname to the manifest file
+        out_dir - str with the directory that receives the outputs, each
+                    repo's outputs are placed in a subdirectory named for
+                    its owner
+        concurrency - int with the maximum number of repos processed at the
+                    same time, 0 selects the number of CPU cores
+        options - optional dictionary of additional keyword arguments for
+                    process_commits()
+    Returns:
+        The list of BatchEntry objects, in manifest order, with their
+        results filled in
+    """
+    concurrency = concurrency if concurrency > 0 else (os.cpu_count() or 1)
+    options = options if options else {}
+    entries = read_manifest(manifest)
+
+    # Counting commits is cheap next to processing them, but still worth
+    # overlapping for large fleets
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        sizes = pool.map(estimate_size, [e.path for e in entries])
+        for e, size in zip(entries, sizes):
+            e.size = size
+
+    # Starting the largest repos first keeps a big repo that happens to be
+    # late in the manifest from running on its own at the end of the batch
+    ordered = sorted(entries, key=lambda e: e.size, reverse=True)
+
+    # Pick an output directory for each repo, keeping them distinct
+    dirs = {}
+    seen = {}
+    for e in entries:
+        key = (e.owner, os.path.basename(os.path.normpath(e.path)))
+        seen[key] = seen.get(key, 0) + 1
+        subdir = e.owner
+        if seen[key] > 1:
+            subdir = "{0}-{1}".format(e.owner, seen[key])
+        dirs[id(e)] = os.path.join(out_dir, subdir)
+
+    batch_start = time.time()
+    with concurrent.futures.ProcessPoolExecutor(concurrency) as pool:
+        futures = {}
+        for e in ordered:
+            args = (e.path, e.owner, e.dft, dirs[id(e)], options)
+            futures[pool.submit(_run_repo, args)] = e
+        for fut in concurrent.futures.as_completed(futures):
+            e = futures[fut]
+            try:
+                e.status, e.records, e.seconds, e.error = fut.result()
+            except Exception as exc:
+                # The worker itself died, e.g. it was killed
+                e.status = "failed"
+                e.error = "worker failed: {0}".format(exc)
+            fstr = "{0:6} {1:8.2f}s {2}\n"
+            sys.stdout.write(fstr.format(e.status, e.seconds, e.path))
+            if e.error:
+                sys.stdout.write(' '*16 + e.error + '\n')
+
+    summary = { "elapsed":time.time() - batch_start
+               ,"concurrency":concurrency
+               ,"failed":sum(1 for e in entries if e.status != "ok")
+               ,"repos":[e.to_dict() for e in entries]
+              }
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, SUMMARY_NAME), 'w') as f:
+        json.dump(summary, f, indent=1)
+    return entries
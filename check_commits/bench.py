@@ -0,0 +1,464 @@
+"""bench.py measures the performance of check_commits on synthetic histories,
+so changes that slow down a phase can be caught before they're released.
+
+Two kinds of input are generated, both from a seeded random number
+generator, so the same parameters always produce the same history:
+
+    - git log output, in both the format parsed by the "regex" engine
+      (git log --numstat) and the NUL delimited format parsed by the
+      "machine" engine, held in memory
+    - a real, local, git repo, built with git fast-import
+
+The history is shaped by the number of commits, the number of files
+changed per commit, the number of lines in each commit message and the
+fraction of commits that are merges.
+
+Each phase is run in a fresh worker process, so its peak RSS isn't
+inflated by the phases before it. The phases are:
+
+    find_commits   - find_commits() on the regex log
+    proc_commits   - proc_commits() on the regex log
+    stream_commits - stream_commits() on the regex log
+    machine_parse  - stream_machine_commits() on the machine log
+    writers        - writers.write_records() to the JSON, CSV and text
+                     sinks
+    repo_machine   - process_commits() on the repo, "machine" engine
+    repo_regex     - process_commits() on the repo, "regex" engine
+
+For each phase, the wall and CPU time, the throughput in commits and MB (of
+log parsed, or output written) per second and the peak RSS of the worker
+(and, for the repo phases, of git) are recorded. The results can be saved
+as a baseline, and later results compared to it: a phase whose wall time
+exceeds that of the baseline by more than the threshold is a regression.
+
+Everything runs offline, it only needs git.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import json
+import time
+import random
+import shutil
+import hashlib
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import concurrent.futures
+from datetime import datetime
+from datetime import timezone
+from datetime import timedelta
+
+from check_commits import check_commits
+from check_commits import writers
+
+PHASES = [ "find_commits"
+          ,"proc_commits"
+          ,"stream_commits"
+          ,"machine_parse"
+          ,"writers"
+          ,"repo_machine"
+          ,"repo_regex"
+         ]
+# Phases that work on the in-memory logs, rather than the repo
+LOG_PHASES = PHASES[:5]
+
+# Default shape of the synthetic history
+DEFAULT_PARAMS = { "commits":2000
+                  ,"files_per_commit":4
+                  ,"msg_lines":3
+                  ,"merge_ratio":0.1
+                  ,"seed":1
+                 }
+# Default allowed slowdown, relative to the baseline, before a phase is
+# reported as a regression
+DEFAULT_THRESHOLD = 0.25
+
+BENCH_REPO = "bench"
+BENCH_OWNER = "bench_owner"
+# File, next to the synthetic repo, that holds the parameters it was built
+# with
+BENCH_PARAMS = "bench-params.json"
+
+_WORDS = ["fix", "add", "update", "remove", "refactor", "parser", "log",
+          "commit", "file", "test", "docs", "cleanup", "handle", "error"]
+_START = datetime(2015, 1, 1, tzinfo=timezone(timedelta(hours=2)))
+
+
+class SynthCommit(object):
+    """One commit of a synthetic history
+
+    Attributes:
+        sha - str with the (made up) SHA-1 of the commit
+        author - email address of the author
+        name - name of the author
+        when - aware datetime of the commit
+        msg - list of strs, the lines of the commit message
+        files - list of (lines added, lines deleted, path) tuples, empty for
+                merges
+        is_merge - bool, whether the commit is a merge
+    """
+    __slots__ = ["sha", "author", "name", "when", "msg", "files", "is_merge"]
+
+    def __init__(self, sha, author, name, when, msg, files, is_merge):
+        self.sha      = sha
+        self.author   = author
+        self.name     = name
+        self.when     = when
+        self.msg      = msg
+        self.files    = files
+        self.is_merge = is_merge
+
+
+def synth_history(params):
+    """Generates the commits of a synthetic history, newest first, as git
+    log shows them
+
+    Args:
+        params - dictionary with the shape of the history, see
+                DEFAULT_PARAMS
+    Returns:
+        List of SynthCommit objects
+    """
+    rnd = random.Random(params["seed"])
+    n_paths = max(10, params["commits"] * params["files_per_commit"] // 8)
+    paths = ["src/mod{0}/dir{1}/file{2}.py".format(i % 7, i % 13, i)
+             for i in range(n_paths)]
+    history = []
+    for i in range(params["commits"]):
+        who = rnd.randrange(25)
+        is_merge = rnd.random() < params["merge_ratio"]
+        msg = []
+        for l in range(params["msg_lines"]):
+            words = [rnd.choice(_WORDS) for _ in range(rnd.randrange(3, 10))]
+            if l == 0 and rnd.random() < 0.15:
+                words.append("JIRA-{0}".format(rnd.randrange(10000)))
+            msg.append(" ".join(words))
+        files = []
+        if not is_merge:
+            count = max(1, int(rnd.expovariate(
+                                    1.0 / params["files_per_commit"])))
+            for p in rnd.sample(paths, min(count, len(paths))):
+                files.append((rnd.randrange(60), rnd.randrange(30), p))
+        sha = hashlib.sha1("{0}-{1}".format(params["seed"], i)
+                           .encode("ascii")).hexdigest()
+        history.append(SynthCommit( sha
+                                   ,"dev{0}@example.com".format(who)
+                                   ,"Dev {0}".format(who)
+                                   ,_START + timedelta(minutes=37 * i)
+                                   ,msg
+                                   ,files
+                                   ,is_merge
+                                  ))
+    history.reverse()
+    return history
+
+
+def regex_log(history):
+    """Renders a history as git log --numstat does
+
+    Returns:
+        str holding the log
+    """
+    out = []
+    for i, c in enumerate(history):
+        out.append("commit " + c.sha)
+        if c.is_merge:
+            parents = history[i+1].sha[:7] if i + 1 < len(history) else ""
+            out.append("Merge: {0} {1}".format(parents, c.sha[-7:]))
+        out.append("Author: {0} <{1}>".format(c.name, c.author))
+        out.append("Date:   " + c.when.strftime(check_commits.CommitRec
+                                                .GIT_DATE_FMT))
+        out.append("")
+        for l in c.msg:
+            out.append("    " + l)
+        out.append("")
+        if c.files:
+            for added, deleted, path in c.files:
+                out.append("{0}\t{1}\t{2}".format(added, deleted, path))
+            out.append("")
+    return "\n".join(out)
+
+
+def machine_log(history):
+    """Renders a history as git log does with MACHINE_LOG_ARGS
+
+    Returns:
+        bytes holding the log
+    """
+    recs = []
+    for c in history:
+        offset = c.when.utcoffset().total_seconds() // 60
+        sign = "-" if offset < 0 else "+"
+        date = "{0} {1}{2:02d}{3:02d}".format( int(c.when.timestamp())
+                                              ,sign
+                                              ,int(abs(offset)) // 60
+                                              ,int(abs(offset)) % 60
+                                             )
+        parts = ["", c.sha, c.author, date, "\n".join(c.msg) + "\n", ""]
+        rec = "\0".join(parts)
+        if c.files:
+            rec += "\n" + "".join("{0}\t{1}\t{2}\0".format(a, d, p)
+                                  for a, d, p in c.files)
+        recs.append(rec)
+    return "\0".join(recs).encode("utf-8")
+
+
+def make_repo(path, history):
+    """Builds a git repo holding a history, using git fast-import
+
+    Each file change rewrites the file with as many lines as were added.
+    A merge joins a one commit side branch into the main line.
+
+    Args:
+        path - str with the directory to create the repo in
+        history - list of SynthCommit objects, newest first
+    """
+    subprocess.check_call(["git", "init", "-q", path])
+    cmds = []
+    mark = 0
+    for c in reversed(history):
+        stamp = "{0} {1}".format(int(c.when.timestamp()),
+                                 c.when.strftime("%z"))
+        ident = "{0} <{1}> {2}".format(c.name, c.author, stamp)
+        msg = ("\n".join(c.msg) + "\n").encode("utf-8")
+        mods = []
+        side = None
+        if c.is_merge and mark:
+            # The side branch contributes a change of its own
+            mark += 1
+            side = mark
+            content = "side {0}\n".format(side).encode("ascii")
+            cmds.append(b"commit refs/heads/side\n")
+            cmds.append("mark :{0}\n".format(side).encode("ascii"))
+            cmds.append("committer {0}\n".format(ident).encode("utf-8"))
+            cmds.append(b"data 5\nside\n\n")
+            cmds.append("from :{0}\n".format(mark - 1).encode("ascii"))
+            cmds.append("M 100644 inline side/s{0}.txt\n".format(side)
+                        .encode("ascii"))
+            cmds.append("data {0}\n".format(len(content)).encode("ascii"))
+            cmds.append(content + b"\n")
+        for added, deleted, p in c.files:
+            content = "".join("line {0} of {1}\n".format(n, c.sha[:8])
+                              for n in range(added)).encode("ascii")
+            mods.append("M 100644 inline {0}\n".format(p).encode("utf-8"))
+            mods.append("data {0}\n".format(len(content)).encode("ascii"))
+            mods.append(content + b"\n")
+        prev = mark if side is None else mark - 1
+        mark += 1
+        cmds.append(b"commit refs/heads/master\n")
+        cmds.append("mark :{0}\n".format(mark).encode("ascii"))
+        cmds.append("author {0}\n".format(ident).encode("utf-8"))
+        cmds.append("committer {0}\n".format(ident).encode("utf-8"))
+        cmds.append("data {0}\n".format(len(msg)).encode("ascii") + msg)
+        if prev:
+            cmds.append("from :{0}\n".format(prev).encode("ascii"))
+        if side is not None:
+            cmds.append("merge :{0}\n".format(side).encode("ascii"))
+        cmds.extend(mods)
+        cmds.append(b"\n")
+    subprocess.run(["git", "-C", path, "fast-import", "--quiet"],
+                   input=b"".join(cmds), check=True)
+    subprocess.check_call(["git", "-C", path, "checkout", "-q", "master"])
+
+
+def _defects_path(tmp_dir):
+    """Creates an empty defect commits file, so the phases don't produce the
+    note that a missing file would, and returns its pathname
+    """
+    path = os.path.join(tmp_dir, "empty.dft")
+    open(path, 'w').close()
+    return path
+
+
+def _run_phase(args):
+    """Worker that runs, and measures, a single phase
+
+    Args:
+        args - tuple of the phase name, the history parameters and the
+                pathname of the repo
+    Returns:
+        Dictionary with the measurements
+    """
+    phase, params, repo_path = args
+    tmp_dir = tempfile.mkdtemp(prefix="bench-")
+    defects_file = _defects_path(tmp_dir)
+    defects = check_commits.DefectCommits(defects_file)
+    history = synth_history(params)
+    commits = len(history)
+    size = 0
+    recs = None
+    if phase in ("find_commits", "proc_commits", "stream_commits"):
+        text = regex_log(history)
+        size = len(text.encode("utf-8"))
+        log = text.splitlines()
+        commit_idx = check_commits.find_commits(log) + [len(log) + 1]
+    elif phase in ("machine_parse", "writers"):
+        data = machine_log(history)
+        size = len(data)
+        chunks = [data[i:i+check_commits.READ_CHUNK]
+                  for i in range(0, len(data), check_commits.READ_CHUNK)]
+        if phase == "writers":
+            recs = list(check_commits.stream_machine_commits( chunks
+                                                              ,BENCH_REPO
+                                                              ,BENCH_OWNER
+                                                              ,defects
+                                                             ))
+    del history
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    if phase == "find_commits":
+        check_commits.find_commits(log)
+    elif phase == "proc_commits":
+        recs = check_commits.proc_commits( log
+                                          ,commit_idx
+                                          ,BENCH_REPO
+                                          ,BENCH_OWNER
+                                          ,defects
+                                         )
+    elif phase == "stream_commits":
+        recs = list(check_commits.stream_commits( iter(log)
+                                                 ,BENCH_REPO
+                                                 ,BENCH_OWNER
+                                                 ,defects
+                                                ))
+    elif phase == "machine_parse":
+        recs = list(check_commits.stream_machine_commits( chunks
+                                                         ,BENCH_REPO
+                                                         ,BENCH_OWNER
+                                                         ,defects
+                                                        ))
+    elif phase == "writers":
+        sinks = [ writers.JsonArraySink(os.path.join(tmp_dir, "b.json"))
+                 ,writers.CsvSink(os.path.join(tmp_dir, "b.csv"))
+                 ,writers.TextSink(os.path.join(tmp_dir, "b.txt"))
+                ]
+        writers.write_records(recs, sinks)
+        size = sum(os.path.getsize(s.path) for s in sinks)
+    elif phase in ("repo_machine", "repo_regex"):
+        n = check_commits.process_commits( repo_path
+                                          ,BENCH_OWNER
+                                          ,engine=phase[len("repo_"):]
+                                          ,out_dir=tmp_dir
+                                          ,defects_file=defects_file
+                                         )
+        recs = range(n)
+        size = os.path.getsize(os.path.join(tmp_dir, BENCH_REPO + ".json"))
+    else:
+        raise ValueError("Unknown benchmark phase: '{0}'".format(phase))
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    shutil.rmtree(tmp_dir)
+
+    result = { "seconds":wall
+              ,"cpu_seconds":cpu
+              ,"commits":commits
+              ,"records":len(recs) if recs is not None else 0
+              ,"mb":size / float(1 << 20)
+              ,"commits_per_sec":commits / wall if wall else 0.0
+              ,"mb_per_sec":size / float(1 << 20) / wall if wall else 0.0
+              # ru_maxrss is in KB on Linux
+              ,"peak_rss_mb":resource.getrusage(resource.RUSAGE_SELF)
+                                     .ru_maxrss / 1024.0
+             }
+    if phase.startswith("repo_"):
+        result["git_peak_rss_mb"] = (resource.getrusage(
+                                        resource.RUSAGE_CHILDREN)
+                                     .ru_maxrss / 1024.0)
+    return result
+
+
+def run_benchmarks(params=None, phases=None, repo_dir=None):
+    """Runs the benchmark phases
+
+    Args:
+        params - optional dictionary with the shape of the history,
+                    defaults to DEFAULT_PARAMS
+        phases - optional list of the phases to run, defaults to PHASES
+        repo_dir - optional str with the directory for the synthetic repo,
+                    which is left in place, and reused by later runs with
+                    the same parameters (it's rebuilt for any others),
+                    otherwise a temporary directory is used
+    Returns:
+        Dictionary with the parameters and, for each phase, its
+        measurements
+    """
+    p = dict(DEFAULT_PARAMS)
+    p.update(params if params else {})
+    phases = phases if phases else PHASES
+    repo_path = None
+    if any(ph not in LOG_PHASES for ph in phases):
+        if repo_dir is None:
+            repo_dir = tempfile.mkdtemp(prefix="bench-repo-")
+        # Name the repo so the outputs have predictable names
+        repo_path = os.path.join(repo_dir, BENCH_REPO)
+        params_path = os.path.join(repo_dir, BENCH_PARAMS)
+        built = None
+        if os.path.exists(repo_path) and os.path.exists(params_path):
+            with open(params_path, 'r') as f:
+                built = json.load(f)
+        if built != p:
+            if os.path.exists(repo_path):
+                shutil.rmtree(repo_path)
+            make_repo(repo_path, synth_history(p))
+            with open(params_path, 'w') as f:
+                json.dump(p, f, indent=1, sort_keys=True)
+
+    results = {}
+    # A fresh process per phase keeps their peak RSS apart
+    ctx = multiprocessing.get_context("spawn")
+    for ph in phases:
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=ctx) as ex:
+            results[ph] = ex.submit(_run_phase, (ph, p, repo_path)).result()
+    return {"params":p, "phases":results}
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compares results against a baseline
+
+    Args:
+        results - dictionary returned by run_benchmarks()
+        baseline - dictionary returned by an earlier run_benchmarks()
+        threshold - float, the allowed fractional increase in wall time
+    Returns:
+        List of (phase, baseline seconds, seconds, ratio, regressed) tuples,
+        for the phases found in both
+    Raises:
+        ValueError if the results were produced with different parameters
+    """
+    if results["params"] != baseline["params"]:
+        raise ValueError("The baseline was run with different parameters: "
+                         "{0}".format(json.dumps(baseline["params"],
+                                                 sort_keys=True)))
+    rows = []
+    for ph, r in results["phases"].items():
+        b = baseline["phases"].get(ph)
+        if b is None:
+            continue
+        ratio = r["seconds"] / b["seconds"] if b["seconds"] else 1.0
+        rows.append((ph, b["seconds"], r["seconds"], ratio,
+                     ratio > 1.0 + threshold))
+    return rows
@@ -0,0 +1,202 @@
+"""branches.py finds which of the repo's branches each commit is on, so the
+records of every branch can be extracted in a single pass, with each commit
+processed once, however many branches share it.
+
+The refs whose names start with one of REF_PATTERNS (the local and remote
+branches, by default) are listed in a table, sorted by name, and the
+commits reachable from any of their tips are walked by a single git log, in
+place of HEAD alone.
+
+The branches that each commit is on are recorded as a bitmap over the table,
+with bit n set if the commit is reachable from the n-th ref. The bitmaps
+come from one more walk of the history, with git rev-list --topo-order
+--parents, which lists the commits without their diffs, every child before
+its parents. Each ref's bit is set on its tip, and each commit passes its
+bitmap on to its parents. So, when a commit is listed, its bitmap is
+complete, and is written out right away. Only the bitmaps of the parents
+still to be listed are held in memory, and the cost grows with the number
+of unique commits, rather than commits times branches.
+
+The table and the bitmaps are written to <repo_name>-refs.json:
+
+    { "repo": <repo_name>
+     ,"refs": [<ref name>, ...]
+     ,"commits": { <SHA-1>: <bitmap, as a hexadecimal str>
+                  ,...
+                 }
+    }
+
+which lists every commit that is reachable from one of the refs, in
+topological order, whether or not it passed the filters of the run.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import json
+import subprocess
+
+# The prefixes of the names of the refs that are walked, see
+# git-for-each-ref(1)
+REF_PATTERNS = ["refs/heads/", "refs/remotes/"]
+
+# The object name, the one it peels to (for annotated tags), their types,
+# and whether the ref is symbolic
+_REF_FMT = ("--format=%(objectname) %(objecttype) %(*objectname) "
+            "%(*objecttype) %(symref) %(refname)")
+
+
+def selected(name, patterns=None):
+    """Checks whether the name of a ref starts with one of the patterns"""
+    patterns = patterns if patterns is not None else REF_PATTERNS
+    return any(name.startswith(p) for p in patterns)
+
+
+def ref_table(cmd_root, patterns=None):
+    """Lists the refs that are walked
+
+    Symbolic refs, such as refs/remotes/origin/HEAD, and refs to anything
+    other than a commit, are left out.
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                targets the repo
+        patterns - optional list of strs with the prefixes of the names of
+                the refs, defaults to the value of REF_PATTERNS
+    Returns:
+        List of (ref name, SHA-1 of its commit) tuples, sorted by name
+    """
+    patterns = patterns if patterns is not None else REF_PATTERNS
+    cmd = cmd_root + ["for-each-ref", _REF_FMT] + patterns
+    table = []
+    out = subprocess.check_output(cmd).decode("utf-8")
+    for line in out.splitlines():
+        sha, kind, peeled, peeled_kind, symref, name = line.split(" ", 5)
+        if symref:
+            continue
+        if peeled:
+            sha, kind = peeled, peeled_kind
+        if kind == "commit" and selected(name, patterns):
+            table.append((name, sha))
+    return sorted(table)
+
+
+def ref_tips(table):
+    """Returns the SHA-1's of the tips of the refs, without repeats"""
+    tips = []
+    seen = set()
+    for name, sha in table:
+        if sha not in seen:
+            seen.add(sha)
+            tips.append(sha)
+    return tips
+
+
+def contains(cmd_root, new_tips, old_tips):
+    """Checks whether every commit reachable from the old tips is still
+    reachable from the new ones, so the records of the commits that were
+    processed are still valid
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                targets the repo
+        new_tips - list of strs with the SHA-1's of the current tips
+        old_tips - list of strs with the SHA-1's of earlier tips, which may
+                no longer exist
+    Returns:
+        True if none of the old commits has become unreachable
+    """
+    if not old_tips:
+        return True
+    cmd = cmd_root + ["rev-list", "--count"] + old_tips + ["--not"] + new_tips
+    try:
+        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return False
+    return int(out) == 0
+
+
+def iter_membership(cmd_root, table):
+    """Generator that computes the refs that each commit is reachable from
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                targets the repo
+        table - list of (ref name, SHA-1) tuples, see ref_table()
+    Yields:
+        Tuples of the SHA-1 of each commit and its int bitmap, with bit n
+        set if the commit is reachable from table[n], children first
+    """
+    # The bits of the refs that point at each tip
+    pending = {}
+    for n, (name, sha) in enumerate(table):
+        pending[sha] = pending.get(sha, 0) | (1 << n)
+    if not pending:
+        return
+    cmd = cmd_root + ["rev-list", "--topo-order", "--parents", "--stdin"]
+    proc = subprocess.Popen( cmd
+                            ,stdin=subprocess.PIPE
+                            ,stdout=subprocess.PIPE
+                           )
+    try:
+        proc.stdin.write(''.join(sha + "\n" for sha in pending)
+                         .encode("ascii"))
+        proc.stdin.close()
+        for line in proc.stdout:
+            shas = line.decode("ascii").split()
+            # Every child has been listed, so the bitmap is complete
+            bits = pending.pop(shas[0], 0)
+            for parent in shas[1:]:
+                pending[parent] = pending.get(parent, 0) | bits
+            yield shas[0], bits
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+
+def write_refs(cmd_root, repo_name, table, path):
+    """Writes the ref table, and the bitmap of every commit reachable from
+    it
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                targets the repo
+        repo_name - str containing the name of the repo
+        table - list of (ref name, SHA-1) tuples, see ref_table()
+        path - pathname of the output file
+    Returns:
+        The number of commits written
+    """
+    count = 0
+    with open(path, 'w') as f:
+        f.write('{{"repo": {0}, "refs": {1}, "commits": {{'
+                .format(json.dumps(repo_name),
+                        json.dumps([name for name, sha in table])))
+        sep = "\n"
+        for sha, bits in iter_membership(cmd_root, table):
+            f.write('{0}"{1}": "{2:x}"'.format(sep, sha, bits))
+            sep = ",\n"
+            count += 1
+        f.write("\n}}\n")
+    return count
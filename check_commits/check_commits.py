@@ -67,6 +67,8 @@ import argparse
 import re
 import json
 import csv
+import contextlib
+import concurrent.futures
 
 from datetime import datetime
 from datetime import timezone
@@ -75,6 +77,81 @@ from datetime import timezone
 GEN_CSV = True
 # Gates whether we generate a plain text representation of the result
 GEN_TEXT = True
+# Gates whether we generate a binary, column oriented, file of the result
+GEN_COLUMNAR = False
+# Gates whether we read the git log incrementally from the subprocess pipe,
+# rather than buffering the complete log before parsing it
+STREAM_LOG = True
+# Selects how the git log is requested and parsed, either:
+#   "machine" - NUL delimited fields, parsed in a single pass
+#   "regex"   - the default git log format, parsed with regular expressions
+LOG_ENGINE = "machine"
+# Size of the reads from the git subprocess pipe by the "machine" engine
+READ_CHUNK = 1 << 16
+# Number of worker processes used to extract the log, 1 extracts serially
+# and 0 uses one worker per CPU core
+JOBS = 1
+# When extracting in parallel, the commits are split into this many shards
+# per worker, but no shard is made smaller than MIN_SHARD_COMMITS
+SHARDS_PER_JOB = 4
+MIN_SHARD_COMMITS = 500
+# Gates whether the records are held in a CommitStore, rather than a list of
+# CommitRec objects, until they're written
+COMPACT_STORE = False
+# Selects the form of the JSON output, either:
+#   "array"  - <repo_name>.json holds a single JSON array of the records
+#   "ndjson" - <repo_name>.ndjson holds one JSON object per line
+JSON_FORMAT = "array"
+# Pathname of the SQLite database that the records are also loaded into,
+# "" selects <repo_name>.sqlite, None disables it
+SQLITE_DB = None
+# Gates the generation of the rollup files, see rollups.py
+GEN_ROLLUPS = False
+# Pathname of the classifier config used to identify defect fixes from the
+# commit messages, "" selects the default rules, None uses DEFECT_REGEX
+CLASSIFIER_CONFIG = None
+# Directory holding the parse cache (see parse_cache.py), None disables it
+CACHE_DIR = None
+# Size, in bytes, above which the least recently used cache entries are
+# evicted
+CACHE_MAX_BYTES = 1 << 30
+# Gates whether the time and memory of each phase of a run, and its
+# counters, are written to <repo_name>-profile.json, see profiler.py
+GEN_PROFILE = False
+# Gates whether the run is also profiled with cProfile, implies GEN_PROFILE
+GEN_CPROFILE = False
+# Gates whether the defect commits are attributed to the commits that
+# introduced the defects, in <repo_name>-szz.csv, see szz.py
+GEN_SZZ = False
+# Gates whether the hunks of each commit, and their enclosing functions, are
+# written to <repo_name>-hunks.csv, see hunks.py
+GEN_HUNKS = False
+# Codec used to compress the JSON, CSV and text outputs, "gzip", "bz2" or
+# "lzma", None leaves them uncompressed. See compress.py for the levels and
+# buffer sizes
+COMPRESS = None
+# Splits the JSON, CSV and text outputs into partitions, listed in
+# <repo_name>-manifest.json, by "day", "week", "month" or "year" of the
+# commit timestamps, or every N records. None writes single files. See
+# partitions.py
+PARTITION = None
+# Orders the JSON, CSV and text outputs by "file" or "timestamp", rather
+# than log order, None keeps log order. See external_sort.py for the memory
+# limit
+SORT_BY = None
+# Gates whether the history of every branch, rather than HEAD's, is walked,
+# and the branches that each commit is on are written to
+# <repo_name>-refs.json, see branches.py
+ALL_REFS = False
+
+# git log arguments that produce the input expected by MachineLogParser
+MACHINE_LOG_FMT = "%x00%H%x00%aE%x00%ad%x00%B%x00"
+MACHINE_LOG_ARGS = [ "log"
+                    ,"-z"
+                    ,"--numstat"
+                    ,"--date=raw"
+                    ,"--pretty=format:" + MACHINE_LOG_FMT
+                   ]
 
 FATAL_LBL = "FATAL ERROR: "
 ERR_LBL = "ERROR: "
@@ -287,12 +364,21 @@ class CommitRec(object):
                     suspect contains the date of the commit
             defect_commit - object that manages a collection of commits that
                     the user has told us are associated with defect fixes.
-                    May be empty.
+                    May be empty. If it carries a classifier, the message
+                    is classified by its rules, rather than DEFECT_REGEX
         """
 
+        classifier = defect_commits.classifier
         if defect_commits.is_defect(self.commit):
             # Tagged by the user
             self.is_defect = True
+            if classifier is not None:
+                classifier.count_external(self.commit)
+        elif classifier is not None:
+            # Apply the configured rules, keeping the lines apart, so words
+            # at the end of one line aren't run together with the next
+            rule = classifier.classify('\n'.join(lines), self.commit)
+            self.is_defect = rule is not None
         else:
             # Otherwise, join all of the commit message strings together
             # and attempt to find clues that this commit addressed a
@@ -425,23 +511,57 @@ class DefectCommits(object):
     Also provides an interface for checking a given commit SHA-1 against the
     internal collection.
 
+    The file is either text, or an index built from a text file (see
+    sha_index.py), which is memory-mapped rather than loaded. Either may
+    hold abbreviated SHA-1's, which match the commits whose SHA-1's start
+    with them. An abbreviated SHA-1 that matches more than one commit is
+    reported, as it may have tagged the wrong commit.
+
     Attributes:
-        defect_commits - the collection of SHA-1's that this object manages
+        defect_commits - the collection of full SHA-1's that this object
+                    manages, when read from a text file
+        prefixes - dictionary mapping each length of the abbreviated SHA-1's
+                    read from a text file to the set of those SHA-1's
+        index - sha_index.ShaIndex, when the file is an index, else None
+        classifier - optional classifier.DefectClassifier, used in place of
+                    the built in heuristics to classify commit messages
     """
-    __slots__ = ["defect_commits"]
+    __slots__ = [ "defect_commits"
+                 ,"prefixes"
+                 ,"index"
+                 ,"classifier"
+                 ,"_prefix_hits"
+                ]
 
-    def __init__(self, defects_file):
+    def __init__(self, defects_file, classifier=None):
         """Attempts to open/read the file of commits and retains the results
 
         Args:
            defects_file - pathname to the file containing the externally 
                             provided collection of commits
+           classifier - optional classifier.DefectClassifier for the commit
+                            messages
         """
+        from check_commits import sha_index
+        self.classifier = classifier
         self.defect_commits = set()
+        self.prefixes = {}
+        self.index = None
+        # The commit first matched by each abbreviated SHA-1
+        self._prefix_hits = {}
         try:
-            with open(defects_file, 'r') as f:
-                for l in f:
-                    self.defect_commits.add(l.rstrip())
+            if sha_index.is_index(defects_file):
+                self.index = sha_index.ShaIndex(defects_file)
+            else:
+                with open(defects_file, 'r') as f:
+                    for l in f:
+                        sha = l.rstrip()
+                        if sha_index.is_abbrev(sha.lower()):
+                            self.prefixes.setdefault( len(sha)
+                                                     ,set()
+                                                    ).add(sha.lower())
+                        else:
+                            self.defect_commits.add(sha)
         except FileNotFoundError:
             sys.stdout.write(NOTE_LBL + 
                              "No external defect commits specified.\n"
@@ -451,7 +571,10 @@ class DefectCommits(object):
                              ("Unable to open external defect commits file. "
                               "Will use internal heuristics.\n")
                             )
-    
+        except ValueError as e:
+            sys.stderr.write(FATAL_LBL + "{0}\n".format(e))
+            sys.exit(EXIT_FAILURE)
+
     def is_defect(self, commit):
         """ Checks the internal collection of commits for a match
         Args:
@@ -460,7 +583,180 @@ class DefectCommits(object):
             True if the specified commit is in the internal collection, which
             signifies that the commit is associated with fixing a defect
         """
-        return True if commit in self.defect_commits else False
+        if commit in self.defect_commits:
+            return True
+        match = None
+        if self.index is not None:
+            match = self.index.lookup(commit)
+        else:
+            for n, prefixes in self.prefixes.items():
+                if commit[:n] in prefixes:
+                    match = commit[:n]
+                    break
+        if match is None:
+            return False
+        if match != commit:
+            first = self._prefix_hits.setdefault(match, commit)
+            if first != commit:
+                sys.stderr.write(NOTE_LBL +
+                                 ("Abbreviated defect commit {0} is "
+                                  "ambiguous, it matches {1} and {2}\n")
+                                 .format(match, first, commit))
+        return True
+
+
+class LogFilter(object):
+    """Limits the commits, and files, that are extracted from the repo
+
+    The filters are handed to git, as git log (and git rev-list) arguments,
+    so the commits and files that don't match are pruned before they reach
+    the parser. Each filter is optional:
+
+        since, until - dates, in any format that git accepts, such as
+                "2015-06-30" or "12 months ago". git compares them with
+                the commit date, while the records carry the author date,
+                so the parser also drops the commits whose author date
+                falls outside the range (typically, commits that were
+                rebased or cherry-picked after being authored)
+        include - pathspecs, only the files that match at least one of
+                them are reported, and only the commits that touch them
+        exclude - pathspecs, the files that match any of them are not
+                reported
+        authors - regular expressions, only the commits whose author
+                ("Name <email>") matches at least one of them are reported
+
+    Attributes:
+        since - str with the start of the date range, or None
+        until - str with the end of the date range, or None
+        include - list of strs with the pathspecs to include
+        exclude - list of strs with the pathspecs to exclude
+        authors - list of strs with the author patterns
+        min_time - seconds since the epoch of since, once resolved by
+                    resolve(), else None
+        max_time - seconds since the epoch of until, once resolved by
+                    resolve(), else None
+    """
+    __slots__ = [ "since"
+                 ,"until"
+                 ,"include"
+                 ,"exclude"
+                 ,"authors"
+                 ,"min_time"
+                 ,"max_time"
+                ]
+
+    def __init__( self
+                 ,since=None
+                 ,until=None
+                 ,include=None
+                 ,exclude=None
+                 ,authors=None
+                ):
+        self.since   = since
+        self.until   = until
+        self.include = list(include) if include else []
+        self.exclude = list(exclude) if exclude else []
+        self.authors = list(authors) if authors else []
+        self.min_time = None
+        self.max_time = None
+
+    def is_empty(self):
+        """Returns True if no filter is set"""
+        return not (self.since or self.until or self.include or
+                    self.exclude or self.authors)
+
+    def resolve(self, cmd_root):
+        """Converts the dates into seconds since the epoch, exactly as git
+        interprets them, for the parser's checks of the author dates
+
+        Args:
+            cmd_root - list of strs with the start of the git command that
+                    targets the repo
+        """
+        args = []
+        if self.since:
+            args.append("--since=" + self.since)
+        if self.until:
+            args.append("--until=" + self.until)
+        if not args:
+            return
+        cmd = cmd_root + ["rev-parse"] + args
+        # git rev-parse translates them into --max-age=N and --min-age=N
+        for arg in subprocess.check_output(cmd).decode("utf-8").split():
+            name, _, secs = arg.partition("=")
+            if name == "--max-age":
+                self.min_time = int(secs)
+            elif name == "--min-age":
+                self.max_time = int(secs)
+
+    def rev_args(self):
+        """Returns the list of git log arguments that limit the commits,
+        which go before the revisions
+        """
+        args = []
+        if self.since:
+            args.append("--since=" + self.since)
+        if self.until:
+            args.append("--until=" + self.until)
+        args.extend("--author=" + a for a in self.authors)
+        if self.include or self.exclude:
+            # Without this, git skips the commits whose changes to the
+            # paths didn't survive a merge, though they still happened
+            args.append("--full-history")
+        return args
+
+    def path_args(self):
+        """Returns the list of git log arguments that limit the files,
+        which go after the revisions
+        """
+        if not (self.include or self.exclude):
+            return []
+        return (["--"] + self.include +
+                [":(exclude)" + p for p in self.exclude])
+
+    def args(self, revs):
+        """Returns the list of git log (or git rev-list) arguments that walk
+        the revisions with the filters applied
+
+        Args:
+            revs - list of strs with the revisions
+        """
+        return self.rev_args() + revs + self.path_args()
+
+    def keep(self, utc_time):
+        """Checks whether an author date falls within the date range
+
+        Args:
+            utc_time - seconds since the epoch
+        Returns:
+            True if the commit should be kept
+        """
+        if self.min_time is not None and utc_time < self.min_time:
+            return False
+        if self.max_time is not None and utc_time > self.max_time:
+            return False
+        return True
+
+    def to_dict(self):
+        """Returns the filters as a dictionary, for the run settings"""
+        return { "since":self.since
+                ,"until":self.until
+                ,"include":self.include
+                ,"exclude":self.exclude
+                ,"authors":self.authors
+               }
+
+
+def utc_offset(tz):
+    """Converts a timezone offset, such as "+0130", into seconds
+
+    Args:
+        tz - str with the sign, hours and minutes of the offset
+    Returns:
+        int with the offset, in seconds
+    """
+    offset = int(tz[1:3])*3600 + int(tz[3:5])*60
+    return -offset if tz[0] == "-" else offset
 
 
 def find_commits(log):
@@ -480,7 +776,118 @@ def find_commits(log):
             if CommitRec.COMMIT_REGEX.match(x) is not None]
 
 
-def proc_commits(log, commits, repo_name, repo_owner):
+def parse_block(lines, repo_name, repo_owner, defect_commits, log_filter=None):
+    """Parses a block from the git log that represents a single commit.
+
+    The caller has chopped up the log into blocks of lines that each
+    represents a single commit. A commit will have the SHA-1, the Author,
+    the time, the commit message, the files involved and the number of
+    lines added/deleted for each file.
+
+    This function creates the CommitRec(s - plural if the commit involved
+    more than one file, we'll create a separate CommitRec object for each
+    file). Then uses the CommitRec object's functions to actually parse,
+    and store the information we're extracting.
+
+    Args:
+        lines - list of strings each of which represents a line from
+                the git log
+        repo_name - str containing the name of the repo that we're processing
+        repo_owner - str specifying the owner of the GitHub (or other shared
+                system) repo
+        defect_commits - DefectCommits object holding the commits that the
+                user has told us are associated with defect fixes
+        log_filter - optional LogFilter object, commits whose author date
+                falls outside its date range produce no records
+    Returns:
+        List of the CommitRec object(s) - one for each file involved in
+        the commit.
+    """
+    # Initialize the first CommitRec object
+    commit_rec = CommitRec(repo_name, repo_owner)
+
+    # Parse the block of lines to extract the commit SHA-1, since this
+    # is a block of commits, the record should be the first one in
+    # the block
+    commit_rec.parse_commit(lines[0])
+    # For author & timestamp, we can't rely on a fixed offset,
+    # so the parse functions take most of the block
+    commit_rec.parse_author(lines[1:])
+    ts_idx = commit_rec.parse_timestamp(lines[1:])
+    if log_filter is not None:
+        # The timestamp is the local time of the commit, the date line ends
+        # with its offset from UTC
+        tz = lines[ts_idx+1].rsplit(" ", 1)[-1]
+        if not log_filter.keep(commit_rec.timestamp - utc_offset(tz)):
+            return []
+
+    # The number of lines in the commit message and file segments of
+    # the commit block are variable, so we can't use fixed offsets, 
+    # other than the start of the commit message segment.  However,
+    # since we know that the rest of the block only contains commit
+    # message text, blank lines and file information, we walk through
+    # the rest of the block and group everything into two buckets:
+    #   msgs - holds commit messages and blan lines
+    #   files - holds the text that identifies files and the number of
+    #           lines changed in each
+    msgs = []
+    files = []
+    # We slice the block of commit log entries so that we're only
+    # dealing with the sections that contain either commit messages, or
+    # file data - ts_idx is the index of the date line in lines[1:]
+    #for l in lines[(ts_idx+1):len(lines)]:
+    for l in lines[(ts_idx+2):]:
+        if CommitRec.is_file_line(l):
+            files.append(l)
+        else:
+            msgs.append(l)
+    # Drop the blank lines that set the message apart from the header and
+    # the file lines, log_msg_lines() doesn't produce them either
+    while msgs and not msgs[0]:
+        msgs.pop(0)
+    while msgs and not msgs[-1]:
+        msgs.pop()
+
+    # Will hold the new CommitRec objects that we create in this pass
+    new_commit_recs = []
+
+    # Some commits, like merges, may not have any files, and, therefore,
+    # no lines_added / lines_deleted information associated with them. We
+    # currently only generate CommitRec data for commits that do have
+    # files. This could change later...
+
+    if files:
+        # The message lines can be handled as a group.
+        commit_rec.parse_msg(msgs, defect_commits)
+
+        # Extract the information from the first (and perhaps only) file
+        # line and initialize the list of CommitRec objects with this one
+        # as the first element
+        commit_rec.parse_file(files[0])
+        new_commit_recs.append(commit_rec)
+
+        # Loop through the remaining lines, if there are any to parse 
+        # additional file lines related to this commit
+        # We just took care of position 0, above
+        idx = 1
+        while idx < len(files):
+            # clone commit_rec, add the information from the next line, and
+            # finally, add the nxt_file object to the list of commit_rec(s)
+            nxt_file = commit_rec.clone()
+            nxt_file.parse_file(files[idx])
+            new_commit_recs.append(nxt_file)
+            idx += 1
+    
+    return new_commit_recs
+
+
+def proc_commits( log
+                 ,commits
+                 ,repo_name
+                 ,repo_owner
+                 ,defect_commits=None
+                 ,log_filter=None
+                ):
     """Process the git log and extracts the information that we need.
 
     We process the log in chunks, each of which represents a single commit.
@@ -496,6 +903,9 @@ def proc_commits(log, commits, repo_name, repo_owner):
         repo_name - str containing the name of the repo that we're processing
         repo_owner - str specifying the owner of the GitHub (or other shared
                     system) repo
+        defect_commits - optional DefectCommits object, if not provided it
+                    is loaded from <repo_name>.dft
+        log_filter - optional LogFilter object, see parse_block()
     Returns:
         The list of CommitRec ojbects that were generated during processing
     """
@@ -508,93 +918,8 @@ def proc_commits(log, commits, repo_name, repo_owner):
     # this to "cheat" a bit, in cases where our heuristics for determing which
     # commits relate to defects is less than completely effective, perhaps
     # due to insufficient information in the log
-    defect_commits = DefectCommits(repo_name+".dft")
-
-    def parse_block(lines):
-        """Parses a block from the git log that represents a single commit.
-
-        The caller has chopped up the log into blocks of lines that each
-        represents a single commit. A commit will have the SHA-1, the Author,
-        the time, the commit message, the files involved and the number of
-        lines added/deleted for each file.
-
-        This function creates the CommitRec(s - plural if the commit involved
-        more than one file, we'll create a separate CommitRec object for each
-        file). Then uses the CommitRec object's functions to actually parse,
-        and store the information we're extracting.
-
-        Args:
-            lines - list of strings each of which represents a line from
-                    the git log
-        Returns:
-            List of the CommitRec object(s) - one for each file involved in
-            the commit.
-        """
-        # Initialize the first CommitRec object
-        commit_rec = CommitRec(repo_name, repo_owner)
-
-        # Parse the block of lines to extract the commit SHA-1, since this
-        # is a block of commits, the record should be the first one in
-        # the block
-        commit_rec.parse_commit(lines[0])
-        # For author & timestamp, we can't rely on a fixed offset,
-        # so the parse functions take most of the block
-        commit_rec.parse_author(lines[1:])
-        ts_idx = commit_rec.parse_timestamp(lines[1:])
-
-        # The number of lines in the commit message and file segments of
-        # the commit block are variable, so we can't use fixed offsets, 
-        # other than the start of the commit message segment.  However,
-        # since we know that the rest of the block only contains commit
-        # message text, blank lines and file information, we walk through
-        # the rest of the block and group everything into two buckets:
-        #   msgs - holds commit messages and blan lines
-        #   files - holds the text that identifies files and the number of
-        #           lines changed in each
-        msgs = []
-        files = []
-        # We slice the block of commit log entries so that we're only
-        # dealing with the sections that contain either commit messages, or
-        # file data
-        #for l in lines[(ts_idx+1):len(lines)]:
-        for l in lines[(ts_idx+1):]:
-            if CommitRec.is_file_line(l):
-                files.append(l)
-            else:
-                msgs.append(l)
-
-        # Will hold the new CommitRec objects that we create in this pass
-        new_commit_recs = []
-
-        # Some commits, like merges, may not have any files, and, therefore,
-        # no lines_added / lines_deleted information associated with them. We
-        # currently only generate CommitRec data for commits that do have
-        # files. This could change later...
-
-        if files:
-            # The message lines can be handled as a group.
-            commit_rec.parse_msg(msgs, defect_commits)
-
-            # Extract the information from the first (and perhaps only) file
-            # line and initialize the list of CommitRec objects with this one
-            # as the first element
-            commit_rec.parse_file(files[0])
-            new_commit_recs.append(commit_rec)
-
-            # Loop through the remaining lines, if there are any to parse 
-            # additional file lines related to this commit
-            # We just took care of position 0, above
-            idx = 1
-            while idx < len(files):
-                # clone commit_rec, add the information from the next line, and
-                # finally, add the nxt_file object to the list of commit_rec(s)
-                nxt_file = commit_rec.clone()
-                nxt_file.parse_file(files[idx])
-                new_commit_recs.append(nxt_file)
-                idx += 1
-        
-        return new_commit_recs
-    # end of parse_block()
+    if defect_commits is None:
+        defect_commits = DefectCommits(repo_name+".dft")
 
     # Using the locations of the commit lines that we received as an argument,
     # We extract slices of the list that go from the location of each commit
@@ -603,13 +928,1146 @@ def proc_commits(log, commits, repo_name, repo_owner):
     # Then we parse each slice, and, finally, extend the list of CommitRec
     # objects by the list returned from parse_block()
     for i in range(0,len(commits)-1):
-        new_recs = parse_block(log[commits[i]:commits[i+1]])
+        new_recs = parse_block( log[commits[i]:commits[i+1]]
+                               ,repo_name
+                               ,repo_owner
+                               ,defect_commits
+                               ,log_filter
+                              )
         commit_recs.extend(new_recs)
 
     return commit_recs
 
 
-def process_commits(repo_path, repo_owner):
+def popen_git(cmd, input=None):
+    """Starts a git command whose output will be read from a pipe
+
+    Args:
+        cmd - list of strs containing the git command and its arguments
+        input - optional bytes to write to the command's standard input.
+                    The commands we use with input (git log --stdin, for
+                    example) read all of it before producing any output, so
+                    it is written up front without risk of deadlock
+    Returns:
+        The subprocess.Popen object for the running command
+    """
+    stdin = None if input is None else subprocess.PIPE
+    proc = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE)
+    if input is not None:
+        proc.stdin.write(input)
+        proc.stdin.close()
+    return proc
+
+
+def read_lines(cmd, input=None):
+    """Generator that reads the raw output of a git command one line at a
+    time
+
+    If git reports a failure, we raise the same exception that
+    subprocess.check_output() would have raised.
+
+    Args:
+        cmd - list of strs containing the git command and its arguments
+        input - optional bytes to write to the command's standard input
+    Yields:
+        bytes objects, each holding the next line, with its terminator
+    """
+    with popen_git(cmd, input) as proc:
+        for raw in proc.stdout:
+            yield raw
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def decode_lines(raw_lines):
+    """Generator that decodes the lines read by read_lines()
+
+    Args:
+        raw_lines - iterable of bytes objects, each holding a line
+    Yields:
+        Each line as a str, without the line terminator
+    """
+    for raw in raw_lines:
+        for l in raw.decode("utf-8").splitlines():
+            yield l
+
+
+def read_log(cmd, input=None):
+    """Reads the output of a git command incrementally
+
+    Rather than collecting the complete output of the command before
+    processing it, we read the subprocess pipe one line at a time, so only
+    the line currently being handled has to be held in memory. The lines
+    are split exactly as str.splitlines() would split the complete output.
+
+    Args:
+        cmd - list of strs containing the git command and its arguments
+        input - optional bytes to write to the command's standard input
+    Returns:
+        A generator that produces each line of the output, without the line
+        terminator
+    """
+    return decode_lines(read_lines(cmd, input))
+
+
+def iter_blocks(log):
+    """Generator that groups the lines of a git log into commit blocks
+
+    This is the streaming equivalent of find_commits(): a new block starts
+    at each "commit SHA-1" line and runs up to, but not including, the next
+    one. Lines that appear before the first commit line are discarded.
+
+    Args:
+        log - iterable of strs that produces the lines of the git log
+    Yields:
+        Lists of strs, each of which holds the lines of a single commit block
+    """
+    block = None
+    for l in log:
+        if CommitRec.is_commit_line(l):
+            if block is not None:
+                yield block
+            block = [l]
+        elif block is not None:
+            block.append(l)
+    if block is not None:
+        yield block
+
+
+def stream_commits(log, repo_name, repo_owner, defect_commits=None):
+    """Generator version of proc_commits() that works on a stream of lines
+
+    Each commit block is handed to parse_block() as soon as the line that
+    starts the next block arrives, so the memory needed for the log itself
+    is bounded by the largest single commit, not the history of the repo.
+
+    Args:
+        log - iterable of strs that produces the lines of the git log,
+                    generally the generator returned by read_log()
+        repo_name - str containing the name of the repo that we're processing
+        repo_owner - str specifying the owner of the GitHub (or other shared
+                    system) repo
+        defect_commits - optional DefectCommits object, if not provided it
+                    is loaded from <repo_name>.dft
+    Returns:
+        A generator that produces the CommitRec objects, in log order, one
+        for each file involved in each commit
+    """
+    if defect_commits is None:
+        defect_commits = DefectCommits(repo_name+".dft")
+    return parse_blocks(iter_blocks(log), repo_name, repo_owner,
+                        defect_commits)
+
+
+def parse_blocks( blocks
+                 ,repo_name
+                 ,repo_owner
+                 ,defect_commits
+                 ,log_filter=None
+                ):
+    """Generator that parses a stream of commit blocks into CommitRecs
+
+    Args:
+        blocks - iterable of lists of strs, each holding the lines of a
+                    single commit block, generally from iter_blocks()
+        repo_name - str containing the name of the repo that we're processing
+        repo_owner - str specifying the owner of the GitHub (or other shared
+                    system) repo
+        defect_commits - DefectCommits object
+        log_filter - optional LogFilter object, see parse_block()
+    Yields:
+        The CommitRec objects, in log order
+    """
+    for block in blocks:
+        for rec in parse_block(block, repo_name, repo_owner, defect_commits,
+                               log_filter):
+            yield rec
+
+
+# The characters that git strips from the ends of the message lines
+_GIT_SPACE = " \t\n\v\f\r"
+
+
+def log_msg_lines(msg):
+    """Splits a raw commit message (%B) into the lines that git log shows
+    for it, so the rules see the same text whichever engine parsed the log
+
+    git indents each line by four spaces, strips the whitespace at its end
+    and expands its tabs, and drops the blank lines at either end of the
+    message. The lines are then split the way decode_lines() splits the
+    log output.
+
+    Args:
+        msg - str with the raw commit message
+    Returns:
+        List of str with the message lines, as parse_block() collects them
+    """
+    lines = [l.rstrip(_GIT_SPACE) for l in msg.split("\n")]
+    while lines and not lines[0]:
+        lines.pop(0)
+    while lines and not lines[-1]:
+        lines.pop()
+    msg_lines = []
+    for l in lines:
+        msg_lines.extend(("    " + l.expandtabs(8)).splitlines())
+    return msg_lines
+
+
+class LogCommit(object):
+    """Holds the data for a single commit, as extracted by MachineLogParser
+
+    Unlike CommitRec, which represents one file touched by a commit, this
+    object represents the whole commit, with the per-file changes collected
+    in a list.
+
+    Attributes:
+        commit - SHA-1 of the commit
+        author - email address of the person responsible for the commit
+        timestamp - time of the commit, computed the same way as
+                CommitRec.parse_timestamp() does
+        utc_offset - int with the timezone offset of the commit, in seconds,
+                timestamp - utc_offset is the time since the epoch
+        msg - str with the raw commit message
+        files - list of (file, lines_added, lines_deleted) tuples, one for
+                each file involved in the commit
+    """
+    __slots__ = [ "commit"
+                 ,"author"
+                 ,"timestamp"
+                 ,"utc_offset"
+                 ,"msg"
+                 ,"files"
+                ]
+
+    def __init__(self, commit):
+        self.commit     = commit
+        self.author     = None
+        self.timestamp  = 0
+        self.utc_offset = 0
+        self.msg        = ""
+        self.files      = []
+
+    def to_commit_recs(self, repo_name, repo_owner, defect_commits):
+        """Creates the CommitRec objects for this commit
+
+        Matches the behaviour of parse_block(), so commits without any
+        files (merges, for example) produce no records.
+
+        Args:
+            repo_name - str containing the name of the repo
+            repo_owner - str specifying the owner of the GitHub (or other
+                    shared system) repo
+            defect_commits - DefectCommits object holding the commits that
+                    the user has told us are associated with defect fixes
+        Returns:
+            List of CommitRec objects, one for each file in the commit
+        """
+        if not self.files:
+            return []
+        commit_rec = CommitRec( repo_name
+                               ,repo_owner
+                               ,self.timestamp
+                               ,self.commit
+                               ,author=self.author
+                              )
+        commit_rec.parse_msg(log_msg_lines(self.msg), defect_commits)
+        is_defect = commit_rec.is_defect
+        return [CommitRec( repo_name
+                          ,repo_owner
+                          ,self.timestamp
+                          ,self.commit
+                          ,f
+                          ,added
+                          ,deleted
+                          ,self.author
+                          ,is_defect
+                         ) for f, added, deleted in self.files]
+
+
+class MachineLogParser(object):
+    """Single pass parser for git log output in the MACHINE_LOG_FMT format
+
+    The log is requested with NUL separated fields (see MACHINE_LOG_ARGS),
+    so it can be split into tokens on NUL bytes and each token interpreted
+    from its position, without any regular expressions. For every commit
+    the tokens are:
+
+        <empty> SHA-1 email date message [numstat entry ...] <empty>
+
+    where date is in git's "raw" format (seconds since the epoch followed by
+    the timezone offset) and each numstat entry is "added<TAB>deleted<TAB>
+    path". For renames the path is empty and the old and new pathnames
+    follow as two separate tokens. Binary files report "-" for the counts.
+
+    Data is pushed into the parser in arbitrary sized chunks with feed(),
+    which makes it equally usable with blocking and asynchronous pipes.
+
+    Attributes:
+        commits - list of the LogCommit objects completed so far, the caller
+                is expected to drain this list as it sees fit
+    """
+    __slots__ = [ "commits"
+                 ,"_tail"
+                 ,"_state"
+                 ,"_cur"
+                 ,"_counts"
+                ]
+
+    # Parser states, named for the token that is expected next
+    _SHA, _AUTHOR, _DATE, _MSG, _FILES, _OLD_PATH, _NEW_PATH = range(7)
+
+    def __init__(self):
+        self.commits = []
+        self._tail = b""
+        self._state = self._SHA
+        self._cur = None
+        self._counts = None
+
+    def feed(self, data):
+        """Adds a chunk of raw log output to the parser
+
+        Args:
+            data - bytes read from the git log subprocess
+        Returns:
+            The list of LogCommit objects completed so far
+        """
+        toks = (self._tail + data).split(b"\0")
+        # The last piece may be incomplete, keep it for the next chunk
+        self._tail = toks.pop()
+        for tok in toks:
+            self._token(tok.decode("utf-8"))
+        return self.commits
+
+    def close(self):
+        """Signals the end of the log and completes the final commit
+
+        Returns:
+            The list of LogCommit objects completed so far
+        """
+        if self._tail:
+            self._token(self._tail.decode("utf-8"))
+            self._tail = b""
+        if self._state not in (self._SHA, self._FILES):
+            self._fail("Truncated commit in machine format log", self._cur)
+        self._finish()
+        return self.commits
+
+    def _finish(self):
+        """Moves the commit being assembled to the list of completed ones"""
+        if self._cur is not None:
+            self.commits.append(self._cur)
+            self._cur = None
+        self._state = self._SHA
+
+    def _token(self, tok):
+        """Interprets a single token according to the current state
+
+        Args:
+            tok - str with the text between two NUL separators
+        """
+        state = self._state
+        if state == self._FILES:
+            if not tok:
+                # Separators between commits
+                return
+            if "\t" not in tok:
+                # Only numstat entries contain tabs, so this is the SHA-1
+                # that starts the next commit
+                self._finish()
+                state = self._SHA
+            else:
+                # The first entry follows the newline that git places after
+                # the formatted header
+                added, deleted, path = tok.lstrip("\n").split("\t", 2)
+                # Binary files don't have line counts
+                counts = ( int(added) if added != "-" else 0
+                          ,int(deleted) if deleted != "-" else 0
+                         )
+                if path:
+                    self._cur.files.append((path,) + counts)
+                else:
+                    self._counts = counts
+                    self._state = self._OLD_PATH
+                return
+        if state == self._SHA:
+            if not tok:
+                return
+            if len(tok) != 40:
+                self._fail("Unable to extract commit info from", tok)
+            self._cur = LogCommit(tok)
+            self._state = self._AUTHOR
+        elif state == self._AUTHOR:
+            self._cur.author = tok
+            self._state = self._DATE
+        elif state == self._DATE:
+            secs, tz = tok.split(" ")
+            # Like CommitRec.parse_timestamp(), the local time of the commit
+            # is treated as if it were UTC
+            self._cur.utc_offset = utc_offset(tz)
+            self._cur.timestamp = float(int(secs) + self._cur.utc_offset)
+            self._state = self._MSG
+        elif state == self._MSG:
+            self._cur.msg = tok
+            self._state = self._FILES
+        elif state == self._OLD_PATH:
+            # We report renamed files under their new name
+            self._state = self._NEW_PATH
+        elif state == self._NEW_PATH:
+            self._cur.files.append((tok,) + self._counts)
+            self._state = self._FILES
+
+    def _fail(self, msg, data):
+        """Generates a fatal error message and exits
+
+        Args:
+            msg - str with the message that explains the failure
+            data - the token, or partial commit, where the failure occurred
+        """
+        fstr = "{0}{1}: '{2}'\n"
+        sys.stderr.write(fstr.format(FATAL_LBL, msg, data))
+        sys.exit(EXIT_FAILURE)
+
+
+def read_chunks(cmd, input=None):
+    """Generator that reads the raw output of a git command incrementally
+
+    Args:
+        cmd - list of strs containing the git command and its arguments
+        input - optional bytes to write to the command's standard input
+    Yields:
+        bytes objects, each holding the next chunk of output
+    """
+    with popen_git(cmd, input) as proc:
+        for chunk in iter(lambda: proc.stdout.read(READ_CHUNK), b""):
+            yield chunk
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def stream_log_commits(chunks):
+    """Generator that parses machine format log output into LogCommits
+
+    Args:
+        chunks - iterable of bytes objects with the output of git log run
+                with MACHINE_LOG_ARGS, generally from read_chunks()
+    Yields:
+        The LogCommit objects, in log order
+    """
+    parser = MachineLogParser()
+    for chunk in chunks:
+        commits = parser.feed(chunk)
+        if commits:
+            for c in commits:
+                yield c
+            del commits[:]
+    for c in parser.close():
+        yield c
+
+
+def stream_machine_commits( chunks
+                           ,repo_name
+                           ,repo_owner
+                           ,defect_commits=None
+                           ,log_filter=None
+                          ):
+    """Machine format counterpart of stream_commits()
+
+    Args:
+        chunks - iterable of bytes objects with the output of git log run
+                with MACHINE_LOG_ARGS, generally from read_chunks()
+        repo_name - str containing the name of the repo that we're processing
+        repo_owner - str specifying the owner of the GitHub (or other shared
+                    system) repo
+        defect_commits - optional DefectCommits object, if not provided it
+                    is loaded from <repo_name>.dft
+        log_filter - optional LogFilter object, commits whose author date
+                    falls outside its date range produce no records
+    Yields:
+        The CommitRec objects, in log order, one for each file involved in
+        each commit
+    """
+    if defect_commits is None:
+        defect_commits = DefectCommits(repo_name+".dft")
+    for c in stream_log_commits(chunks):
+        if (log_filter is not None and
+                not log_filter.keep(c.timestamp - c.utc_offset)):
+            continue
+        for rec in c.to_commit_recs(repo_name, repo_owner, defect_commits):
+            yield rec
+
+
+def _phase(profile, name):
+    """Context manager that charges its body to a phase of the profile, see
+    profiler.py, or does nothing if profile is None
+    """
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.phase(name)
+
+
+def _timed(profile, name, iterable):
+    """Charges the production of the items of an iterable to a phase of the
+    profile, or returns the iterable as is if profile is None
+    """
+    if profile is None:
+        return iterable
+    return profile.iterate(name, iterable)
+
+
+def iter_commit_recs( cmd_root
+                     ,repo_name
+                     ,repo_owner
+                     ,engine
+                     ,stream
+                     ,revs=None
+                     ,defect_commits=None
+                     ,input=None
+                     ,profile=None
+                     ,log_filter=None
+                    ):
+    """Runs git log on the repo and parses the output into CommitRecs
+
+    Except for the buffered "regex" engine, the records are produced as the
+    log is read, so the caller decides how (and whether) to keep them.
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                    targets the repo
+        repo_name - str containing the name of the repo that we're processing
+        repo_owner - str specifying the owner of the GitHub (or other shared
+                    system) repo
+        engine - str selecting the log format and parser, "machine" or
+                    "regex"
+        stream - bool, whether the "regex" engine parses the log as it is
+                    read, rather than buffering it
+        revs - optional list of strs with the revisions (or revision ranges)
+                    for git log to walk, defaults to HEAD
+        defect_commits - optional DefectCommits object, if not provided it
+                    is loaded from <repo_name>.dft
+        input - optional bytes to pass to git log on its standard input, for
+                    use with "--stdin" in revs
+        profile - optional profiler.RunProfile object, which is charged with
+                    the time taken by each phase of the extraction
+        log_filter - optional LogFilter object that limits the commits and
+                    files extracted
+    Returns:
+        An iterable of the CommitRec objects, in log order
+    """
+    revs = revs if revs else []
+    if defect_commits is None:
+        defect_commits = DefectCommits(repo_name+".dft")
+    if log_filter is not None:
+        revs = log_filter.args(revs)
+    if engine == "machine":
+        # Ask git for delimited fields, which are parsed as they arrive
+        cmd = cmd_root + MACHINE_LOG_ARGS + revs
+        chunks = _timed(profile, "git_log", read_chunks(cmd, input))
+        commit_files = stream_machine_commits( chunks
+                                              ,repo_name
+                                              ,repo_owner
+                                              ,defect_commits
+                                              ,log_filter
+                                             )
+        commit_files = _timed(profile, "parse", commit_files)
+    elif engine == "regex":
+        # The information that we deal with all comes from git log --numstat
+        cmd = cmd_root + ["log", "--numstat"] + revs
+        if stream:
+            # Each commit block is parsed as soon as it has been read, so
+            # only the CommitRec objects are retained, not the text of the log
+            log = _timed(profile, "git_log", read_lines(cmd, input))
+            log = _timed(profile, "decode", decode_lines(log))
+            blocks = _timed(profile, "find_commits", iter_blocks(log))
+            commit_files = parse_blocks( blocks
+                                        ,repo_name
+                                        ,repo_owner
+                                        ,defect_commits
+                                        ,log_filter
+                                       )
+            commit_files = _timed(profile, "parse", commit_files)
+        else:
+            with _phase(profile, "git_log"):
+                log = subprocess.check_output(cmd, input=input)
+            with _phase(profile, "decode"):
+                log = log.decode("utf-8").splitlines()
+
+            # Get indices into the returned log for the start of each commit
+            # block
+            with _phase(profile, "find_commits"):
+                commits = find_commits(log)
+            # Add a dummy entry at the end that is one element beyond the end
+            # of the log. We'll use this as an upper bound for processing
+            commits.append(len(log)+1)
+
+            # Does the actual processing of the log and generates a list of
+            # "CommitRec" objects, each of which represents a file involved
+            # in a commit.
+            with _phase(profile, "parse"):
+                commit_files = proc_commits( log
+                                            ,commits
+                                            ,repo_name
+                                            ,repo_owner
+                                            ,defect_commits
+                                            ,log_filter
+                                           )
+    else:
+        raise ValueError("Unknown log engine: '{0}'".format(engine))
+    return commit_files
+
+
+def extract_commits( cmd_root
+                    ,repo_name
+                    ,repo_owner
+                    ,engine
+                    ,stream
+                    ,revs=None
+                    ,defect_commits=None
+                    ,input=None
+                    ,compact=False
+                    ,profile=None
+                    ,log_filter=None
+                   ):
+    """Runs git log on the repo and collects the resulting CommitRecs
+
+    Args:
+        compact - bool, if True the records are collected in a CommitStore,
+                    rather than a list
+        The remaining arguments are the same as for iter_commit_recs()
+    Returns:
+        The list, or CommitStore, of CommitRec objects, in log order
+    """
+    recs = iter_commit_recs( cmd_root
+                            ,repo_name
+                            ,repo_owner
+                            ,engine
+                            ,stream
+                            ,revs
+                            ,defect_commits
+                            ,input
+                            ,profile
+                            ,log_filter
+                           )
+    with _phase(profile, "store"):
+        if not compact:
+            return list(recs)
+        from check_commits.commit_store import CommitStore
+        store = CommitStore(repo_name, repo_owner)
+        store.extend(recs)
+    return store
+
+
+def _extract_shard(args):
+    """Process pool worker that extracts the records for one shard
+
+    The shard is a list of commits, which git log shows in the order given
+    (rather than walking history) because of --no-walk=unsorted.
+
+    Args:
+        args - tuple of the arguments for extract_commits(), except that
+                    the list of commit SHA-1's that make up the shard takes
+                    the place of revs, followed by a bool that is True when
+                    the run is profiled and the LogFilter (or None)
+    Returns:
+        Tuple of a CommitStore with the records for the commits in the shard,
+        which is much cheaper to send back to the parent than a list of
+        CommitRecs, the worker's classifier (or None), carrying the counters
+        for the shard, and the worker's profiler.RunProfile (or None)
+    """
+    (cmd_root, repo_name, repo_owner, engine, stream, defect_commits, shas,
+     profiled, log_filter) = args
+    profile = None
+    if profiled:
+        from check_commits.profiler import RunProfile
+        profile = RunProfile()
+    store = extract_commits( cmd_root
+                           ,repo_name
+                           ,repo_owner
+                           ,engine
+                           ,stream
+                           ,["--no-walk=unsorted", "--stdin"]
+                           ,defect_commits
+                           ,''.join(c + "\n" for c in shas).encode("ascii")
+                           ,True
+                           ,profile
+                           ,log_filter
+                          )
+    return (store, defect_commits.classifier, profile)
+
+
+def extract_parallel( cmd_root
+                     ,repo_name
+                     ,repo_owner
+                     ,engine
+                     ,stream=True
+                     ,revs=None
+                     ,jobs=0
+                     ,defect_commits=None
+                     ,compact=False
+                     ,shas=None
+                     ,profile=None
+                     ,log_filter=None
+                    ):
+    """Parallel version of extract_commits()
+
+    The commits that git log would walk are listed with git rev-list, which
+    uses the same ordering, and split into contiguous shards. Each shard is
+    extracted and parsed by its own git log in a pool of worker processes.
+    The results are then concatenated in shard order, so the records come
+    out in exactly the same order as they would from extract_commits().
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                    targets the repo
+        repo_name - str containing the name of the repo that we're processing
+        repo_owner - str specifying the owner of the GitHub (or other shared
+                    system) repo
+        engine - str selecting the log format and parser, "machine" or
+                    "regex"
+        stream - bool, whether the "regex" engine parses the log of each
+                    shard as it is read, rather than buffering it
+        revs - optional list of strs with the revisions (or revision ranges)
+                    to walk, defaults to HEAD
+        jobs - int with the number of worker processes, 0 selects the number
+                    of CPU cores
+        defect_commits - optional DefectCommits object, if not provided it
+                    is loaded from <repo_name>.dft
+        compact - bool, if True the records are collected in a CommitStore,
+                    rather than a list
+        shas - optional list of strs with the SHA-1's of the commits to
+                    extract, in order, in place of those listed from revs
+        profile - optional profiler.RunProfile object, which is charged with
+                    the time taken by each phase. The phases of the worker
+                    processes are added to its worker_phases
+        log_filter - optional LogFilter object that limits the commits and
+                    files extracted
+    Returns:
+        The list, or CommitStore, of CommitRec objects, in log order
+    """
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    input = None
+    if shas is None:
+        revs = revs if revs else ["HEAD"]
+        cmd = cmd_root + ["rev-list"]
+        cmd += log_filter.args(revs) if log_filter is not None else revs
+        shas = subprocess.check_output(cmd).decode("ascii").split()
+    else:
+        revs = ["--no-walk=unsorted", "--stdin"]
+        input = ''.join(c + "\n" for c in shas).encode("ascii")
+
+    # Aim for a few shards per worker, so one slow shard doesn't leave the
+    # others idle, but don't bother splitting small histories
+    n_shards = min(jobs * SHARDS_PER_JOB, len(shas) // MIN_SHARD_COMMITS)
+    # Load the user's defect commits once, rather than in every worker
+    if defect_commits is None:
+        defect_commits = DefectCommits(repo_name+".dft")
+    if jobs == 1 or n_shards < 2:
+        return extract_commits( cmd_root
+                               ,repo_name
+                               ,repo_owner
+                               ,engine
+                               ,stream
+                               ,revs
+                               ,defect_commits
+                               ,input
+                               ,compact
+                               ,profile
+                               ,log_filter
+                              )
+
+    size = -(-len(shas) // n_shards)
+    shards = [( cmd_root
+               ,repo_name
+               ,repo_owner
+               ,engine
+               ,stream
+               ,defect_commits
+               ,shas[i:i+size]
+               ,profile is not None
+               ,log_filter
+              ) for i in range(0, len(shas), size)]
+    if compact:
+        from check_commits.commit_store import CommitStore
+        commit_files = CommitStore(repo_name, repo_owner)
+    else:
+        commit_files = []
+    with _phase(profile, "extract_parallel"), \
+         concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        # map() hands back the results in the order of the shards
+        for store, classifier, shard_profile in pool.map(_extract_shard,
+                                                         shards):
+            if classifier is not None:
+                defect_commits.classifier.merge_stats(classifier)
+            if shard_profile is not None:
+                profile.merge_workers(shard_profile)
+            if compact:
+                commit_files.merge(store)
+            else:
+                commit_files.extend(store)
+    return commit_files
+
+
+def output_path(out_dir, repo_name, suffix):
+    """Builds the pathname of one of the output files for a repo
+
+    Args:
+        out_dir - str with the directory that receives the outputs
+        repo_name - str containing the name of the repo
+        suffix - str appended to the repo name, including any extension
+    Returns:
+        str with the pathname
+    """
+    return os.path.join(out_dir, repo_name + suffix)
+
+
+def write_outputs( commit_files
+                  ,repo_name
+                  ,append=False
+                  ,out_dir="."
+                  ,json_format=None
+                  ,columnar=None
+                  ,sqlite=None
+                  ,rollups=None
+                  ,compress=None
+                  ,compress_level=None
+                  ,compress_buffer=None
+                  ,partition=None
+                  ,sort_by=None
+                  ,memory_limit=None
+                  ,repo_owner=None
+                 ):
+    """Generates the JSON and, optionally, the CSV and text output files
+
+    The records are serialized as they are retrieved, and every output file
+    is written in the same pass, so commit_files may be a generator that
+    produces the records while the log is being parsed.
+
+    When appending, the records are added to the end of the files written
+    by an earlier run, without rewriting their existing contents. The JSON
+    array is extended in place by overwriting its closing bracket (or, when
+    compressed, by dropping the stream that holds it).
+
+    Args:
+        commit_files - iterable of the CommitRec objects to write
+        repo_name - str containing the name of the repo, used to name the
+                    output files
+        append - bool, if True, add the records to existing output files
+        out_dir - str with the directory that receives the output files
+        json_format - str, "array" writes <repo_name>.json holding a JSON
+                    array, "ndjson" writes <repo_name>.ndjson, with one JSON
+                    object per line. Defaults to the value of JSON_FORMAT
+        columnar - bool, if True, also write <repo_name>.ccol, a binary
+                    column oriented file, see check_commits/columnar.py.
+                    Defaults to the value of GEN_COLUMNAR
+        sqlite - str with the pathname of an SQLite database to load the
+                    records into, see check_commits/sqlite_sink.py. "" selects
+                    <repo_name>.sqlite. Defaults to the value of SQLITE_DB,
+                    if None, no database is loaded
+        rollups - bool, if True, also write the rollups by file, directory,
+                    author, day, week and month, see check_commits/rollups.py.
+                    Defaults to the value of GEN_ROLLUPS
+        compress - str with the codec that compresses the JSON, CSV and
+                    text outputs, "gzip", "bz2" or "lzma", whose extension
+                    is added to their names. Defaults to the value of
+                    COMPRESS, if None, they're not compressed
+        compress_level - int with the compression level, defaults to the
+                    codec's entry in compress.DEFAULT_LEVELS
+        compress_buffer - int with the number of bytes handed to the
+                    compression thread at a time, defaults to the value of
+                    compress.BUFFER_SIZE
+        partition - str or int, split the JSON, CSV and text outputs into
+                    partitions, by "day", "week", "month" or "year", or of
+                    that number of records, in <repo_name>-parts/, listed in
+                    <repo_name>-manifest.json, see partitions.py. Defaults
+                    to the value of PARTITION, if None, single files are
+                    written
+        sort_by - str, "file" or "timestamp", order the JSON, CSV and text
+                    outputs by the field, see external_sort.py. Defaults to
+                    the value of SORT_BY, if None, they're in log order
+        memory_limit - int with the estimated size, in bytes, of the records
+                    held in memory while sorting, above which they're
+                    spilled to temporary files. Defaults to the value of
+                    external_sort.MEMORY_LIMIT
+        repo_owner - str specifying the owner of the repo, which, with
+                    repo_name, identifies it in the SQLite database. Only
+                    used when loading one
+    Returns:
+        The number of records written
+    """
+    from check_commits import writers
+
+    if json_format is None:
+        json_format = JSON_FORMAT
+    if columnar is None:
+        columnar = GEN_COLUMNAR
+    if sqlite is None:
+        sqlite = SQLITE_DB
+    if rollups is None:
+        rollups = GEN_ROLLUPS
+    if compress is None:
+        compress = COMPRESS
+    compression = None
+    ext = ""
+    if compress is not None:
+        from check_commits.compress import Compression
+        compression = Compression(compress, compress_level, compress_buffer)
+        ext = compression.ext
+    if partition is None:
+        partition = PARTITION
+    if sort_by is None:
+        sort_by = SORT_BY
+
+    # The formats of the JSON, CSV and text outputs, their extensions and
+    # sinks
+    formats = []
+    if json_format == "ndjson":
+        formats.append(("ndjson", ".ndjson" + ext, writers.NdjsonSink))
+    elif json_format == "array":
+        formats.append(("json", ".json" + ext, writers.JsonArraySink))
+    else:
+        raise ValueError("Unknown JSON format: '{0}'".format(json_format))
+    if GEN_CSV:
+        formats.append(("csv", ".csv" + ext, writers.CsvSink))
+    # The text representation of the CommitRec dictionaries
+    if GEN_TEXT:
+        formats.append(("text", "-commit-recs.txt" + ext, writers.TextSink))
+
+    sinks = []
+    try:
+        # Generate the JSON and, optionally, the CSV and text, either
+        # partitioned, or in single files
+        if partition is not None:
+            from check_commits.partitions import PartitionSink
+            sinks.append(PartitionSink(out_dir, repo_name, partition,
+                                       formats, append, compression))
+        else:
+            for fmt, suffix, sink_class in formats:
+                path = output_path(out_dir, repo_name, suffix)
+                sinks.append(sink_class(path, append, compression))
+
+        # Optionally, sort the records of those outputs
+        if sort_by is not None:
+            from check_commits.external_sort import SortSink
+            sinks = [SortSink(sinks, sort_by, memory_limit)]
+
+        # Optionally, generate the columnar file for analytics
+        if columnar:
+            from check_commits.columnar import ColumnarSink
+            path = output_path(out_dir, repo_name, ".ccol")
+            sinks.append(ColumnarSink(path, append))
+
+        # Optionally, load the records into a database for querying
+        if sqlite is not None:
+            from check_commits.sqlite_sink import SqliteSink
+            path = sqlite if sqlite else output_path(out_dir, repo_name,
+                                                     ".sqlite")
+            sinks.append(SqliteSink(path, repo_name, repo_owner, append))
+
+        # Optionally, aggregate the records for dashboards
+        if rollups:
+            from check_commits.rollups import RollupSink
+            sinks.append(RollupSink(out_dir, repo_name, append))
+    except:
+        for sink in sinks:
+            sink.close()
+        raise
+
+    return writers.write_records(commit_files, sinks)
+
+
+def git_ref_tips(cmd_root):
+    """Retrieves the current tip of HEAD and of every ref in the repo
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                    targets the repo
+    Returns:
+        Tuple of the SHA-1 that HEAD resolves to, and a dictionary that maps
+        each ref name to the SHA-1 of its tip
+    """
+    cmd = cmd_root + ["rev-parse", "HEAD"]
+    head = subprocess.check_output(cmd).decode("utf-8").rstrip()
+    cmd = cmd_root + ["for-each-ref", "--format=%(objectname) %(refname)"]
+    refs = {}
+    for l in subprocess.check_output(cmd).decode("utf-8").splitlines():
+        sha, ref = l.split(" ", 1)
+        refs[ref] = sha
+    return head, refs
+
+
+def is_ancestor(cmd_root, old, new):
+    """Checks whether one commit is an ancestor of (or equal to) another
+
+    A commit that no longer exists in the repo, for example after a
+    force-push followed by garbage collection, is not an ancestor.
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                    targets the repo
+        old - str with the SHA-1 of the presumed ancestor
+        new - str with the SHA-1 of the presumed descendant
+    Returns:
+        True if old is reachable from new
+    """
+    cmd = cmd_root + ["merge-base", "--is-ancestor", old, new]
+    return subprocess.call(cmd, stderr=subprocess.DEVNULL) == 0
+
+
+class RunState(object):
+    """Records what a run processed, so the next run can be incremental
+
+    The state is kept in a small JSON file, next to the other outputs,
+    named:
+
+        <repo_name>.state
+
+    Attributes:
+        head - SHA-1 that HEAD resolved to when the run started
+        refs - dictionary mapping each ref name to the SHA-1 of its tip
+        settings - dictionary with the options that affect the content of
+                the outputs. If these change, earlier outputs can't be
+                extended and the next run has to rebuild them
+    """
+    __slots__ = ["head", "refs", "settings"]
+
+    def __init__(self, head, refs, settings):
+        self.head     = head
+        self.refs     = refs
+        self.settings = settings
+
+    def state_path(repo_name, out_dir="."):
+        """Pathname of the state file for the repo
+        NOTE: This is a class function, not an instance function, so no
+              "self" argument.
+        """
+        return output_path(out_dir, repo_name, ".state")
+
+    def load(repo_name, out_dir="."):
+        """Reads the state recorded by an earlier run
+        NOTE: This is a class function, not an instance function, so no
+              "self" argument.
+        Args:
+            repo_name - str containing the name of the repo
+            out_dir - str with the directory that holds the outputs
+        Returns:
+            A RunState object, or None if there is no usable state
+        """
+        try:
+            with open(RunState.state_path(repo_name, out_dir), 'r') as f:
+                od = json.load(f)
+            return RunState(od["head"], od["refs"], od["settings"])
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError):
+            sys.stdout.write(NOTE_LBL +
+                             "Ignoring unreadable incremental state file.\n"
+                            )
+        return None
+
+    def save(self, repo_name, out_dir="."):
+        """Writes the state, replacing any earlier state for the repo
+
+        Args:
+            repo_name - str containing the name of the repo
+            out_dir - str with the directory that holds the outputs
+        """
+        path = RunState.state_path(repo_name, out_dir)
+        with open(path + ".tmp", 'w') as f:
+            json.dump({ "head":self.head
+                       ,"refs":self.refs
+                       ,"settings":self.settings
+                      }, f, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+
+def write_profile( run_profile
+                  ,cmd_root
+                  ,revs
+                  ,repo_name
+                  ,out_dir
+                  ,cache
+                  ,options
+                  ,log_filter=None
+                 ):
+    """Completes the counters of a profiled run, then writes its stats
+
+    The commits that were walked, and the merges among them, are counted
+    with git rev-list, so the commits skipped for having no file changes
+    can be told from those that were written.
+
+    Args:
+        run_profile - the profiler.RunProfile object of the run
+        cmd_root - list of strs with the start of the git command that
+                    targets the repo
+        revs - list of strs with the revisions that were walked, HEAD if
+                    empty
+        repo_name - str containing the name of the repo
+        out_dir - str with the directory that receives the outputs
+        cache - the parse_cache.ParseCache object that was used, or None
+        options - dictionary with the options of the run, which are
+                    recorded with the stats
+        log_filter - optional LogFilter object that limited the commits
+    """
+    revs = revs if revs else ["HEAD"]
+    if log_filter is not None:
+        revs = log_filter.args(revs)
+    with run_profile.phase("count_commits"):
+        cmd = cmd_root + ["rev-list", "--count"]
+        walked = int(subprocess.check_output(cmd + revs))
+        merges = int(subprocess.check_output(cmd + ["--merges"] + revs))
+    run_profile.disable()
+    counters = run_profile.counters
+    counters["commits_walked"] = walked
+    counters["merge_commits"] = merges
+    counters["skipped_commits"] = walked - counters.get("commits", 0)
+    if cache is not None:
+        counters["cache_hits"] = cache.hits
+        counters["cache_misses"] = cache.misses
+
+    stats_path = output_path(out_dir, repo_name, "-profile.json")
+    pstats_path = None
+    if run_profile.cprofile is not None:
+        pstats_path = output_path(out_dir, repo_name, "-profile.pstats")
+    run_profile.write( stats_path
+                      ,pstats_path
+                      ,{"repo":repo_name, "options":options}
+                     )
+    sys.stdout.write(NOTE_LBL + "Profile written to " + stats_path + "\n")
+
+
+def process_commits( repo_path
+                    ,repo_owner
+                    ,stream=None
+                    ,engine=None
+                    ,incremental=False
+                    ,jobs=None
+                    ,out_dir="."
+                    ,defects_file=None
+                    ,compact=None
+                    ,json_format=None
+                    ,columnar=None
+                    ,classifier_config=None
+                    ,cache_dir=None
+                    ,cache_size=None
+                    ,sqlite=None
+                    ,rollups=None
+                    ,profile=None
+                    ,cprofile=None
+                    ,since=None
+                    ,until=None
+                    ,include=None
+                    ,exclude=None
+                    ,authors=None
+                    ,szz=None
+                    ,blame_jobs=None
+                    ,hunks=None
+                    ,compress=None
+                    ,compress_level=None
+                    ,compress_buffer=None
+                    ,partition=None
+                    ,sort_by=None
+                    ,memory_limit=None
+                    ,all_refs=None
+                   ):
     """Main function to process a Git repo
 
     Retrieves commit information from a Git repo. This function coordinates
@@ -618,56 +2076,498 @@ def process_commits(repo_path, repo_owner):
     whether the commit was intended to address a defect.  Finally, generates
     the desired output files
 
+    In incremental mode, the HEAD that was processed is recorded in a state
+    file (see RunState). When a state file from an earlier run exists, only
+    the commits added since then are extracted, and their records are
+    appended to the existing outputs. Note that this means the new records
+    follow the older ones, rather than preceding them as they would in a
+    complete run. If the recorded HEAD is no longer an ancestor of the
+    current HEAD (after a force-push, for example), or the options that
+    shape the outputs, or the defect commits file, have changed, the outputs
+    are rebuilt from scratch.
+
     Args:
         repo_path - str with the filesystem pathname to the repo that is to 
                     be processed
         repo_owner - str specifying the owner of the GitHub (or other shared
                     system) repo
+        stream - bool, if True, the git log is parsed as it is read from the
+                    subprocess, if False, the complete log is retrieved before
+                    parsing starts. Defaults to the value of STREAM_LOG. Only
+                    applies to the "regex" engine, the "machine" engine
+                    always streams
+        engine - str selecting the log format and parser, "machine" or
+                    "regex". Defaults to the value of LOG_ENGINE
+        incremental - bool, if True, only process the commits added since
+                    the last incremental run
+        jobs - int with the number of worker processes used to extract the
+                    log, 0 selects one per CPU core. Defaults to the value
+                    of JOBS. The output is the same for any number of jobs
+        out_dir - str with the directory that receives the output files,
+                    defaults to the current working directory
+        defects_file - str with the pathname of the file listing the commits
+                    that are known to fix defects, either text or an index
+                    (see sha_index.py). Defaults to <repo_name>.dfx, or if
+                    there is no such index, <repo_name>.dft, in the current
+                    working directory
+        compact - bool, if True the records are held in a CommitStore, which
+                    uses far less memory than a list of CommitRecs. Defaults
+                    to the value of COMPACT_STORE
+        json_format - str, "array" or "ndjson", selecting the form of the
+                    JSON output. Defaults to the value of JSON_FORMAT
+        columnar - bool, if True, also write the binary columnar file,
+                    <repo_name>.ccol. Defaults to the value of GEN_COLUMNAR
+        classifier_config - str with the pathname of a classifier config
+                    (see classifier.py) whose rules identify defect fixes
+                    from the commit messages, "" selects the default rules.
+                    The rule that fired for each defect commit, and the
+                    per-rule statistics, are written to
+                    <repo_name>-defect-rules.csv and
+                    <repo_name>-classifier.json (added to, in incremental
+                    runs). Defaults to the value of CLASSIFIER_CONFIG, if
+                    None, DEFECT_REGEX is used without collecting statistics
+        cache_dir - str with the directory that holds the parse cache,
+                    which keeps the records of every commit processed, so
+                    only commits that weren't processed before are extracted
+                    and parsed. Defaults to the value of CACHE_DIR, if None,
+                    the cache isn't used
+        cache_size - int with the size, in bytes, above which the least
+                    recently used cache entries are evicted. Defaults to the
+                    value of CACHE_MAX_BYTES
+        sqlite - str with the pathname of an SQLite database to also load
+                    the records into, which may hold other repos, "" selects
+                    <repo_name>.sqlite. Defaults to the value of SQLITE_DB
+        rollups - bool, if True, also write the churn and defect rollups,
+                    <repo_name>-rollup-*.csv. Defaults to the value of
+                    GEN_ROLLUPS
+        profile - bool, if True, write the wall time, CPU time and memory
+                    high-water mark of each phase of the run, along with
+                    counters of the commits and records, to
+                    <repo_name>-profile.json, see profiler.py. Defaults to
+                    the value of GEN_PROFILE
+        cprofile - bool, if True, also profile the run with cProfile, saving
+                    the results to <repo_name>-profile.pstats. Implies
+                    profile. Defaults to the value of GEN_CPROFILE
+        since - str with a date, in any format git accepts, only commits
+                    made on or after it are processed, see LogFilter
+        until - str with a date, only commits made on or before it are
+                    processed
+        include - list of strs with pathspecs, only the files that match
+                    one of them are processed
+        exclude - list of strs with pathspecs, the files that match one of
+                    them are not processed
+        authors - list of strs with regular expressions, only the commits
+                    whose author matches one of them are processed
+        szz - bool, if True, blame the lines that each defect commit deletes
+                    or modifies, and write the commits that introduced them
+                    to <repo_name>-szz.csv, see szz.py. Defaults to the value
+                    of GEN_SZZ
+        blame_jobs - int with the number of threads running git blame for
+                    szz, 0 selects one per CPU core. Defaults to the value
+                    of szz.BLAME_JOBS
+        hunks - bool, if True, also extract the patches of the commits, and
+                    write the line ranges, line counts and enclosing
+                    function of every hunk to <repo_name>-hunks.csv, see
+                    hunks.py. Defaults to the value of GEN_HUNKS
+        compress - str, "gzip", "bz2" or "lzma", compress the JSON, CSV and
+                    text outputs with the codec, in a background thread
+                    that runs while the log is parsed, adding the codec's
+                    extension to their names, see compress.py. Defaults to
+                    the value of COMPRESS, if None, they're not compressed
+        compress_level - int with the compression level, defaults to the
+                    codec's entry in compress.DEFAULT_LEVELS
+        compress_buffer - int with the number of bytes handed to the
+                    compression thread at a time. Defaults to the value of
+                    compress.BUFFER_SIZE
+        partition - str or int, split the JSON, CSV and text outputs into
+                    partitions, one per "day", "week", "month" or "year" of
+                    the commit timestamps, or of that number of records,
+                    written to <repo_name>-parts/ and listed, with their row
+                    counts, time ranges and sizes, in
+                    <repo_name>-manifest.json, see partitions.py. Defaults
+                    to the value of PARTITION, if None, single files are
+                    written
+        sort_by - str, "file" or "timestamp", order the records of the
+                    JSON, CSV and text outputs by file path, or from the
+                    oldest commit to the newest, rather than in log order.
+                    In incremental runs, the records that are appended are
+                    sorted among themselves. See external_sort.py. Defaults
+                    to the value of SORT_BY, if None, log order is kept
+        memory_limit - int with the estimated size, in bytes, of the records
+                    held in memory while sorting, above which sorted runs
+                    are spilled to temporary files and merged. Defaults to
+                    the value of external_sort.MEMORY_LIMIT
+        all_refs - bool, if True, walk the commits of all of the branches
+                    (the refs that match branches.REF_PATTERNS), rather than
+                    HEAD's, in a single pass, and write the refs that each
+                    commit is reachable from, as a bitmap over a table of
+                    the refs, to <repo_name>-refs.json, see branches.py. In
+                    incremental mode, the commits reachable from the tips
+                    recorded by the last run are skipped. Defaults to the
+                    value of ALL_REFS
+    Returns:
+        The number of records that were written
     """
+    if stream is None:
+        stream = STREAM_LOG
+    if jobs is None:
+        jobs = JOBS
+    if compact is None:
+        compact = COMPACT_STORE
+    if json_format is None:
+        json_format = JSON_FORMAT
+    if columnar is None:
+        columnar = GEN_COLUMNAR
+    if sqlite is None:
+        sqlite = SQLITE_DB
+    if rollups is None:
+        rollups = GEN_ROLLUPS
+    if engine is None:
+        engine = LOG_ENGINE
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    if cache_size is None:
+        cache_size = CACHE_MAX_BYTES
+    if classifier_config is None:
+        classifier_config = CLASSIFIER_CONFIG
+    if profile is None:
+        profile = GEN_PROFILE
+    if cprofile is None:
+        cprofile = GEN_CPROFILE
+    if szz is None:
+        szz = GEN_SZZ
+    if hunks is None:
+        hunks = GEN_HUNKS
+    if compress is None:
+        compress = COMPRESS
+    compress_ext = ""
+    if compress is not None:
+        from check_commits.compress import Compression
+        try:
+            compression = Compression(compress, compress_level)
+        except ValueError as e:
+            sys.stderr.write(FATAL_LBL + "{0}\n".format(e))
+            sys.exit(EXIT_FAILURE)
+        compress_level = compression.level
+        compress_ext = compression.ext
+    if partition is None:
+        partition = PARTITION
+    if partition is not None:
+        from check_commits.partitions import parse_partition
+        try:
+            partition = parse_partition(partition)
+        except ValueError as e:
+            sys.stderr.write(FATAL_LBL + "{0}\n".format(e))
+            sys.exit(EXIT_FAILURE)
+    if all_refs is None:
+        all_refs = ALL_REFS
+    if sort_by is None:
+        sort_by = SORT_BY
+    if sort_by is not None:
+        from check_commits.external_sort import SORT_KEYS
+        if sort_by not in SORT_KEYS:
+            sys.stderr.write(FATAL_LBL + "Unknown sort key: '{0}'\n"
+                                         .format(sort_by))
+            sys.exit(EXIT_FAILURE)
+    run_profile = None
+    if profile or cprofile:
+        from check_commits.profiler import RunProfile
+        run_profile = RunProfile(cprofile)
+        run_profile.enable()
+
+    classifier = None
+    if classifier_config is not None:
+        from check_commits.classifier import DefectClassifier
+        try:
+            with _phase(run_profile, "classifier"):
+                if classifier_config:
+                    classifier = DefectClassifier.load(classifier_config)
+                else:
+                    classifier = DefectClassifier()
+        except (OSError, ValueError, KeyError, re.error) as e:
+            sys.stderr.write(FATAL_LBL +
+                             "Unable to load the classifier config "
+                             "'{0}': {1}\n".format(classifier_config, e))
+            sys.exit(EXIT_FAILURE)
+
     # Get the name of the repo from the target repo itself by using:
     # git rev-parse --show-toplevel, then getting the leaf name of the
     # repo
+    if run_profile is not None:
+        run_profile.push("setup")
     cmd_root = ["git", "-C",  repo_path]
     cmd = cmd_root + ["rev-parse", "--show-toplevel"]
     full_repo_name = subprocess.check_output(cmd).decode("utf-8").rstrip()
     repo_name = os.path.basename(full_repo_name)
-    
-    # The information that we deal with all comes from git log --numstat
-    cmd = cmd_root + ["log", "--numstat"]
-    log = subprocess.check_output(cmd).decode("utf-8").splitlines()
 
-    # Get indices into the returned log for the start of each commit block
-    commits = find_commits(log)
-    # Add a dummy entry at the end that is one element beyond the end of the
-    # log. We'll use this as an upper bound for processing
-    commits.append(len(log)+1)
+    # git prunes the commits and files that don't match the filters
+    log_filter = LogFilter(since, until, include, exclude, authors)
+    if log_filter.is_empty():
+        log_filter = None
+    else:
+        log_filter.resolve(cmd_root)
+
+    if defects_file is None:
+        # Prefer the index, when one has been built
+        defects_file = repo_name + ".dfx"
+        if not os.path.exists(defects_file):
+            defects_file = repo_name + ".dft"
+
+    revs = []
+    append = False
+    ref_tbl = None
+    if all_refs:
+        from check_commits import branches
+        ref_tbl = branches.ref_table(cmd_root)
+        tips = branches.ref_tips(ref_tbl)
+        revs = tips
+    if incremental:
+        from check_commits import parse_cache
+        head, refs = git_ref_tips(cmd_root)
+        if all_refs:
+            # The tips that are walked are the ones recorded, so the next
+            # run starts from where this one ended
+            refs = dict(ref_tbl)
+        settings = { "owner":repo_owner
+                    ,"engine":engine
+                    ,"csv":GEN_CSV
+                    ,"text":GEN_TEXT
+                    ,"json":json_format
+                    ,"columnar":columnar
+                    ,"sqlite":sqlite
+                    ,"rollups":rollups
+                    ,"szz":szz
+                    ,"hunks":hunks
+                    ,"compress":([compress, compress_level]
+                                 if compress is not None else None)
+                    ,"partition":partition
+                    ,"sort":sort_by
+                    ,"all_refs":branches.REF_PATTERNS if all_refs else None
+                    ,"classifier":(classifier.fingerprint()
+                                   if classifier is not None else None)
+                    # The defect flags of the earlier records depend on it
+                    ,"defects":[ os.path.abspath(defects_file)
+                                ,parse_cache.file_digest(defects_file)
+                               ]
+                    ,"filter":(log_filter.to_dict()
+                               if log_filter is not None else None)
+                   }
+        json_ext = ".ndjson" if json_format == "ndjson" else ".json"
+        json_ext += compress_ext
+        if partition is not None:
+            from check_commits.partitions import manifest_path
+            outputs = manifest_path(out_dir, repo_name)
+        else:
+            outputs = output_path(out_dir, repo_name, json_ext)
+        state = RunState.load(repo_name, out_dir)
+        if state is None:
+            pass
+        elif state.settings != settings:
+            sys.stdout.write(NOTE_LBL + "Options changed since the last run, "
+                                        "rebuilding outputs.\n")
+        elif not os.path.exists(outputs):
+            sys.stdout.write(NOTE_LBL + "Outputs from the last run are "
+                                        "missing, rebuilding them.\n")
+        elif not (branches.contains(cmd_root, tips,
+                                    branches.ref_tips(state.refs.items()))
+                  if all_refs else is_ancestor(cmd_root, state.head, head)):
+            sys.stdout.write(NOTE_LBL + "History was rewritten since the "
+                                        "last run, rebuilding outputs.\n")
+        elif all_refs:
+            # Only walk the commits that weren't reachable from any of the
+            # tips last time
+            revs = tips + ["^" + sha for sha in
+                           branches.ref_tips(state.refs.items())]
+            append = True
+        else:
+            # Only walk the commits that weren't reachable last time. We
+            # pin the range to the SHA-1 we just recorded, so commits that
+            # arrive while we're running are picked up by the next run
+            revs = ["{0}..{1}".format(state.head, head)]
+            append = True
+        if not append:
+            revs = tips if all_refs else [head]
+    if run_profile is not None:
+        run_profile.pop()
 
-    # Does the actual processing of the log and generates a list of
-    # "CommitRec" objects, each of which represents a file involved in a
-    # commit.
-    commit_files = proc_commits(log, commits, repo_name, repo_owner)
+    # Initialize the object that may (if the user has provided it) contain
+    # the commit SHA-1's that are associated with fixing a defect
+    with _phase(run_profile, "defect_commits"):
+        defect_commits = DefectCommits(defects_file, classifier)
+
+    cache = None
+    if cache_dir:
+        from check_commits import parse_cache
+        with _phase(run_profile, "cache"):
+            # The filters limit the files recorded for each commit, and
+            # which commits are recorded as having none
+            extra = log_filter.to_dict() if log_filter is not None else None
+            fp = parse_cache.fingerprint(engine, defects_file, classifier,
+                                         extra)
+            cache = parse_cache.ParseCache(cache_dir, fp, cache_size)
+
+    if cache is not None:
+        # Only the commits that aren't cached are extracted
+        commit_files = parse_cache.cached_commit_recs( cache
+                                                      ,cmd_root
+                                                      ,repo_name
+                                                      ,repo_owner
+                                                      ,engine
+                                                      ,stream
+                                                      ,revs
+                                                      ,jobs
+                                                      ,defect_commits
+                                                      ,run_profile
+                                                      ,log_filter
+                                                     )
+        commit_files = _timed(run_profile, "cache", commit_files)
+        if compact:
+            from check_commits.commit_store import CommitStore
+            with _phase(run_profile, "store"):
+                store = CommitStore(repo_name, repo_owner)
+                store.extend(commit_files)
+            commit_files = store
+    elif jobs == 1 and not compact:
+        # The records are written as they are parsed, without being kept
+        commit_files = iter_commit_recs( cmd_root
+                                        ,repo_name
+                                        ,repo_owner
+                                        ,engine
+                                        ,stream
+                                        ,revs
+                                        ,defect_commits
+                                        ,profile=run_profile
+                                        ,log_filter=log_filter
+                                       )
+    elif jobs == 1:
+        commit_files = extract_commits( cmd_root
+                                       ,repo_name
+                                       ,repo_owner
+                                       ,engine
+                                       ,stream
+                                       ,revs
+                                       ,defect_commits
+                                       ,compact=compact
+                                       ,profile=run_profile
+                                       ,log_filter=log_filter
+                                      )
+    else:
+        commit_files = extract_parallel( cmd_root
+                                        ,repo_name
+                                        ,repo_owner
+                                        ,engine
+                                        ,stream
+                                        ,revs
+                                        ,jobs
+                                        ,defect_commits
+                                        ,compact
+                                        ,profile=run_profile
+                                        ,log_filter=log_filter
+                                       )
 
     # for c in commit_files:
     #     print(c)
 
-    # Generate the JSON
-    with open(''.join(["./", repo_name, ".json"]), 'w') as f:
-        json.dump(commit_files,f, cls=CommitRecEncoder)
-
-    # Optionally, generate the CSV
-    if GEN_CSV:
-        with open(''.join(["./", repo_name, ".csv"]), 'w', newline='') as f:
-            writer = csv.DictWriter( f
-                                    ,fieldnames=CommitRec.__slots__
-                                    ,lineterminator=os.linesep
-                                   )
-            writer.writeheader()
-            for c in commit_files:
-                writer.writerow(c.to_dict())
-
-    # Optionally, generte a text representation of the CommitRec dictionaries
-    if GEN_TEXT:
-        with open(''.join(["./", repo_name, "-commit-recs.txt"]), 'w') as f:
-            for c in commit_files:
-                f.write("{}\n".format(c))
-
+    if szz or hunks:
+        # The defect commits are listed as the records are written
+        from check_commits.szz import collect_defects
+        fixes = []
+        commit_files = collect_defects(commit_files, fixes)
+    if run_profile is not None:
+        commit_files = run_profile.count_records(commit_files)
+    with _phase(run_profile, "writers"):
+        count = write_outputs( commit_files
+                              ,repo_name
+                              ,append
+                              ,out_dir
+                              ,json_format
+                              ,columnar
+                              ,sqlite
+                              ,rollups
+                              ,compress
+                              ,compress_level
+                              ,compress_buffer
+                              ,partition
+                              ,sort_by
+                              ,memory_limit
+                              ,repo_owner
+                             )
+
+    if szz:
+        from check_commits.szz import write_szz
+        with _phase(run_profile, "szz"):
+            blames = write_szz( cmd_root
+                               ,fixes
+                               ,output_path(out_dir, repo_name, "-szz.csv")
+                               ,append
+                               ,blame_jobs
+                               ,log_filter
+                              )
+        sys.stdout.write(NOTE_LBL + "SZZ: {0} defect commits, blame cache "
+                                    "{1} hits, {2} misses\n"
+                                    .format(len(fixes), blames.hits,
+                                            blames.misses))
+
+    if hunks:
+        from check_commits.hunks import write_hunks
+        with _phase(run_profile, "hunks"):
+            write_hunks( cmd_root
+                        ,repo_name
+                        ,revs
+                        ,output_path(out_dir, repo_name, "-hunks.csv")
+                        ,set(fixes)
+                        ,append
+                        ,log_filter
+                       )
+
+    if all_refs:
+        with _phase(run_profile, "refs"):
+            # Every commit's branches, old and new, as the refs may have
+            # moved
+            count_refs = branches.write_refs( cmd_root
+                                             ,repo_name
+                                             ,ref_tbl
+                                             ,output_path(out_dir, repo_name,
+                                                          "-refs.json")
+                                            )
+        sys.stdout.write(NOTE_LBL + "All refs: {0} refs, {1} commits\n"
+                                    .format(len(ref_tbl), count_refs))
+
+    if run_profile is not None:
+        run_profile.push("finish")
+    if cache is not None:
+        sys.stdout.write(NOTE_LBL + "Parse cache: {0} hits, {1} misses\n"
+                                    .format(cache.hits, cache.misses))
+        cache.close()
+
+    if classifier is not None:
+        classifier.write_stats(
+                    output_path(out_dir, repo_name, "-classifier.json")
+                   ,output_path(out_dir, repo_name, "-defect-rules.csv")
+                   ,append)
+
+    if incremental:
+        RunState(head, refs, settings).save(repo_name, out_dir)
+
+    if run_profile is not None:
+        run_profile.pop()
+        write_profile( run_profile
+                      ,cmd_root
+                      ,revs
+                      ,repo_name
+                      ,out_dir
+                      ,cache
+                      ,{ "engine":engine
+                        ,"stream":stream
+                        ,"jobs":jobs
+                        ,"compact":compact
+                        ,"incremental":incremental
+                        ,"append":append
+                        ,"cache_dir":cache_dir
+                        ,"filter":(log_filter.to_dict()
+                                   if log_filter is not None else None)
+                       }
+                      ,log_filter
+                     )
+
+    return count
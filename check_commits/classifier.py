@@ -0,0 +1,427 @@
+"""classifier.py decides, from its commit message, whether a commit addresses
+a defect, using a configurable set of rules.
+
+The rules are read from a JSON file such as:
+
+    {"rules": [
+        {"name": "jira", "regex": "JIRA-\\\\d+"},
+        {"name": "trackers", "keys": ["CORE", "UI"], "keys_file": "keys.txt"},
+        {"name": "fix-words", "keywords": ["fix", "fixes", "bug"]}
+    ]}
+
+There are three kinds of rule:
+
+    regex    - a regular expression, searched for anywhere in the message.
+               "ignore_case": true makes the match case insensitive. Since
+               the expressions are combined, they can't use named groups or
+               numbered backreferences.
+    keys     - issue tracker project keys, which match references such as
+               "CORE-1234". The keys can be listed in the rule, and/or read
+               from "keys_file", one per line, relative to the config file.
+    keywords - words that match when they appear as whole words in the
+               message, regardless of case.
+
+Rather than running each rule against each message, the rules are compiled
+into (at most) three matchers that each make a single pass over the message:
+all of the regex rules are combined into one alternation, with a named group
+per rule, while key and keyword rules tokenize the message with one regular
+expression and look the tokens up in a dictionary, so thousands of keys cost
+no more than a handful. The matches of the alternation don't overlap, so
+when it matches a message, the regex rules that it didn't report are tried
+on their own, in case another rule took the text they need.
+
+When several rules match a message, the one that appears first in the config
+is reported as the rule that fired. For each rule, the classifier counts the
+messages it matched, the messages for which it was the rule that fired, and
+the time spent in its matcher. When profiling is enabled ("profile": true in
+the config), each rule is also run on its own, so that the time of every rule
+can be measured separately.
+
+Without a config, a single regex rule equivalent to the original heuristic,
+"JIRA-\\d+", is used.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import re
+import csv
+import json
+import time
+import hashlib
+
+DEFAULT_RULES = [{"name":"jira", "regex":"JIRA-\\d+"}]
+
+# Tokens that may be tracker references, the key is the first group
+KEY_TOKEN_REGEX = re.compile(r"\b([A-Z][A-Z0-9_]+)-\d+\b")
+# Tokens that may be keywords
+WORD_TOKEN_REGEX = re.compile(r"\w+")
+
+# Name under which commits tagged by the external defects file are counted
+EXTERNAL_RULE = "<dft>"
+
+
+def _key_matcher(keys):
+    """Builds a function that searches a message for one rule's keys, used
+    to time the rule on its own
+    """
+    def match(msg):
+        for m in KEY_TOKEN_REGEX.finditer(msg):
+            if m.group(1) in keys:
+                return m
+        return None
+    return match
+
+
+def _word_matcher(words):
+    """Builds a function that searches a message for one rule's keywords,
+    used to time the rule on its own
+    """
+    def match(msg):
+        for m in WORD_TOKEN_REGEX.finditer(msg):
+            if m.group(0).lower() in words:
+                return m
+        return None
+    return match
+
+
+class RuleStats(object):
+    """Counters kept for each rule
+
+    Attributes:
+        name - name of the rule
+        kind - "regex", "keys", "keywords", or "external"
+        matches - number of messages the rule matched
+        hits - number of messages for which this rule was the one reported
+        seconds - time spent matching. For rules that share a matcher, this
+                is the time of the shared matcher, unless profiling is on
+    """
+    __slots__ = ["name", "kind", "matches", "hits", "seconds"]
+
+    def __init__(self, name, kind):
+        self.name    = name
+        self.kind    = kind
+        self.matches = 0
+        self.hits    = 0
+        self.seconds = 0.0
+
+    def to_dict(self):
+        """Produce a Python dictionary representation of this object"""
+        od = {}
+        for k in self.__slots__:
+            od[k] = getattr(self, k)
+        return od
+
+
+class DefectClassifier(object):
+    """Classifies commit messages with a compiled set of rules
+
+    Attributes:
+        rules - list of the rule dictionaries, as configured, with any keys
+                files already read
+        stats - list of RuleStats, one per rule, in config order, followed
+                by the one for commits tagged by the external defects file
+        fired - dictionary mapping the SHA-1 of each defect commit to the
+                name of the rule that fired for it
+        messages - number of messages classified
+        profile - bool, whether each rule is also timed on its own
+    """
+    __slots__ = [ "rules"
+                 ,"stats"
+                 ,"fired"
+                 ,"messages"
+                 ,"profile"
+                 ,"_regex"
+                 ,"_regex_rules"
+                 ,"_keys"
+                 ,"_key_rules"
+                 ,"_words"
+                 ,"_word_rules"
+                 ,"_singles"
+                ]
+
+    def __init__(self, rules=None, profile=False):
+        """Compiles the rules
+
+        Args:
+            rules - list of rule dictionaries, see the module description,
+                    defaults to DEFAULT_RULES
+            profile - bool, if True, time every rule on its own as well
+        Raises:
+            ValueError if a rule is malformed
+        """
+        self.rules = rules if rules else DEFAULT_RULES
+        self.profile = profile
+        self.stats = []
+        self.fired = {}
+        self.messages = 0
+        alternatives = []
+        self._regex_rules = {}
+        self._keys = {}
+        self._key_rules = set()
+        self._words = {}
+        self._word_rules = set()
+        self._singles = []
+        for idx, rule in enumerate(self.rules):
+            name = rule.get("name", "rule{0}".format(idx))
+            if "regex" in rule:
+                kind = "regex"
+                pattern = rule["regex"]
+                if rule.get("ignore_case"):
+                    pattern = "(?i:" + pattern + ")"
+                group = "r{0}".format(idx)
+                alternatives.append("(?P<{0}>{1})".format(group, pattern))
+                self._regex_rules[group] = idx
+                single = re.compile(pattern)
+                self._singles.append(single.search)
+            elif "keys" in rule:
+                kind = "keys"
+                self._key_rules.add(idx)
+                for k in rule["keys"]:
+                    # The first rule to list a key takes priority
+                    self._keys.setdefault(k, idx)
+                keys = frozenset(rule["keys"])
+                self._singles.append(_key_matcher(keys))
+            elif "keywords" in rule:
+                kind = "keywords"
+                self._word_rules.add(idx)
+                words = [w.lower() for w in rule["keywords"]]
+                for w in words:
+                    self._words.setdefault(w, idx)
+                self._singles.append(_word_matcher(frozenset(words)))
+            else:
+                raise ValueError("Rule '{0}' has no regex, keys or keywords"
+                                 .format(name))
+            self.stats.append(RuleStats(name, kind))
+        self.stats.append(RuleStats(EXTERNAL_RULE, "external"))
+        self._regex = (re.compile("|".join(alternatives))
+                       if alternatives else None)
+
+    def load(config):
+        """Creates a classifier from a JSON config file
+        NOTE: This is a class function, not an instance function, so no
+              "self" argument.
+        Args:
+            config - pathname of the config file
+        Returns:
+            A new DefectClassifier object
+        """
+        with open(config, 'r') as f:
+            cfg = json.load(f)
+        base = os.path.dirname(os.path.abspath(config))
+        rules = []
+        for rule in cfg["rules"]:
+            rule = dict(rule)
+            if "keys_file" in rule:
+                keys = list(rule.get("keys", []))
+                path = os.path.join(base, rule.pop("keys_file"))
+                with open(path, 'r') as f:
+                    keys.extend(l.strip() for l in f if l.strip())
+                rule["keys"] = keys
+            rules.append(rule)
+        return DefectClassifier(rules, cfg.get("profile", False))
+
+    def fingerprint(self):
+        """Returns a str that changes whenever the rules change
+
+        Used to recognize results that were produced with different rules.
+        """
+        canon = json.dumps(self.rules, sort_keys=True).encode("utf-8")
+        return hashlib.sha1(canon).hexdigest()
+
+    def classify(self, msg, commit=None):
+        """Determines whether a commit message indicates a defect fix
+
+        Args:
+            msg - str with the commit message
+            commit - optional str with the SHA-1 of the commit, used to
+                    record which rule fired for it
+        Returns:
+            The name of the rule that fired, or None if no rule matched
+        """
+        self.messages += 1
+        stats = self.stats
+        matched = set()
+        clock = time.perf_counter
+        timings = []
+
+        start = clock()
+        if self._regex is not None:
+            for m in self._regex.finditer(msg):
+                # lastgroup names the rule whose alternative matched
+                matched.add(self._regex_rules[m.lastgroup])
+            if matched:
+                # The matches don't overlap, so text that one rule needs
+                # may have been taken by another, the rules that didn't
+                # match are tried on their own
+                singles = self._singles
+                for idx in self._regex_rules.values():
+                    if idx not in matched and singles[idx](msg):
+                        matched.add(idx)
+            end = clock()
+            timings.append((self._regex_rules.values(), end - start))
+            start = end
+        if self._keys:
+            keys = self._keys
+            for m in KEY_TOKEN_REGEX.finditer(msg):
+                idx = keys.get(m.group(1))
+                if idx is not None:
+                    matched.add(idx)
+            end = clock()
+            timings.append((self._key_rules, end - start))
+            start = end
+        if self._words:
+            words = self._words
+            for m in WORD_TOKEN_REGEX.finditer(msg):
+                idx = words.get(m.group(0).lower())
+                if idx is not None:
+                    matched.add(idx)
+            timings.append((self._word_rules, clock() - start))
+
+        if self.profile:
+            # Time each rule on its own, instead of charging every rule with
+            # the time of the matcher it shares with others
+            for idx, single in enumerate(self._singles):
+                start = clock()
+                single(msg)
+                stats[idx].seconds += clock() - start
+        else:
+            for rules, elapsed in timings:
+                for idx in rules:
+                    stats[idx].seconds += elapsed
+
+        if not matched:
+            return None
+        for idx in matched:
+            stats[idx].matches += 1
+        first = min(matched)
+        stats[first].hits += 1
+        name = stats[first].name
+        if commit is not None:
+            self.fired[commit] = name
+        return name
+
+    def count_external(self, commit=None):
+        """Records a commit that the external defects file tagged
+
+        Args:
+            commit - optional str with the SHA-1 of the commit
+        """
+        ext = self.stats[-1]
+        ext.matches += 1
+        ext.hits += 1
+        if commit is not None:
+            self.fired[commit] = EXTERNAL_RULE
+
+    def replay(self, commit, rule):
+        """Records a commit whose message was classified by an earlier run,
+        e.g. one taken from the parse cache, as if it had been classified
+        again
+
+        Only the rule that fired is counted as matching the message, the
+        time taken isn't.
+
+        Args:
+            commit - str with the SHA-1 of the commit
+            rule - str with the name of the rule that fired for it,
+                    EXTERNAL_RULE, or None if none did
+        """
+        if rule == EXTERNAL_RULE:
+            self.count_external(commit)
+            return
+        self.messages += 1
+        if rule is None:
+            return
+        for s in self.stats:
+            if s.name == rule:
+                s.matches += 1
+                s.hits += 1
+                break
+        self.fired[commit] = rule
+
+    def merge_stats(self, other):
+        """Adds the counters of another classifier, with the same rules, to
+        this one, e.g. those of a worker process
+
+        Args:
+            other - DefectClassifier whose counters are to be added
+        """
+        self.messages += other.messages
+        for mine, theirs in zip(self.stats, other.stats):
+            mine.matches += theirs.matches
+            mine.hits += theirs.hits
+            mine.seconds += theirs.seconds
+        self.fired.update(other.fired)
+
+    def write_stats(self, stats_path, fired_path=None, append=False):
+        """Writes the per-rule counters and, optionally, the fired rules
+
+        When appending, e.g. in an incremental run that only classified the
+        new commits, the counters are added to those in the existing file,
+        and the fired rules to the existing list.
+
+        Args:
+            stats_path - pathname of the JSON file for the counters
+            fired_path - optional pathname of a CSV file that lists each
+                    defect commit with the rule that fired for it
+            append - bool, if True, add to the files of an earlier run with
+                    the same rules
+        """
+        messages = self.messages
+        rules = [s.to_dict() for s in self.stats]
+        if append and os.path.exists(stats_path):
+            with open(stats_path, 'r') as f:
+                old = json.load(f)
+            if [r["name"] for r in old["rules"]] == [r["name"]
+                                                     for r in rules]:
+                messages += old["messages"]
+                for mine, theirs in zip(rules, old["rules"]):
+                    for k in ["matches", "hits", "seconds"]:
+                        mine[k] += theirs[k]
+        with open(stats_path, 'w') as f:
+            json.dump({ "messages":messages
+                       ,"profile":self.profile
+                       ,"rules":rules
+                      }, f, indent=1)
+        if fired_path is not None:
+            extend = append and os.path.exists(fired_path)
+            with open(fired_path, 'a' if extend else 'w', newline='') as f:
+                writer = csv.writer(f, lineterminator=os.linesep)
+                if not extend:
+                    writer.writerow(["commit", "rule"])
+                for commit, rule in self.fired.items():
+                    writer.writerow([commit, rule])
+
+    def __getstate__(self):
+        """The compiled matchers are not pickled, they're rebuilt from the
+        rules
+        """
+        return [getattr(self, k) for k in self.__slots__
+                if not k.startswith("_")]
+
+    def __setstate__(self, state):
+        public = dict(zip([k for k in self.__slots__
+                           if not k.startswith("_")], state))
+        self.__init__(public["rules"], public["profile"])
+        for k, v in public.items():
+            setattr(self, k, v)
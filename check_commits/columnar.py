@@ -0,0 +1,328 @@
+"""columnar.py writes the records of a run to a compact binary file, organized
+by column, and provides a reader that memory-maps the file and exposes the
+columns without parsing them.
+
+The file, named:
+
+    <repo_name>.ccol
+
+starts with a fixed size header:
+
+    magic       8 bytes, MAGIC
+    meta_off    unsigned 64 bit little endian int, offset of the metadata
+    meta_len    unsigned 64 bit little endian int, length of the metadata
+
+The metadata is a UTF-8 JSON object that gives the number of rows, the byte
+order of the numeric data and, for each column (in the order of the CSV
+output), where its data can be found. Every section of data starts on an 8
+byte boundary, so it can be used in place.
+
+Numeric columns (timestamp, lines_added, lines_deleted and is_defect) are
+stored as fixed width arrays, one element per row. String columns (repo,
+owner, commit, file and author) are dictionary encoded: a fixed width array
+of codes, one per row, and a dictionary of the distinct values, stored as an
+array of offsets into a block of UTF-8 text.
+
+Reading the rows back, and writing them with the csv module, reproduces the
+CSV output exactly.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import sys
+import os
+import json
+import mmap
+import struct
+from array import array
+
+from check_commits.writers import FIELDS
+from check_commits.writers import RecordSink
+
+MAGIC = b"CCCOL\x00\x01\x00"
+HEADER = struct.Struct("<8sQQ")
+
+# Typecodes of the fixed width numeric columns, any other field is stored
+# as a dictionary encoded string column
+NUMERIC_COLUMNS = { "timestamp":'d'
+                   ,"lines_added":'q'
+                   ,"lines_deleted":'q'
+                   ,"is_defect":'B'
+                  }
+# Typecodes for the codes and offsets of dictionary encoded columns
+CODE_TYPE = 'I'
+OFFSET_TYPE = 'Q'
+
+
+def _pad(f):
+    """Writes zero bytes to bring the file position to an 8 byte boundary
+
+    Args:
+        f - binary file object open for writing
+    Returns:
+        The new file position
+    """
+    pos = f.tell()
+    if pos % 8:
+        f.write(b"\0" * (8 - pos % 8))
+        pos = f.tell()
+    return pos
+
+
+class ColumnarSink(RecordSink):
+    """Collects the records in columns and writes the file when closed
+
+    The columns are accumulated in arrays, which use a few bytes per row, and
+    the file is written in one go by close(), since the size of each column
+    isn't known until then.
+
+    When appending, the rows of the existing file are loaded first, and the
+    file is rewritten with the new rows following them.
+    """
+    __slots__ = ["_cols", "_dicts"]
+
+    def __init__(self, path, append=False):
+        """Prepares the columns
+
+        Args:
+            path - pathname of the output file
+            append - bool, if True, keep the rows of an existing file
+        """
+        RecordSink.__init__(self, path, None)
+        self._cols = []
+        self._dicts = []
+        for k in FIELDS:
+            if k in NUMERIC_COLUMNS:
+                self._cols.append(array(NUMERIC_COLUMNS[k]))
+                self._dicts.append(None)
+            else:
+                self._cols.append(array(CODE_TYPE))
+                self._dicts.append({})
+        if append and os.path.exists(path):
+            with ColumnarReader(path) as reader:
+                for vals in reader.rows():
+                    self.write(vals)
+
+    def write(self, vals):
+        for col, d, v in zip(self._cols, self._dicts, vals):
+            if d is None:
+                col.append(v)
+            else:
+                code = d.get(v)
+                if code is None:
+                    code = d[v] = len(d)
+                col.append(code)
+
+    def close(self):
+        meta = { "rows":len(self._cols[0])
+                ,"byteorder":sys.byteorder
+                ,"columns":[]
+               }
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, 0, 0))
+            for k, col, d in zip(FIELDS, self._cols, self._dicts):
+                desc = {"name":k}
+                desc["offset"] = _pad(f)
+                col.tofile(f)
+                if d is None:
+                    desc["type"] = col.typecode
+                else:
+                    desc["type"] = "dict"
+                    # The dictionary keys are in code order, since codes
+                    # were assigned as the keys were inserted
+                    blob = bytearray()
+                    offsets = array(OFFSET_TYPE, [0])
+                    for v in d:
+                        blob.extend(v.encode("utf-8"))
+                        offsets.append(len(blob))
+                    desc["offsets"] = _pad(f)
+                    offsets.tofile(f)
+                    desc["values"] = f.tell()
+                    f.write(blob)
+                    desc["count"] = len(d)
+                meta["columns"].append(desc)
+            meta_off = _pad(f)
+            meta_bytes = json.dumps(meta).encode("utf-8")
+            f.write(meta_bytes)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, meta_off, len(meta_bytes)))
+
+
+class DictColumn(object):
+    """A dictionary encoded string column of a memory-mapped file
+
+    Attributes:
+        codes - memoryview of the codes, one per row, each of which is an
+                index into values
+        values - list of the distinct strs of the column, decoded the first
+                time they're needed
+    """
+    __slots__ = ["codes", "_offsets", "_blob", "_values"]
+
+    def __init__(self, codes, offsets, blob):
+        self.codes = codes
+        self._offsets = offsets
+        self._blob = blob
+        self._values = None
+
+    @property
+    def values(self):
+        if self._values is None:
+            offs = self._offsets
+            blob = self._blob
+            self._values = [bytes(blob[offs[i]:offs[i+1]]).decode("utf-8")
+                            for i in range(len(offs) - 1)]
+        return self._values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx):
+        return self.values[self.codes[idx]]
+
+    def release(self):
+        """Releases the views onto the memory-mapped file"""
+        for mv in (self.codes, self._offsets, self._blob):
+            mv.release()
+
+
+class ColumnarReader(object):
+    """Memory-maps a columnar file and exposes its columns
+
+    Numeric columns are returned as memoryviews, cast to the type of the
+    column, so they can be indexed directly or, for example, handed to
+    numpy.frombuffer(), without any copying. String columns are returned as
+    DictColumn objects.
+
+    Attributes:
+        path - pathname of the file
+        fields - list of the column names, in the order of the CSV output
+        rows_count - number of rows in the file
+    """
+    __slots__ = [ "path"
+                 ,"fields"
+                 ,"rows_count"
+                 ,"_f"
+                 ,"_mm"
+                 ,"_cols"
+                ]
+
+    def __init__(self, path):
+        """Opens and maps the file
+
+        Args:
+            path - pathname of the columnar file
+        Raises:
+            ValueError if the file isn't a columnar file that this reader
+            can use
+        """
+        self.path = path
+        self._f = open(path, 'rb')
+        self._cols = {}
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, meta_off, meta_len = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError("Not a columnar file: '{0}'".format(path))
+            meta = json.loads(self._mm[meta_off:meta_off+meta_len]
+                              .decode("utf-8"))
+            if meta["byteorder"] != sys.byteorder:
+                raise ValueError(("Columnar file '{0}' was written on a "
+                                  "machine of different byte order")
+                                 .format(path))
+        except:
+            self.close()
+            raise
+        self.rows_count = meta["rows"]
+        self.fields = []
+        mv = memoryview(self._mm)
+        for desc in meta["columns"]:
+            name = desc["name"]
+            self.fields.append(name)
+            if desc["type"] == "dict":
+                codes = self._view(mv, desc["offset"], CODE_TYPE,
+                                   self.rows_count)
+                offsets = self._view(mv, desc["offsets"], OFFSET_TYPE,
+                                     desc["count"] + 1)
+                end = desc["values"] + offsets[-1]
+                blob = mv[desc["values"]:end]
+                self._cols[name] = DictColumn(codes, offsets, blob)
+            else:
+                self._cols[name] = self._view(mv, desc["offset"],
+                                              desc["type"], self.rows_count)
+        mv.release()
+
+    def _view(self, mv, offset, typecode, count):
+        """Creates a typed view of a section of the file"""
+        size = array(typecode).itemsize
+        return mv[offset:offset + size*count].cast(typecode)
+
+    def __len__(self):
+        return self.rows_count
+
+    def column(self, name):
+        """Returns a column of the file
+
+        Args:
+            name - str with the name of the column
+        Returns:
+            memoryview for numeric columns, DictColumn for string columns
+        """
+        return self._cols[name]
+
+    def rows(self):
+        """Generator that reconstructs the rows of the file
+
+        Yields:
+            Tuples of the field values, in the order of fields, with the same
+            types as the CommitRec attributes they came from
+        """
+        cols = []
+        for name in self.fields:
+            col = self._cols[name]
+            if isinstance(col, DictColumn):
+                cols.append((col.values, col.codes))
+            else:
+                cols.append((None, col))
+        defect = self.fields.index("is_defect")
+        for i in range(self.rows_count):
+            row = [vals[c[i]] if vals is not None else c[i]
+                   for vals, c in cols]
+            row[defect] = row[defect] == 1
+            yield tuple(row)
+
+    def close(self):
+        """Releases the views and unmaps the file"""
+        for col in self._cols.values():
+            col.release()
+        self._cols = {}
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
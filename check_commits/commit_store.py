@@ -0,0 +1,300 @@
+"""commit_store.py provides a compact, column oriented, alternative to
+holding one CommitRec object for every file touched by every commit.
+
+A CommitRec repeats the repo, owner, timestamp, SHA-1, author and defect
+flag of its commit, so a commit that touches thousands of files carries
+thousands of copies of the same data, each with the overhead of a Python
+object. CommitStore keeps the per-commit data once, in parallel arrays, with
+the SHA-1's in binary form and the authors interned. The file changes are
+kept in parallel arrays of integers: the index of their commit, the index of
+their (interned) pathname and the number of lines added and deleted.
+
+Iterating over a CommitStore produces CommitRec objects on demand, in the
+order in which they were added, so it can be handed to anything that expects
+a list of CommitRecs, such as the output writers.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import sys
+import binascii
+from array import array
+
+from check_commits.check_commits import CommitRec
+
+
+class CommitStore(object):
+    """Holds the records of a run in columns, with per-commit data stored once
+
+    Attributes:
+        repo - the name of the repo the records belong to
+        owner - the owner of the repo
+        shas - bytearray holding the binary SHA-1's of the commits, one after
+                the other, each sha_len bytes long
+        sha_len - number of bytes in each binary SHA-1
+        timestamps - array of the commit timestamps
+        author_ids - array of indices into authors, one for each commit
+        defects - bytearray of flags, one for each commit, 1 if the commit
+                is associated with fixing a defect
+        authors - list of the distinct author email addresses
+        paths - list of the distinct pathnames
+        file_commit - array holding the index of the commit for each file
+                change
+        file_path - array holding the index into paths for each file change
+        lines_added - array with the lines added for each file change
+        lines_deleted - array with the lines deleted for each file change
+    """
+    __slots__ = [ "repo"
+                 ,"owner"
+                 ,"shas"
+                 ,"sha_len"
+                 ,"timestamps"
+                 ,"author_ids"
+                 ,"defects"
+                 ,"authors"
+                 ,"paths"
+                 ,"file_commit"
+                 ,"file_path"
+                 ,"lines_added"
+                 ,"lines_deleted"
+                 ,"_author_idx"
+                 ,"_path_idx"
+                 ,"_last_commit"
+                ]
+
+    def __init__(self, repo, owner):
+        """Initialize an empty store
+
+        Args:
+            repo - the name of the repo the records will belong to
+            owner - the owner of the repo
+        """
+        self.repo          = repo
+        self.owner         = owner
+        self.shas          = bytearray()
+        self.sha_len       = 0
+        self.timestamps    = array('d')
+        self.author_ids    = array('I')
+        self.defects       = bytearray()
+        self.authors       = []
+        self.paths         = []
+        self.file_commit   = array('I')
+        self.file_path     = array('I')
+        self.lines_added   = array('i')
+        self.lines_deleted = array('i')
+        # Lookup tables used to intern the strings, rebuilt when unpickled
+        self._author_idx   = {}
+        self._path_idx     = {}
+        # SHA-1 of the last commit added by append()
+        self._last_commit  = None
+
+    def __getstate__(self):
+        """The private lookup tables are not pickled, they're rebuilt from the
+        public attributes
+        """
+        return [getattr(self, k) for k in self.__slots__
+                if not k.startswith("_")]
+
+    def __setstate__(self, state):
+        public = [k for k in self.__slots__ if not k.startswith("_")]
+        for k, v in zip(public, state):
+            setattr(self, k, v)
+        self._author_idx = {a:i for i, a in enumerate(self.authors)}
+        self._path_idx = {p:i for i, p in enumerate(self.paths)}
+        n = len(self.timestamps)
+        self._last_commit = self.sha(n - 1) if n else None
+
+    def __len__(self):
+        """Returns the number of file changes, i.e. the number of records"""
+        return len(self.file_commit)
+
+    def commit_count(self):
+        """Returns the number of commits in the store"""
+        return len(self.timestamps)
+
+    def sha(self, idx):
+        """Returns the SHA-1 of a commit as a hex str
+
+        Args:
+            idx - index of the commit
+        """
+        start = idx * self.sha_len
+        sha = self.shas[start:start + self.sha_len]
+        return binascii.hexlify(sha).decode("ascii")
+
+    def add_commit(self, commit, author, timestamp, is_defect):
+        """Adds the per-commit data for a commit
+
+        Args:
+            commit - str with the SHA-1 of the commit
+            author - email address of the person responsible for the commit
+            timestamp - time of the commit
+            is_defect - whether the commit is associated with fixing a defect
+        Returns:
+            The index of the new commit, for use with add_file()
+        """
+        sha = binascii.unhexlify(commit)
+        if not self.sha_len:
+            self.sha_len = len(sha)
+        self.shas.extend(sha)
+        self.timestamps.append(timestamp)
+        author_id = self._author_idx.get(author)
+        if author_id is None:
+            author_id = self._author_idx[author] = len(self.authors)
+            self.authors.append(author)
+        self.author_ids.append(author_id)
+        self.defects.append(1 if is_defect else 0)
+        self._last_commit = commit
+        return len(self.timestamps) - 1
+
+    def add_file(self, commit_idx, path, lines_added, lines_deleted):
+        """Adds a file change to a commit
+
+        Args:
+            commit_idx - index of the commit, as returned by add_commit()
+            path - name of the file
+            lines_added - number of lines added to the file
+            lines_deleted - number of lines deleted from the file
+        """
+        path_id = self._path_idx.get(path)
+        if path_id is None:
+            path_id = self._path_idx[path] = len(self.paths)
+            self.paths.append(path)
+        self.file_commit.append(commit_idx)
+        self.file_path.append(path_id)
+        self.lines_added.append(lines_added)
+        self.lines_deleted.append(lines_deleted)
+
+    def append(self, rec):
+        """Adds a CommitRec to the store
+
+        The records of a commit are expected to be added one after the
+        other, as they are produced by the parsers. A record whose commit
+        differs from that of the previous record starts a new commit.
+
+        Args:
+            rec - the CommitRec object to add
+        """
+        if rec.commit != self._last_commit:
+            self.add_commit( rec.commit
+                            ,rec.author
+                            ,rec.timestamp
+                            ,rec.is_defect
+                           )
+        self.add_file( len(self.timestamps) - 1
+                      ,rec.file
+                      ,rec.lines_added
+                      ,rec.lines_deleted
+                     )
+
+    def extend(self, recs):
+        """Adds each of an iterable of CommitRecs to the store
+
+        Args:
+            recs - iterable of CommitRec objects, see append()
+        """
+        for rec in recs:
+            self.append(rec)
+
+    def merge(self, other):
+        """Adds all of the records of another store to the end of this one
+
+        Args:
+            other - CommitStore whose records are to be added
+        """
+        base = len(self.timestamps)
+        if not self.sha_len:
+            self.sha_len = other.sha_len
+        self.shas.extend(other.shas)
+        self.timestamps.extend(other.timestamps)
+        self.defects.extend(other.defects)
+        # Map the interned ids of the other store onto ours
+        author_map = []
+        for a in other.authors:
+            author_id = self._author_idx.get(a)
+            if author_id is None:
+                author_id = self._author_idx[a] = len(self.authors)
+                self.authors.append(a)
+            author_map.append(author_id)
+        self.author_ids.extend(author_map[i] for i in other.author_ids)
+        path_map = []
+        for p in other.paths:
+            path_id = self._path_idx.get(p)
+            if path_id is None:
+                path_id = self._path_idx[p] = len(self.paths)
+                self.paths.append(p)
+            path_map.append(path_id)
+        self.file_path.extend(path_map[i] for i in other.file_path)
+        self.file_commit.extend(c + base for c in other.file_commit)
+        self.lines_added.extend(other.lines_added)
+        self.lines_deleted.extend(other.lines_deleted)
+        if other.commit_count():
+            self._last_commit = other.sha(other.commit_count() - 1)
+
+    def __iter__(self):
+        """Lazy view of the store as a sequence of CommitRec objects
+
+        Yields:
+            A new CommitRec object for each file change, in the order in
+            which they were added
+        """
+        last = -1
+        for i, c in enumerate(self.file_commit):
+            if c != last:
+                last = c
+                sha = self.sha(c)
+                timestamp = self.timestamps[c]
+                author = self.authors[self.author_ids[c]]
+                is_defect = self.defects[c] == 1
+            yield CommitRec( self.repo
+                            ,self.owner
+                            ,timestamp
+                            ,sha
+                            ,self.paths[self.file_path[i]]
+                            ,self.lines_added[i]
+                            ,self.lines_deleted[i]
+                            ,author
+                            ,is_defect
+                           )
+
+    def nbytes(self):
+        """Estimates the memory used by the store
+
+        Returns:
+            int with the approximate number of bytes used by the columns and
+            the interned strings
+        """
+        total = 0
+        for col in ( self.shas
+                    ,self.timestamps
+                    ,self.author_ids
+                    ,self.defects
+                    ,self.file_commit
+                    ,self.file_path
+                    ,self.lines_added
+                    ,self.lines_deleted
+                   ):
+            total += sys.getsizeof(col)
+        for strs in (self.authors, self.paths):
+            total += sys.getsizeof(strs) + sum(sys.getsizeof(s) for s in strs)
+        return total
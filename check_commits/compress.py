@@ -0,0 +1,355 @@
+"""compress.py writes compressed output files, with the compression done by
+a background thread, so it overlaps with parsing the log instead of
+stalling it.
+
+The supported codecs are those of the standard library:
+
+    gzip - <output>.gz, fast, the default level is 6
+    bz2  - <output>.bz2, the default level is 9
+    lzma - <output>.xz, the smallest output, and the slowest, the default
+           preset is 6
+
+A CompressedWriter is a text file object, written by the sinks in the same
+way as a file that was opened with open(), whose text is encoded and
+buffered the same way. Each time BUFFER_SIZE bytes are buffered, they're
+handed, through a queue, to the CompressionThread below it. zlib, bz2 and
+lzma release the GIL while they compress, so the thread compresses one
+block, and writes it out, while the records of the next are being parsed.
+The queue holds at most QUEUE_BLOCKS blocks, so when compression can't keep
+up, the writer waits, rather than holding the whole output in memory.
+
+A compressed file may hold several streams (gzip "members"), one after the
+other, which readers decompress as a single one. The outputs are appended
+to by adding a stream, and the closing bracket of a JSON array is written
+as a stream of its own, so it can be dropped when the array is extended
+(see Compression.strip_member()). The streams are reproducible, gzip's are
+written without a timestamp or file name.
+
+open_text() opens an output for reading, whether it's compressed or not,
+by checking the magic number at its start.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import io
+import os
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+
+# Number of bytes of output collected before they're handed to the
+# compression thread
+BUFFER_SIZE = 1 << 20
+# Number of blocks waiting for the compression thread, before the writer
+# waits for it
+QUEUE_BLOCKS = 4
+
+# The extension and default level of each codec
+EXTENSIONS = { "gzip":".gz"
+              ,"bz2":".bz2"
+              ,"lzma":".xz"
+             }
+DEFAULT_LEVELS = { "gzip":6
+                  ,"bz2":9
+                  ,"lzma":6
+                 }
+
+# The magic number at the start of a file compressed with each codec
+_MAGIC = [ (b"\x1f\x8b", gzip.open)
+          ,(b"BZh", bz2.open)
+          ,(b"\xfd7zXZ\x00", lzma.open)
+         ]
+
+# Queued in place of a block, to end the current stream
+_END_MEMBER = object()
+
+
+def _compressor(codec, raw, level):
+    """Returns a binary file object that compresses what is written to it
+    into one stream, in the file object raw, which is left open
+    """
+    if codec == "gzip":
+        return gzip.GzipFile( filename=""
+                             ,mode="wb"
+                             ,compresslevel=level
+                             ,fileobj=raw
+                             ,mtime=0
+                            )
+    elif codec == "bz2":
+        return bz2.BZ2File(raw, "wb", compresslevel=level)
+    return lzma.LZMAFile(raw, "wb", preset=level)
+
+
+class Compression(object):
+    """The codec, level and buffering of compressed outputs
+
+    Attributes:
+        codec - str, "gzip", "bz2" or "lzma"
+        level - int, the compression level (the preset, for lzma)
+        buffer_size - int, the number of bytes in each block handed to the
+                compression thread
+        queue_blocks - int, the most blocks waiting for the thread
+        ext - str with the extension added to the names of the outputs
+    """
+    __slots__ = [ "codec"
+                 ,"level"
+                 ,"buffer_size"
+                 ,"queue_blocks"
+                 ,"ext"
+                ]
+
+    def __init__( self
+                 ,codec
+                 ,level=None
+                 ,buffer_size=None
+                 ,queue_blocks=None
+                ):
+        """Validates the settings
+
+        Args:
+            codec - str, "gzip", "bz2" or "lzma"
+            level - int, the compression level. Defaults to the codec's
+                    entry in DEFAULT_LEVELS
+            buffer_size - int, the number of bytes in each block.
+                    Defaults to the value of BUFFER_SIZE
+            queue_blocks - int, the most blocks waiting for the thread.
+                    Defaults to the value of QUEUE_BLOCKS
+        Raises:
+            ValueError if the codec is unknown, or the level is out of range
+        """
+        if codec not in EXTENSIONS:
+            raise ValueError("Unknown compression codec: '{0}'".format(codec))
+        if level is None:
+            level = DEFAULT_LEVELS[codec]
+        low = 0 if codec == "lzma" else 1
+        if not low <= level <= 9:
+            raise ValueError("The {0} level must be from {1} to 9, not {2}"
+                             .format(codec, low, level))
+        self.codec = codec
+        self.level = level
+        self.buffer_size = (buffer_size if buffer_size is not None
+                            else BUFFER_SIZE)
+        self.queue_blocks = (queue_blocks if queue_blocks is not None
+                             else QUEUE_BLOCKS)
+        self.ext = EXTENSIONS[codec]
+
+    def open(self, path, append=False, newline=None):
+        """Opens a compressed output file for writing
+
+        Args:
+            path - pathname of the output file, including the extension
+            append - bool, if True, add a stream to an existing file
+            newline - passed to open(), '' for CSV
+        Returns:
+            CompressedWriter object
+        """
+        return CompressedWriter(path, self, append, newline)
+
+    def member(self, text):
+        """Returns the bytes of a stream that holds nothing but text"""
+        buf = io.BytesIO()
+        f = _compressor(self.codec, buf, self.level)
+        f.write(text.encode("utf-8"))
+        f.close()
+        return buf.getvalue()
+
+    def strip_member(self, path, text):
+        """Removes the last stream of a compressed file, which must hold
+        nothing but text, and was written with the same settings
+
+        Args:
+            path - pathname of the compressed file
+            text - str held by the last stream
+        Returns:
+            The size, in bytes, of the rest of the file
+        Raises:
+            ValueError if the file doesn't end with that stream
+        """
+        tail = self.member(text)
+        with open(path, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END) - len(tail)
+            if size >= 0:
+                f.seek(size)
+            if size < 0 or f.read() != tail:
+                raise ValueError("'{0}' doesn't end with a {1} stream of "
+                                 "'{2}'".format(path, self.codec, text))
+            f.truncate(size)
+        return size
+
+
+class CompressionThread(io.RawIOBase):
+    """Binary file object that hands what is written to it to a thread,
+    which compresses it into the output file
+
+    Attributes:
+        path - pathname of the output file
+        compression - Compression object with the settings
+    """
+    __slots__ = [ "path"
+                 ,"compression"
+                 ,"_raw"
+                 ,"_in_member"
+                 ,"_queue"
+                 ,"_thread"
+                 ,"_error"
+                ]
+
+    def __init__(self, path, compression, append=False):
+        """Opens the file, and starts the thread
+
+        Args:
+            path - pathname of the output file
+            compression - Compression object with the settings
+            append - bool, if True, add a stream to an existing file
+        """
+        io.RawIOBase.__init__(self)
+        self.path = path
+        self.compression = compression
+        self._raw = open(path, 'ab' if append else 'wb')
+        self._in_member = False
+        self._queue = queue.Queue(max(compression.queue_blocks, 1))
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """Compresses the queued blocks into the file, until a None is
+        queued
+        """
+        c = self.compression
+        f = None
+        try:
+            while True:
+                block = self._queue.get()
+                if block is None:
+                    break
+                elif block is _END_MEMBER:
+                    if f is not None:
+                        f.close()
+                        f = None
+                else:
+                    if f is None:
+                        f = _compressor(c.codec, self._raw, c.level)
+                    f.write(block)
+            if f is not None:
+                f.close()
+        except BaseException as e:
+            self._error = e
+            # Keep taking the blocks, so the writer never waits on a full
+            # queue, it raises the error instead
+            while self._queue.get() is not None:
+                pass
+
+    def _check(self):
+        """Raises the error that stopped the thread, if any"""
+        if self._error is not None:
+            raise OSError("Unable to write '{0}': {1}"
+                          .format(self.path, self._error)) from self._error
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        """Queues a block of bytes, waiting while the queue is full"""
+        self._check()
+        self._queue.put(bytes(b))
+        self._in_member = True
+        return len(b)
+
+    def end_member(self):
+        """Ends the current stream, what follows is written as a new one"""
+        if self._in_member:
+            self._queue.put(_END_MEMBER)
+            self._in_member = False
+
+    def close(self):
+        """Waits for the thread to compress the queued blocks, and closes
+        the file
+
+        Raises:
+            OSError if the output couldn't be compressed or written
+        """
+        if self.closed:
+            return
+        try:
+            self._queue.put(None)
+            self._thread.join()
+            try:
+                self._raw.close()
+            except OSError:
+                # The thread's error is the one reported
+                if self._error is None:
+                    raise
+            self._check()
+        finally:
+            io.RawIOBase.close(self)
+
+
+class CompressedWriter(io.TextIOWrapper):
+    """Text file object whose output is compressed by a background thread
+
+    The text is encoded and buffered as by open(), the buffer is handed to
+    a CompressionThread whenever it fills up.
+    """
+
+    def __init__(self, path, compression, append=False, newline=None):
+        """Opens the file, and starts the compression thread
+
+        Args:
+            path - pathname of the output file
+            compression - Compression object with the settings
+            append - bool, if True, add a stream to an existing file
+            newline - passed to open(), '' for CSV
+        """
+        raw = CompressionThread(path, compression, append)
+        io.TextIOWrapper.__init__( self
+                                  ,io.BufferedWriter(raw,
+                                                     compression.buffer_size)
+                                  ,encoding="utf-8"
+                                  ,newline=newline
+                                 )
+
+    def end_member(self):
+        """Ends the current stream, what follows is written as a new one"""
+        self.flush()
+        self.buffer.raw.end_member()
+
+
+def open_text(path, newline=None):
+    """Opens an output file for reading, decompressing it if it has been
+    compressed with one of the codecs
+
+    Args:
+        path - pathname of the file
+        newline - passed to open(), '' for CSV
+    Returns:
+        Text file object
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    for sig, opener in _MAGIC:
+        if magic.startswith(sig):
+            return opener(path, 'rt', encoding="utf-8", newline=newline)
+    return open(path, 'r', newline=newline)
@@ -0,0 +1,624 @@
+"""daemon.py serves the records, and rollups, of any number of repos over
+HTTP on localhost, and keeps the results of each repo in memory, so the
+tools that query the same repos don't each run check-commits over their
+whole history.
+
+    check-commits --serve 8765 --memory-budget 512
+
+The endpoints (all GET) are:
+
+    /records?repo=PATH[&owner=OWNER][&format=FORMAT][&fresh=1]
+            the records of the repo, as newline delimited JSON, or, with
+            format=json, as a JSON array, the same as <repo_name>.ndjson
+            and <repo_name>.json
+    /rollups?repo=PATH&grouping=GROUPING[&owner=OWNER][&fresh=1]
+            the totals of one of the groupings of rollups.py, as JSON:
+            {"columns":[GROUPING, "lines_added", ...], "rows":[[...], ...]}
+    /status the repos held, with their size and HEAD, and the counters of
+            the cache
+
+The first request for a repo (a path and owner) extracts its history. The
+requests for the same repo that arrive while it's being extracted wait for
+that extraction, rather than starting their own. The records are held in a
+CommitStore, and the rollups are accumulated as they're extracted. Once the
+estimated size of all the repos held exceeds the memory budget, the least
+recently requested repos are dropped, to be extracted again when they're
+next requested.
+
+A watcher thread checks the HEAD of each repo every watch_interval seconds.
+When it has moved forward, only the new commits are extracted, and their
+records are appended, as with --incremental, so they follow the older
+records rather than preceding them. If history was rewritten, the repo is
+extracted again from scratch. With fresh=1, a request checks HEAD itself
+before it's answered.
+
+Records are only ever appended to a repo's store, and each request is
+answered from the records, and rollups, as of the last complete refresh, so
+a response never holds part of a refresh, however long it takes to send.
+
+The server only listens on localhost, and serves any repo that the user
+running it can read.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import sys
+import json
+import time
+import threading
+import itertools
+import subprocess
+import traceback
+import collections
+import http.server
+import urllib.parse
+import concurrent.futures
+
+from check_commits import check_commits
+from check_commits import rollups
+from check_commits.check_commits import DefectCommits
+from check_commits.commit_store import CommitStore
+from check_commits.writers import get_values
+from check_commits.writers import json_encoder
+
+DEFAULT_PORT = 8765
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_OWNER = "unknown_owner"
+# Estimated size, in bytes, above which repos are dropped
+MEMORY_BUDGET = 512 << 20
+# Seconds between checks of the HEAD of each repo
+WATCH_INTERVAL = 5.0
+# Rough size of a rollup group: its key, counters and row
+ROLLUP_GROUP_BYTES = 300
+# Number of records encoded before they're sent
+SEND_RECORDS = 1000
+
+
+def _error_str(e):
+    """Describes an exception in one line, as batch.py does"""
+    if isinstance(e, SystemExit):
+        return "exited with status {0}".format(e.code)
+    return ''.join(traceback.format_exception_only(type(e), e)).strip()
+
+
+class RepoResults(object):
+    """The results held for one repo
+
+    Attributes:
+        repo_path - str with the real pathname of the repo
+        repo_owner - str with the owner of the repo
+        repo_name - str with the name of the repo
+        head - SHA-1 that HEAD resolved to when the results were last
+                refreshed
+        store - CommitStore holding the records
+        rollups - rollups.RollupSink accumulating the totals
+        defects_file - str with the pathname of the defect commits file
+        defect_commits - DefectCommits object for the repo
+        view - tuple of the store, the number of its records and a
+                dictionary of the rows of each grouping, as of the last
+                complete refresh. The requests are answered from it
+        nbytes - int with the estimated size of the results
+        refreshed - time of the last refresh
+        lock - threading.Lock held while the results are refreshed
+    """
+    __slots__ = [ "repo_path"
+                 ,"repo_owner"
+                 ,"repo_name"
+                 ,"head"
+                 ,"store"
+                 ,"rollups"
+                 ,"defects_file"
+                 ,"defect_commits"
+                 ,"view"
+                 ,"nbytes"
+                 ,"refreshed"
+                 ,"lock"
+                ]
+
+    def __init__( self
+                 ,repo_path
+                 ,repo_owner
+                 ,repo_name
+                 ,defects_file
+                 ,defect_commits
+                ):
+        self.repo_path      = repo_path
+        self.repo_owner     = repo_owner
+        self.repo_name      = repo_name
+        self.head           = None
+        self.store          = CommitStore(repo_name, repo_owner)
+        # The sink is only flushed, it never writes its files
+        self.rollups        = rollups.RollupSink(".", repo_name)
+        self.defects_file   = defects_file
+        self.defect_commits = defect_commits
+        self.view           = (self.store, 0, {})
+        self.nbytes         = 0
+        self.refreshed      = None
+        self.lock           = threading.Lock()
+
+    def cmd_root(self):
+        """Returns the start of the git commands that target the repo"""
+        return ["git", "-C", self.repo_path]
+
+    def add(self, recs):
+        """Adds records to the store and the rollups. They aren't visible
+        to requests until publish() is called
+        """
+        append = self.store.append
+        write = self.rollups.write
+        for rec in recs:
+            append(rec)
+            write(get_values(rec))
+
+    def publish(self, head):
+        """Makes the records added so far visible to requests
+
+        Args:
+            head - str with the SHA-1 that HEAD resolved to
+        """
+        self.rollups.flush()
+        rows = {g:self.rollups.rows(g) for g in rollups.GROUPINGS}
+        self.head = head
+        self.nbytes = (self.store.nbytes() +
+                       sum(len(r) for r in rows.values()) *
+                       ROLLUP_GROUP_BYTES)
+        self.refreshed = time.time()
+        # A single assignment, so requests never see a partial update
+        self.view = (self.store, len(self.store), rows)
+
+    def to_dict(self):
+        """Describes the results, for the status"""
+        store, count, rows = self.view
+        return { "repo_path":self.repo_path
+                ,"owner":self.repo_owner
+                ,"repo_name":self.repo_name
+                ,"head":self.head
+                ,"records":count
+                ,"bytes":self.nbytes
+                ,"refreshed":self.refreshed
+               }
+
+
+class ResultCache(object):
+    """The results of the repos that have been requested, within a memory
+    budget, least recently requested first
+
+    Attributes:
+        budget - int with the estimated size, in bytes, above which repos
+                are dropped
+        engine - str with the log engine, "machine" or "regex"
+        cache_dir - optional str with the directory of the parse cache
+        cache_size - int with the size limit of the parse cache, in bytes
+        classifier - optional classifier.DefectClassifier with the rules
+                that each repo's own classifier is built with. It doesn't
+                classify any messages itself
+        counters - dictionary with the number of hits, misses, coalesced
+                requests, refreshes, rebuilds, evictions and failures
+    """
+    __slots__ = [ "budget"
+                 ,"engine"
+                 ,"cache_dir"
+                 ,"cache_size"
+                 ,"classifier"
+                 ,"counters"
+                 ,"_lock"
+                 ,"_entries"
+                 ,"_loading"
+                ]
+
+    def __init__(self, budget=MEMORY_BUDGET, options=None):
+        """Creates an empty cache
+
+        Args:
+            budget - int with the estimated size, in bytes, above which the
+                    least recently requested repos are dropped
+            options - optional dictionary of check-commits options, of
+                    which engine, classifier_config, cache_dir and
+                    cache_size are used
+        """
+        options = options if options else {}
+        self.budget = budget
+        self.engine = options.get("engine") or check_commits.LOG_ENGINE
+        self.cache_dir = options.get("cache_dir") or check_commits.CACHE_DIR
+        self.cache_size = (options.get("cache_size") or
+                           check_commits.CACHE_MAX_BYTES)
+        self.classifier = None
+        config = options.get("classifier_config")
+        if config is None:
+            config = check_commits.CLASSIFIER_CONFIG
+        if config is not None:
+            from check_commits.classifier import DefectClassifier
+            if config:
+                self.classifier = DefectClassifier.load(config)
+            else:
+                self.classifier = DefectClassifier()
+        self.counters = { "hits":0
+                         ,"misses":0
+                         ,"coalesced":0
+                         ,"refreshes":0
+                         ,"rebuilds":0
+                         ,"evictions":0
+                         ,"failures":0
+                        }
+        self._lock = threading.Lock()
+        # Maps (repo_path, repo_owner) to RepoResults, in order of use
+        self._entries = collections.OrderedDict()
+        # Maps (repo_path, repo_owner) to the Future of its extraction
+        self._loading = {}
+
+    def get(self, repo_path, repo_owner=DEFAULT_OWNER, fresh=False):
+        """Returns the results of a repo, extracting them if they're not
+        held. Concurrent requests for the same repo share one extraction
+
+        Args:
+            repo_path - str with the pathname of the repo
+            repo_owner - str with the owner of the repo
+            fresh - bool, if True, refresh the results if HEAD has moved
+        Returns:
+            The RepoResults object
+        Raises:
+            subprocess.CalledProcessError if git fails, for example because
+            repo_path isn't a repo, ValueError if the extraction fails
+        """
+        key = (os.path.realpath(repo_path), repo_owner)
+        loader = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+            else:
+                future = self._loading.get(key)
+                if future is not None:
+                    self.counters["coalesced"] += 1
+                else:
+                    self.counters["misses"] += 1
+                    future = self._loading[key] = concurrent.futures.Future()
+                    loader = True
+        if entry is not None:
+            if fresh and self.refresh(entry):
+                # A rebuild replaces the results
+                with self._lock:
+                    entry = self._entries.get(key, entry)
+            return entry
+        if not loader:
+            return future.result()
+
+        try:
+            entry = self._load(*key)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+                self.counters["failures"] += 1
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self._entries[key] = entry
+            self._evict(key)
+        future.set_result(entry)
+        return entry
+
+    def _load(self, repo_path, repo_owner):
+        """Extracts the complete results of a repo"""
+        cmd_root = ["git", "-C", repo_path]
+        cmd = cmd_root + ["rev-parse", "--show-toplevel"]
+        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+        repo_name = os.path.basename(out.decode("utf-8").rstrip())
+        defects_file = repo_name + ".dfx"
+        if not os.path.exists(defects_file):
+            defects_file = repo_name + ".dft"
+        classifier = None
+        if self.classifier is not None:
+            from check_commits.classifier import DefectClassifier
+            # Each repo has its own, so the rules it records as having fired
+            # are dropped along with its results, and the repos' threads
+            # don't share its counters
+            classifier = DefectClassifier(self.classifier.rules,
+                                          self.classifier.profile)
+        defect_commits = DefectCommits(defects_file, classifier)
+        entry = RepoResults( repo_path
+                            ,repo_owner
+                            ,repo_name
+                            ,defects_file
+                            ,defect_commits
+                           )
+        head = self._head(entry)
+        self._extract(entry, [head])
+        entry.publish(head)
+        return entry
+
+    def _head(self, entry):
+        """Returns the SHA-1 that HEAD of a repo resolves to"""
+        cmd = entry.cmd_root() + ["rev-parse", "HEAD"]
+        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+        return out.decode("utf-8").rstrip()
+
+    def _extract(self, entry, revs):
+        """Extracts the records of a range of commits into a repo's results
+
+        Raises:
+            subprocess.CalledProcessError if git fails, ValueError if the
+            log can't be parsed
+        """
+        cmd_root = entry.cmd_root()
+        name = entry.repo_name
+        owner = entry.repo_owner
+        defects = entry.defect_commits
+        try:
+            if self.cache_dir:
+                from check_commits import parse_cache
+                fp = parse_cache.fingerprint(self.engine, entry.defects_file,
+                                             self.classifier)
+                # The cache's connection can only be used by the thread
+                # that opened it
+                cache = parse_cache.ParseCache(self.cache_dir, fp,
+                                               self.cache_size)
+                try:
+                    recs = parse_cache.cached_commit_recs( cache
+                                                          ,cmd_root
+                                                          ,name
+                                                          ,owner
+                                                          ,self.engine
+                                                          ,True
+                                                          ,revs
+                                                          ,1
+                                                          ,defects
+                                                         )
+                    entry.add(recs)
+                finally:
+                    cache.close()
+            else:
+                entry.add(check_commits.iter_commit_recs( cmd_root
+                                                         ,name
+                                                         ,owner
+                                                         ,self.engine
+                                                         ,True
+                                                         ,revs
+                                                         ,defects
+                                                        ))
+        except SystemExit as e:
+            # The parsers exit on malformed logs, which mustn't stop the
+            # server
+            raise ValueError(_error_str(e))
+
+    def refresh(self, entry):
+        """Brings the results of a repo up to date with its HEAD
+
+        New commits are appended to the results. If history was rewritten,
+        the results are extracted again, and replace the old ones. If the
+        refresh fails, the results are dropped, so the next request
+        extracts them again.
+
+        Args:
+            entry - the RepoResults object
+        Returns:
+            True if the results changed
+        """
+        key = (entry.repo_path, entry.repo_owner)
+        with entry.lock:
+            try:
+                head = self._head(entry)
+                if head == entry.head:
+                    return False
+                if check_commits.is_ancestor(entry.cmd_root(), entry.head,
+                                             head):
+                    self._extract(entry, ["{0}..{1}".format(entry.head,
+                                                            head)])
+                    entry.publish(head)
+                    counter = "refreshes"
+                else:
+                    new = self._load(entry.repo_path, entry.repo_owner)
+                    counter = "rebuilds"
+            except (subprocess.CalledProcessError, OSError, ValueError) as e:
+                sys.stderr.write(check_commits.ERR_LBL +
+                                 "Unable to refresh '{0}': {1}\n"
+                                 .format(entry.repo_path, _error_str(e)))
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+                    self.counters["failures"] += 1
+                return False
+            with self._lock:
+                self.counters[counter] += 1
+                if counter == "rebuilds" and self._entries.get(key) is entry:
+                    self._entries[key] = new
+                self._evict(key)
+        return True
+
+    def refresh_all(self):
+        """Refreshes the results of every repo held"""
+        with self._lock:
+            entries = list(self._entries.values())
+        for entry in entries:
+            self.refresh(entry)
+
+    def watch(self, interval, stop):
+        """Refreshes the results of every repo held, every interval seconds,
+        until stop is set. Runs in its own thread
+
+        Args:
+            interval - float, the number of seconds between refreshes
+            stop - threading.Event that ends the loop
+        """
+        while not stop.wait(interval):
+            self.refresh_all()
+
+    def _evict(self, keep):
+        """Drops the least recently requested repos, other than keep, until
+        the results fit in the budget. Called with the lock held
+        """
+        total = sum(e.nbytes for e in self._entries.values())
+        for key in list(self._entries):
+            if total <= self.budget:
+                break
+            if key == keep:
+                continue
+            total -= self._entries.pop(key).nbytes
+            self.counters["evictions"] += 1
+
+    def status(self):
+        """Describes the cache and the repos held, as a dictionary"""
+        with self._lock:
+            repos = [e.to_dict() for e in self._entries.values()]
+            counters = dict(self.counters)
+        return { "budget_bytes":self.budget
+                ,"bytes":sum(r["bytes"] for r in repos)
+                ,"counters":counters
+                ,"repos":repos
+               }
+
+
+class DaemonHandler(http.server.BaseHTTPRequestHandler):
+    """Answers the requests, from the ResultCache of the server"""
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == "/status":
+            self._send_json(200, self.server.results.status())
+            return
+        if url.path not in ("/records", "/rollups"):
+            self._send_json(404, {"error":"Unknown endpoint: " + url.path})
+            return
+        repo_path = query.get("repo", [None])[0]
+        if not repo_path:
+            self._send_json(400, {"error":"The repo parameter is required"})
+            return
+        repo_owner = query.get("owner", [DEFAULT_OWNER])[0]
+        fresh = query.get("fresh", ["0"])[0] not in ("", "0")
+        try:
+            entry = self.server.results.get(repo_path, repo_owner, fresh)
+        except subprocess.CalledProcessError:
+            self._send_json(404, {"error":"Not a git repo: " + repo_path})
+            return
+        except (OSError, ValueError) as e:
+            self._send_json(500, {"error":_error_str(e)})
+            return
+
+        if url.path == "/records":
+            self._send_records(entry, query.get("format", ["ndjson"])[0])
+        else:
+            grouping = query.get("grouping", [None])[0]
+            if grouping not in rollups.GROUPINGS:
+                self._send_json(400, {"error":("The grouping parameter must "
+                                               "be one of: " +
+                                               ", ".join(rollups.GROUPINGS))})
+                return
+            store, count, rows = entry.view
+            self._send_json(200, { "columns":[grouping] + rollups.COLUMNS
+                                  ,"rows":rows[grouping]
+                                 })
+
+    def _send_json(self, status, obj):
+        """Sends a complete JSON response"""
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_records(self, entry, fmt):
+        """Streams the records of a repo, as of its last refresh"""
+        if fmt not in ("ndjson", "json"):
+            self._send_json(400, {"error":"Unknown format: " + fmt})
+            return
+        store, count, rows = entry.view
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json" if fmt == "json"
+                                         else "application/x-ndjson")
+        self.end_headers()
+        enc = json_encoder()
+        # Matches the outputs of the JSON and NDJSON sinks
+        if fmt == "json":
+            lead, sep, tail = "[", ", ", "]"
+        else:
+            lead, sep, tail = "", "\n", "\n" if count else ""
+        recs = itertools.islice(store, count)
+        parts = [lead]
+        try:
+            for i, rec in enumerate(recs):
+                if i:
+                    parts.append(sep)
+                parts.append(enc.encode(get_values(rec)))
+                if len(parts) >= SEND_RECORDS:
+                    self.wfile.write(''.join(parts).encode("ascii"))
+                    parts = []
+            parts.append(tail)
+            self.wfile.write(''.join(parts).encode("ascii"))
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away
+            pass
+
+
+class DaemonServer(http.server.ThreadingHTTPServer):
+    """HTTP server, with a thread per request, that holds the ResultCache
+
+    Attributes:
+        results - the ResultCache the requests are answered from
+    """
+    daemon_threads = True
+
+    def __init__(self, address, results):
+        self.results = results
+        http.server.ThreadingHTTPServer.__init__(self, address,
+                                                 DaemonHandler)
+
+
+def serve( port=DEFAULT_PORT
+          ,budget=MEMORY_BUDGET
+          ,watch_interval=WATCH_INTERVAL
+          ,options=None
+          ,host=DEFAULT_HOST
+         ):
+    """Runs the server until it's interrupted
+
+    Args:
+        port - int with the port to listen on, 0 selects any free port
+        budget - int with the estimated size, in bytes, above which the
+                    least recently requested repos are dropped
+        watch_interval - float with the number of seconds between checks
+                    of the HEAD of each repo
+        options - optional dictionary of check-commits options, see
+                    ResultCache
+        host - str with the address to listen on, defaults to localhost
+    """
+    results = ResultCache(budget, options)
+    server = DaemonServer((host, port), results)
+    stop = threading.Event()
+    watcher = threading.Thread(target=results.watch,
+                               args=(watch_interval, stop))
+    watcher.daemon = True
+    watcher.start()
+    sys.stdout.write(check_commits.NOTE_LBL + "Serving on http://{0}:{1}/\n"
+                     .format(*server.server_address[:2]))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
@@ -0,0 +1,241 @@
+"""external_sort.py orders the records of the JSON, CSV and text outputs by
+file path or by timestamp, rather than git's log order, within a memory
+budget, no matter how large the history is.
+
+The records are sorted by a SortSink, which stands in front of the sinks of
+the ordered outputs. It collects the field values of the records until
+their estimated size reaches the memory limit, then sorts them, and spills
+them, as a "run", to a temporary file. When the last record has been
+received, the runs are merged, reading each one a chunk at a time, and the
+merged records are fed to the sinks. If the records fit in the budget,
+nothing is spilled, they're simply sorted and written.
+
+The runs are kept in levels, the spilled runs are on level 0. Whenever a
+level holds MERGE_FAN_IN runs, they're merged into a single run on the next
+level, so runs are only merged with others of about the same size. Each
+record is rewritten once per level, O(log n) times, and fewer than
+MERGE_FAN_IN runs per level are open at once.
+
+The sort is stable: the records with the same key, the changes to a file,
+or the files of a commit, stay in log order.
+
+Only the JSON, CSV and text outputs are sorted. The columnar, SQLite and
+rollup outputs are still written in log order, as they group the records
+by commit.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import heapq
+import pickle
+import operator
+import tempfile
+
+from check_commits.writers import FIELDS
+from check_commits.writers import RecordSink
+
+# Estimated size, in bytes, of the records held in memory, above which they
+# are spilled to a temporary file
+MEMORY_LIMIT = 256 << 20
+# Directory of the temporary files, None uses the system's default
+SPILL_DIR = None
+# Number of runs on a level that are merged into one run of the next level
+MERGE_FAN_IN = 64
+# Number of records pickled together in a run
+RUN_CHUNK = 4096
+
+# The keys that the records can be sorted by
+SORT_KEYS = ["file", "timestamp"]
+
+# Estimated size of the field values of a record, besides its pathname. The
+# commit's strs are shared by its records
+_RECORD_BYTES = 200
+_FILE = FIELDS.index("file")
+
+
+class SortRun(object):
+    """A sorted run of records, spilled to a temporary file
+
+    Attributes:
+        count - number of records in the run
+    """
+    __slots__ = ["count", "_f"]
+
+    def __init__(self, vals, spill_dir=None):
+        """Writes a run
+
+        Args:
+            vals - iterable of the field values of the records, in order
+            spill_dir - optional str with the directory of the file
+        """
+        self._f = tempfile.TemporaryFile(dir=spill_dir)
+        self.count = 0
+        chunk = []
+        for v in vals:
+            chunk.append(v)
+            if len(chunk) >= RUN_CHUNK:
+                pickle.dump(chunk, self._f, pickle.HIGHEST_PROTOCOL)
+                self.count += len(chunk)
+                chunk = []
+        if chunk:
+            pickle.dump(chunk, self._f, pickle.HIGHEST_PROTOCOL)
+            self.count += len(chunk)
+
+    def __iter__(self):
+        """Reads the records back, one chunk at a time"""
+        self._f.seek(0)
+        for _ in range(0, self.count, RUN_CHUNK):
+            for v in pickle.load(self._f):
+                yield v
+
+    def close(self):
+        """Deletes the file"""
+        self._f.close()
+
+
+class SortSink(RecordSink):
+    """Sorts the records, within a memory budget, and feeds them to other
+    sinks in order
+
+    Attributes:
+        sinks - list of the RecordSink objects that receive the records
+        sort_by - str, the field that the records are sorted by, one of
+                SORT_KEYS
+        memory_limit - int, the estimated size, in bytes, of the records
+                held before they are spilled
+        runs - list of the levels of runs, each a list of SortRun objects,
+                oldest first. Level n holds the runs that were merged from
+                MERGE_FAN_IN ** n spilled ones
+    """
+    __slots__ = [ "sinks"
+                 ,"sort_by"
+                 ,"memory_limit"
+                 ,"runs"
+                 ,"_key"
+                 ,"_buf"
+                 ,"_bytes"
+                 ,"_spill_dir"
+                ]
+
+    def __init__(self, sinks, sort_by, memory_limit=None, spill_dir=None):
+        """Prepares the sort
+
+        Args:
+            sinks - list of RecordSink objects that receive the records
+            sort_by - str, one of SORT_KEYS
+            memory_limit - int, the estimated size, in bytes, of the records
+                    held in memory. Defaults to the value of MEMORY_LIMIT
+            spill_dir - str with the directory of the temporary files.
+                    Defaults to the value of SPILL_DIR
+        Raises:
+            ValueError if sort_by isn't one of SORT_KEYS
+        """
+        if sort_by not in SORT_KEYS:
+            raise ValueError("Unknown sort key: '{0}'".format(sort_by))
+        RecordSink.__init__(self, None, None)
+        self.sinks = sinks
+        self.sort_by = sort_by
+        self.memory_limit = (memory_limit if memory_limit is not None
+                             else MEMORY_LIMIT)
+        self.runs = []
+        self._key = operator.itemgetter(FIELDS.index(sort_by))
+        self._buf = []
+        self._bytes = 0
+        self._spill_dir = spill_dir if spill_dir is not None else SPILL_DIR
+
+    def write(self, vals):
+        self._buf.append(vals)
+        self._bytes += _RECORD_BYTES + len(vals[_FILE])
+        if self._bytes >= self.memory_limit:
+            self._spill()
+
+    def _spill(self):
+        """Sorts the records held in memory, and writes them as a run"""
+        self._buf.sort(key=self._key)
+        run = SortRun(self._buf, self._spill_dir)
+        self._buf = []
+        self._bytes = 0
+        level = 0
+        while True:
+            if level == len(self.runs):
+                self.runs.append([])
+            runs = self.runs[level]
+            runs.append(run)
+            if len(runs) < MERGE_FAN_IN:
+                break
+            # The runs of a level are newer than those of the levels above
+            # it, and merged oldest first, so the order of the records with
+            # equal keys is kept
+            run = SortRun(self._merge(runs), self._spill_dir)
+            for r in runs:
+                r.close()
+            self.runs[level] = []
+            level += 1
+
+    def _merge(self, runs):
+        """Returns an iterator of the records of the runs, in order. Runs
+        that are earlier in the list come first among equal keys
+        """
+        return heapq.merge(*runs, key=self._key)
+
+    def _sorted(self):
+        """Returns an iterator of all of the records, in order"""
+        self._buf.sort(key=self._key)
+        if not self.runs:
+            return iter(self._buf)
+        # Oldest first, from the top level down
+        runs = [r for level in reversed(self.runs) for r in level]
+        return self._merge(runs + [self._buf])
+
+    def close(self):
+        """Writes the records, in order, to the sinks, and closes them"""
+        try:
+            writes = [s.write for s in self.sinks]
+            for vals in self._sorted():
+                for w in writes:
+                    w(vals)
+        except:
+            self._discard()
+            for s in self.sinks:
+                s.abort()
+            raise
+        self._discard()
+        for s in self.sinks:
+            s.close()
+
+    def abort(self):
+        """Closes the sinks after a failure, without writing the records
+        that are still being sorted
+        """
+        self._discard()
+        for s in self.sinks:
+            s.abort()
+
+    def _discard(self):
+        """Deletes the runs, and drops the records held in memory"""
+        for level in self.runs:
+            for r in level:
+                r.close()
+        self.runs = []
+        self._buf = []
+        self._bytes = 0
@@ -0,0 +1,353 @@
+"""git_workers.py looks up the records of arbitrary commits through git
+processes that are kept open, rather than started for every request, so a
+service that asks about a handful of commits at a time doesn't pay for
+starting git, and walking history, each time.
+
+Each GitWorker holds two long-lived git processes for a repo:
+
+    git cat-file --batch-check  resolves what the caller asked for (full or
+                                abbreviated SHA-1's, refs, ...) into the
+                                SHA-1's of commits
+    git diff-tree --stdin       reports each commit in the same format as the
+                                "machine" engine's git log, so its output is
+                                parsed by MachineLogParser
+
+Requests are written to the processes' standard input, followed by a line
+that git echoes back unchanged, marking the end of the response. The
+commits of a request are sent in batches of BATCH_SIZE, small enough that
+neither side's pipe can fill up while the other waits.
+
+A GitWorkerPool keeps the workers for any number of repos, and hands them
+out to one caller (thread) at a time. At most max_workers are started per
+repo, each with its two processes. Callers wait for a worker when all of
+them are busy. A worker whose git processes have died is discarded, and the
+request is retried once with a fresh one.
+
+The records are the same as those that the "machine" engine produces for
+the same commits, assuming git's default rename detection.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import uuid
+import threading
+import subprocess
+
+from check_commits.check_commits import MACHINE_LOG_FMT
+from check_commits.check_commits import READ_CHUNK
+from check_commits.check_commits import DefectCommits
+from check_commits.check_commits import MachineLogParser
+
+# Maximum number of workers, each with two git processes, per repo
+MAX_WORKERS = 2
+# Number of commits sent to git per round-trip
+BATCH_SIZE = 100
+DEFAULT_OWNER = "unknown_owner"
+
+# --always reports commits without changes, such as merges, so every commit
+# that is asked for produces a response
+DIFF_TREE_ARGS = [ "diff-tree"
+                  ,"--stdin"
+                  ,"--always"
+                  ,"--root"
+                  ,"-r"
+                  ,"-M"
+                  ,"-z"
+                  ,"--numstat"
+                  ,"--date=raw"
+                  ,"--pretty=format:" + MACHINE_LOG_FMT
+                 ]
+CAT_FILE_ARGS = [ "cat-file"
+                 ,"--batch-check=%(objectname) %(objecttype)"
+                ]
+
+
+class GitWorker(object):
+    """A pair of long-lived git processes for one repo
+
+    Attributes:
+        repo_path - str with the pathname of the repo
+    """
+    __slots__ = [ "repo_path"
+                 ,"_cat_file"
+                 ,"_diff_tree"
+                 ,"_end"
+                ]
+
+    def __init__(self, repo_path):
+        """Starts the git processes
+
+        Args:
+            repo_path - str with the pathname of the repo
+        """
+        self.repo_path = repo_path
+        cmd_root = ["git", "-C", repo_path]
+        self._cat_file = GitWorker._start(cmd_root + CAT_FILE_ARGS)
+        self._diff_tree = GitWorker._start(cmd_root + DIFF_TREE_ARGS)
+        # Not a SHA-1, so diff-tree echoes it, it can't appear in a message
+        # by accident
+        self._end = "#end-{0}\n".format(uuid.uuid4().hex).encode("ascii")
+
+    def _start(cmd):
+        """Starts a git process that is driven through its standard input
+        NOTE: This is a class function, not an instance function, so no
+              "self" argument.
+        """
+        return subprocess.Popen( cmd
+                                ,stdin=subprocess.PIPE
+                                ,stdout=subprocess.PIPE
+                               )
+
+    def alive(self):
+        """Returns True if both git processes are still running"""
+        return (self._cat_file.poll() is None and
+                self._diff_tree.poll() is None)
+
+    def resolve(self, revs):
+        """Resolves revisions into the SHA-1's of the commits they name
+
+        Args:
+            revs - list of strs, each naming a commit
+        Returns:
+            List with the SHA-1 of each commit, in the same order, or None
+            where a revision doesn't name a commit
+        Raises:
+            OSError or EOFError if git has died
+        """
+        proc = self._cat_file
+        shas = []
+        for i in range(0, len(revs), BATCH_SIZE):
+            batch = revs[i:i+BATCH_SIZE]
+            proc.stdin.write(''.join(r + "^{commit}\n" for r in batch)
+                             .encode("utf-8"))
+            proc.stdin.flush()
+            for r in batch:
+                line = proc.stdout.readline()
+                if not line:
+                    raise EOFError("git cat-file exited")
+                # Names that don't resolve are reported as "<name> missing"
+                # or "<name> ambiguous"
+                sha, kind = line.decode("utf-8").rstrip("\n").rsplit(" ", 1)
+                shas.append(sha if kind == "commit" else None)
+        return shas
+
+    def log_commits(self, shas):
+        """Retrieves the LogCommits of a list of commits
+
+        Args:
+            shas - list of strs with the SHA-1's of the commits
+        Returns:
+            List of the LogCommit objects, in the same order
+        Raises:
+            OSError or EOFError if git has died
+        """
+        proc = self._diff_tree
+        parser = MachineLogParser()
+        tail = len(self._end)
+        for i in range(0, len(shas), BATCH_SIZE):
+            batch = shas[i:i+BATCH_SIZE]
+            proc.stdin.write(''.join(c + "\n" for c in batch)
+                             .encode("ascii") + self._end)
+            proc.stdin.flush()
+            data = b""
+            while not data.endswith(self._end):
+                chunk = proc.stdout.read1(READ_CHUNK)
+                if not chunk:
+                    raise EOFError("git diff-tree exited")
+                # Only the data that can't hold the end marker is parsed
+                data += chunk
+                if len(data) > tail:
+                    parser.feed(data[:-tail])
+                    data = data[-tail:]
+            parser.feed(data[:-tail])
+        return parser.close()
+
+    def close(self):
+        """Stops the git processes"""
+        for proc in (self._cat_file, self._diff_tree):
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+            if proc.poll() is None:
+                try:
+                    proc.wait(timeout=1)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+            proc.stdout.close()
+
+
+class GitWorkerPool(object):
+    """The workers for any number of repos, handed out one caller at a time
+
+    Attributes:
+        max_workers - int, the most workers started for each repo
+    """
+    __slots__ = [ "max_workers"
+                 ,"_cond"
+                 ,"_idle"
+                 ,"_started"
+                 ,"_repos"
+                 ,"_closed"
+                ]
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        """Creates the pool, the workers are only started when needed
+
+        Args:
+            max_workers - int, the most workers started for each repo
+        """
+        self.max_workers = max_workers
+        self._cond = threading.Condition()
+        # Per repo, the list of idle workers and the number started
+        self._idle = {}
+        self._started = {}
+        # Per repo, the repo name and the default DefectCommits
+        self._repos = {}
+        self._closed = False
+
+    def _acquire(self, repo_path):
+        """Takes an idle worker for the repo, starting one if the cap
+        allows, or waiting for one to be released
+        """
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise ValueError("GitWorkerPool is closed")
+                idle = self._idle.setdefault(repo_path, [])
+                while idle:
+                    worker = idle.pop()
+                    if worker.alive():
+                        return worker
+                    # Replace the workers whose git processes died
+                    self._discard(worker)
+                if self._started.get(repo_path, 0) < self.max_workers:
+                    self._started[repo_path] = (
+                                    self._started.get(repo_path, 0) + 1)
+                    break
+                self._cond.wait()
+        try:
+            return GitWorker(repo_path)
+        except:
+            with self._cond:
+                self._started[repo_path] -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, worker, broken=False):
+        """Returns a worker to the pool, or discards it if it's broken"""
+        with self._cond:
+            if broken or self._closed:
+                self._discard(worker)
+            else:
+                self._idle[worker.repo_path].append(worker)
+            self._cond.notify()
+
+    def _discard(self, worker):
+        """Stops a worker and frees its place. Called with the lock held"""
+        self._started[worker.repo_path] -= 1
+        worker.close()
+
+    def _repo_info(self, repo_path):
+        """Returns the name of the repo and its default DefectCommits"""
+        info = self._repos.get(repo_path)
+        if info is None:
+            cmd = ["git", "-C", repo_path, "rev-parse", "--show-toplevel"]
+            top = subprocess.check_output(cmd).decode("utf-8").rstrip()
+            repo_name = os.path.basename(top)
+            defects_file = repo_name + ".dfx"
+            if not os.path.exists(defects_file):
+                defects_file = repo_name + ".dft"
+            info = (repo_name, DefectCommits(defects_file))
+            self._repos[repo_path] = info
+        return info
+
+    def commit_recs( self
+                    ,repo_path
+                    ,revs
+                    ,repo_owner=DEFAULT_OWNER
+                    ,defect_commits=None
+                   ):
+        """Looks up the records of a list of commits
+
+        Args:
+            repo_path - str with the pathname of the repo
+            revs - list of strs, each naming a commit, generally its full or
+                    abbreviated SHA-1
+            repo_owner - str specifying the owner of the GitHub (or other
+                    shared system) repo
+            defect_commits - optional DefectCommits object, if not provided
+                    it is loaded, once, from <repo_name>.dfx or
+                    <repo_name>.dft in the current working directory
+        Returns:
+            List of the CommitRec objects, in the order of revs
+        Raises:
+            ValueError if one of revs doesn't name a commit
+        """
+        repo_name, default_defects = self._repo_info(repo_path)
+        if defect_commits is None:
+            defect_commits = default_defects
+        for attempt in range(2):
+            worker = self._acquire(repo_path)
+            try:
+                shas = worker.resolve(revs)
+                for rev, sha in zip(revs, shas):
+                    if sha is None:
+                        raise ValueError("Unknown commit: '{0}'".format(rev))
+                commits = worker.log_commits(shas)
+            except (OSError, EOFError):
+                # The worker died, retry once with a new one
+                self._release(worker, True)
+                if attempt:
+                    raise
+                continue
+            except:
+                self._release(worker)
+                raise
+            self._release(worker)
+            break
+        recs = []
+        for c in commits:
+            recs.extend(c.to_commit_recs(repo_name, repo_owner,
+                                         defect_commits))
+        return recs
+
+    def close(self):
+        """Stops all the idle workers, the busy ones are stopped as they're
+        released
+        """
+        with self._cond:
+            self._closed = True
+            for idle in self._idle.values():
+                for worker in idle:
+                    self._discard(worker)
+                del idle[:]
+            self._cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,202 @@
+"""hunks.py breaks the changes of each commit down into hunks, and records
+the function that encloses each one, so churn, and defect fixes, can be
+tracked below the level of files.
+
+The hunks come from git log -p, with no context lines (-U0). git heads each
+hunk with its line ranges, followed by the line that encloses it, found by
+the diff driver's function heuristics (see "Defining a custom hunk-header"
+in gitattributes(5) for better results on specific languages):
+
+    @@ -<old start>,<old count> +<new start>,<new count> @@ <function>
+
+Without context, the old and new counts are exactly the lines deleted and
+added by the hunk. So only the commit, file and hunk headers are needed,
+and the changed lines themselves are skipped. The patches are typically 10
+to 100 times larger than the --numstat output, so they're never held in
+memory: git's output is read in chunks, and the headers are picked out of
+each chunk with a single regular expression, which skips the changed lines
+without handling them one by one.
+
+The header lines can't be confused with changed lines, which always start
+with "+", "-" or " ", except for the "--- " and "+++ " lines that name the
+files. Those are only read between a "diff --git" line and the first hunk
+of the file.
+
+The hunks are written to:
+
+    <repo_name>-hunks.csv
+
+with one row per hunk:
+
+    repo, commit, file, old_start, lines_deleted, new_start, lines_added,
+    function, is_defect
+
+The commit and file match those of the CommitRec of the file change (files
+that were renamed are named by their new pathname, those that were deleted
+by their old one). Merge commits and binary files have no hunks.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import re
+import csv
+import itertools
+
+from check_commits.check_commits import read_chunks
+from check_commits.szz import unquote_path
+
+COLUMNS = [ "repo"
+           ,"commit"
+           ,"file"
+           ,"old_start"
+           ,"lines_deleted"
+           ,"new_start"
+           ,"lines_added"
+           ,"function"
+           ,"is_defect"
+          ]
+
+# git log arguments for the patches. The commits are marked by a NUL, which
+# can't start a line of a text patch, followed by the SHA-1 and the author
+# date
+HUNK_LOG_ARGS = [ "-c", "core.quotePath=false"
+                 ,"log"
+                 ,"-p"
+                 ,"-U0"
+                 ,"--no-prefix"
+                 ,"--no-color"
+                 ,"--no-ext-diff"
+                 ,"--format=%x00%H %at"
+                ]
+
+# Each line that matters, preceded by its newline, so the search for the
+# next one is a fast search for "\n"
+_HEADER_RE = re.compile(br"\n(?:"
+                        br"\x00([0-9a-f]+) (\d+)"
+                        br"|(diff) --git "
+                        br"|--- ([^\n]*)"
+                        br"|\+\+\+ ([^\n]*)"
+                        br"|@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?"
+                        br"([^\n]*))")
+
+_DEV_NULL = b"/dev/null"
+
+
+def iter_hunks(chunks, log_filter=None):
+    """Generator that parses patches into hunks
+
+    Args:
+        chunks - iterable of bytes, the output of git log with
+                HUNK_LOG_ARGS, in chunks of any size
+        log_filter - optional check_commits.LogFilter, whose date range is
+                checked against the author dates, as the parsers do
+    Yields:
+        Tuples of the commit, file, old start, lines deleted, new start,
+        lines added and function, for each hunk
+    """
+    commit = None
+    old_path = None
+    new_path = None
+    path = None
+    in_header = False
+    # The first line isn't preceded by a newline
+    carry = b"\n"
+    # The final newline completes the last line, should it lack one
+    for chunk in itertools.chain(chunks, (b"\n",)):
+        buf = carry + chunk
+        # Only complete lines are searched
+        end = buf.rfind(b"\n")
+        for m in _HEADER_RE.finditer(buf, 0, end):
+            if m.group(1) is not None:
+                commit = m.group(1).decode("ascii")
+                if (log_filter is not None and
+                        not log_filter.keep(int(m.group(2)))):
+                    commit = None
+                in_header = False
+            elif m.group(3) is not None:
+                in_header = True
+                old_path = None
+                new_path = None
+            elif m.group(6) is not None:
+                if in_header:
+                    in_header = False
+                    # Added and deleted files have /dev/null on one side
+                    path = unquote_path(new_path if new_path != _DEV_NULL
+                                        else old_path)
+                if commit is None:
+                    continue
+                deleted = m.group(7)
+                added = m.group(9)
+                yield ( commit
+                       ,path
+                       ,int(m.group(6))
+                       ,1 if deleted is None else int(deleted)
+                       ,int(m.group(8))
+                       ,1 if added is None else int(added)
+                       ,m.group(10).decode("utf-8", "replace").strip()
+                      )
+            elif in_header:
+                # Names with spaces are followed by a tab
+                if m.group(4) is not None:
+                    old_path = m.group(4).rstrip(b"\t")
+                else:
+                    new_path = m.group(5).rstrip(b"\t")
+        carry = buf[end:]
+
+
+def write_hunks( cmd_root
+                ,repo_name
+                ,revs
+                ,path
+                ,defects=None
+                ,append=False
+                ,log_filter=None
+               ):
+    """Extracts the hunks of the commits, and writes them
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                targets the repo
+        repo_name - str containing the name of the repo
+        revs - list of strs with the revisions for git log to walk
+        path - pathname of the output file
+        defects - optional set of the SHA-1's of the defect commits
+        append - bool, if True, add the rows to an existing file
+        log_filter - optional check_commits.LogFilter object that limits
+                the commits and files
+    Returns:
+        The number of hunks written
+    """
+    defects = defects if defects else set()
+    args = log_filter.args(revs) if log_filter is not None else revs
+    chunks = read_chunks(cmd_root + HUNK_LOG_ARGS + args)
+    count = 0
+    with open(path, 'a' if append else 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        if not append:
+            writer.writerow(COLUMNS)
+        for hunk in iter_hunks(chunks, log_filter):
+            writer.writerow((repo_name,) + hunk + (hunk[0] in defects,))
+            count += 1
+    return count
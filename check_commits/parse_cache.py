@@ -0,0 +1,408 @@
+"""parse_cache.py keeps the parsed records of each commit in a persistent,
+on-disk, cache so that commits are only extracted from git, and parsed, once.
+
+Commits are immutable, so the records of a commit only depend on its SHA-1,
+and on the inputs that shape its records: the log engine, and the defect
+commits file and classifier rules that determine its is_defect flag. These
+inputs are combined into a fingerprint, which is part of the key of each
+cache entry, so changing any of them makes the existing entries miss rather
+than return stale records. The cache holds no repo specific data (the repo
+name and owner are filled in when the records are produced), so forks and
+mirrors that share history share cache entries.
+
+A run with the cache lists the commits to process with git rev-list, which
+uses the same ordering as git log, and checks which of them are cached.
+Only the commits that miss are extracted, with git log --no-walk --stdin,
+which shows the commits in the order given. The results are merged back
+with the cached records in log order, so the outputs are exactly those of
+an uncached run. The commits are walked LOOKUP_BATCH at a time: the cached
+entries of a batch are only loaded when it's reached, and the entries of
+the commits that were parsed are stored once it's done, so neither is held
+for the whole history, and an interrupted run keeps what it parsed.
+
+The cache is an SQLite database:
+
+    <cache_dir>/parse-cache.sqlite
+
+Each entry records when it was last used. Once the entries grow beyond the
+size limit, the least recently used are evicted.
+
+Each entry also records the classifier rule (see classifier.py) that fired
+for the commit, which is replayed into the classifier when the entry is
+used, so its statistics cover the cached commits too. Only the rule that
+fired is counted as matching a cached commit's message, any other rules
+that matched it, and the time taken to match them, aren't.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import itertools
+import subprocess
+
+from check_commits.check_commits import CommitRec
+from check_commits.check_commits import iter_commit_recs
+from check_commits.check_commits import extract_parallel
+
+CACHE_NAME = "parse-cache.sqlite"
+# Bumped whenever the format of the cached records, or the way they are
+# classified, changes
+CACHE_VERSION = 3
+# Number of SHA-1's looked up (or touched) per SQL statement, kept below
+# SQLite's limit on the number of parameters
+LOOKUP_BATCH = 500
+# Seconds to wait for another process that holds the database lock
+LOCK_TIMEOUT = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    sha TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (sha, fingerprint)
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+def file_digest(path):
+    """Returns the SHA-1 hex digest of a file's contents, or None if the
+    file doesn't exist
+    """
+    h = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+
+def fingerprint(engine, defects_file, classifier=None, extra=None):
+    """Combines the inputs that shape the records of a commit into a str
+
+    Args:
+        engine - str with the log engine, "machine" or "regex"
+        defects_file - pathname of the defect commits file (text or index)
+        classifier - optional classifier.DefectClassifier, if None the
+                    built in CommitRec.DEFECT_REGEX is assumed
+        extra - optional JSON serializable value with any other inputs
+                    that affect the records
+    Returns:
+        str holding the SHA-1 hex digest of the inputs
+    """
+    if classifier is not None:
+        rules = classifier.fingerprint()
+    else:
+        rules = CommitRec.DEFECT_REGEX.pattern
+    inputs = [CACHE_VERSION, engine, rules, file_digest(defects_file), extra]
+    canon = json.dumps(inputs, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(canon).hexdigest()
+
+
+class ParseCache(object):
+    """The on-disk cache of parsed commits
+
+    Each entry holds the records of one commit, pickled as a tuple of the
+    author, timestamp, defect flag, a list of (file, lines added, lines
+    deleted) tuples, one per file changed, and the name of the classifier
+    rule that fired for it (or None).
+
+    Attributes:
+        path - pathname of the SQLite database
+        fp - the fingerprint of the inputs of this run
+        max_bytes - int, the size above which entries are evicted
+        hits - number of commits found in the cache
+        misses - number of commits that were not found
+    """
+    __slots__ = [ "path"
+                 ,"fp"
+                 ,"max_bytes"
+                 ,"hits"
+                 ,"misses"
+                 ,"_db"
+                ]
+
+    def __init__(self, cache_dir, fp, max_bytes):
+        """Opens, creating if need be, the cache
+
+        Args:
+            cache_dir - str with the directory holding the cache
+            fp - str, the fingerprint of the inputs of this run
+            max_bytes - int, the size above which entries are evicted
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_NAME)
+        self.fp = fp
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+        self._db.executescript(_SCHEMA)
+
+    def present(self, shas):
+        """Checks which of a collection of commits are cached, without
+        loading their entries
+
+        Args:
+            shas - list of strs with the SHA-1's of the commits
+        Returns:
+            Set of the SHA-1's of the commits found
+        """
+        found = set()
+        for i in range(0, len(shas), LOOKUP_BATCH):
+            batch = shas[i:i+LOOKUP_BATCH]
+            marks = ",".join("?" * len(batch))
+            sql = ("SELECT sha FROM entries "
+                   "WHERE fingerprint = ? AND sha IN ({0})").format(marks)
+            found.update(r[0] for r in self._db.execute(sql,
+                                                        [self.fp] + batch))
+        return found
+
+    def lookup(self, shas):
+        """Retrieves the cached entries for a collection of commits
+
+        The entries that are found are marked as used.
+
+        Args:
+            shas - list of strs with the SHA-1's of the commits
+        Returns:
+            Dictionary mapping the SHA-1 of each commit found to its pickled
+            entry
+        """
+        found = {}
+        db = self._db
+        for i in range(0, len(shas), LOOKUP_BATCH):
+            batch = shas[i:i+LOOKUP_BATCH]
+            marks = ",".join("?" * len(batch))
+            sql = ("SELECT sha, data FROM entries "
+                   "WHERE fingerprint = ? AND sha IN ({0})").format(marks)
+            found.update(db.execute(sql, [self.fp] + batch))
+        self.hits += len(found)
+        self.misses += len(shas) - len(found)
+        now = time.time()
+        hit_shas = list(found)
+        with db:
+            for i in range(0, len(hit_shas), LOOKUP_BATCH):
+                batch = hit_shas[i:i+LOOKUP_BATCH]
+                marks = ",".join("?" * len(batch))
+                sql = ("UPDATE entries SET last_used = ? "
+                       "WHERE fingerprint = ? AND sha IN ({0})").format(marks)
+                db.execute(sql, [now, self.fp] + batch)
+        return found
+
+    def store(self, entries):
+        """Adds entries to the cache, in a single transaction, then evicts
+        the least recently used entries if the cache has outgrown its limit
+
+        Args:
+            entries - list of (SHA-1, pickled entry) tuples
+        """
+        now = time.time()
+        with self._db as db:
+            db.executemany("INSERT OR REPLACE INTO entries "
+                           "VALUES (?, ?, ?, ?, ?)",
+                           [(sha, self.fp, data, len(data), now)
+                            for sha, data in entries])
+        self.evict()
+
+    def size(self):
+        """Returns the total size, in bytes, of the cached entries"""
+        row = self._db.execute("SELECT SUM(size) FROM entries").fetchone()
+        return row[0] or 0
+
+    def evict(self):
+        """Removes the least recently used entries, until the cache is no
+        larger than max_bytes
+
+        Returns:
+            The number of entries that were removed
+        """
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return 0
+        victims = []
+        rows = self._db.execute("SELECT rowid, size FROM entries "
+                                "ORDER BY last_used")
+        for rowid, size in rows:
+            if excess <= 0:
+                break
+            victims.append((rowid,))
+            excess -= size
+        with self._db as db:
+            db.executemany("DELETE FROM entries WHERE rowid = ?", victims)
+        return len(victims)
+
+    def close(self):
+        """Closes the database"""
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _pack(recs, rule=None):
+    """Pickles the records of one commit, and the name of the classifier
+    rule that fired for it, as a cache entry
+    """
+    first = recs[0] if recs else None
+    files = [(r.file, r.lines_added, r.lines_deleted) for r in recs]
+    if first is None:
+        return pickle.dumps((None, 0, False, files, rule),
+                            pickle.HIGHEST_PROTOCOL)
+    return pickle.dumps((first.author, first.timestamp, first.is_defect,
+                         files, rule), pickle.HIGHEST_PROTOCOL)
+
+
+def _unpack(data, sha, repo_name, repo_owner):
+    """Rebuilds the CommitRecs of one commit from its cache entry
+
+    Returns:
+        Tuple of the list of CommitRecs and the name of the classifier rule
+        that fired for the commit (or None)
+    """
+    author, timestamp, is_defect, files, rule = pickle.loads(data)
+    recs = [CommitRec( repo_name
+                      ,repo_owner
+                      ,timestamp
+                      ,sha
+                      ,path
+                      ,added
+                      ,deleted
+                      ,author
+                      ,is_defect
+                     ) for path, added, deleted in files]
+    return recs, rule
+
+
+def cached_commit_recs( cache
+                       ,cmd_root
+                       ,repo_name
+                       ,repo_owner
+                       ,engine
+                       ,stream
+                       ,revs=None
+                       ,jobs=1
+                       ,defect_commits=None
+                       ,profile=None
+                       ,log_filter=None
+                      ):
+    """Generator that produces the records of a run, using the cache
+
+    Args:
+        cache - the ParseCache object to use
+        jobs - int with the number of worker processes used to extract the
+                    commits that miss, see extract_parallel()
+        The remaining arguments are the same as for iter_commit_recs()
+    Yields:
+        The CommitRec objects, in log order
+    """
+    revs = revs if revs else ["HEAD"]
+    cmd = cmd_root + ["rev-list"]
+    cmd += log_filter.args(revs) if log_filter is not None else revs
+    shas = subprocess.check_output(cmd).decode("ascii").split()
+    cached = cache.present(shas)
+    missing = [c for c in shas if c not in cached]
+
+    def extract(commits, jobs):
+        """Returns an iterator of the records of the commits, in the order
+        given
+        """
+        if not commits:
+            return iter(())
+        elif jobs == 1:
+            input = ''.join(c + "\n" for c in commits).encode("ascii")
+            return iter_commit_recs( cmd_root
+                                    ,repo_name
+                                    ,repo_owner
+                                    ,engine
+                                    ,stream
+                                    ,["--no-walk=unsorted", "--stdin"]
+                                    ,defect_commits
+                                    ,input
+                                    ,profile
+                                    ,log_filter
+                                   )
+        return extract_parallel( cmd_root
+                                ,repo_name
+                                ,repo_owner
+                                ,engine
+                                ,stream
+                                ,jobs=jobs
+                                ,defect_commits=defect_commits
+                                ,shas=commits
+                                ,profile=profile
+                                ,log_filter=log_filter
+                               )
+
+    # The commits that missed are shown in the order given, which is log
+    # order, but commits without any file changes produce no records
+    groups = itertools.groupby(extract(missing, jobs),
+                               key=lambda r: r.commit)
+    group = next(groups, None)
+    classifier = (defect_commits.classifier if defect_commits is not None
+                  else None)
+    for i in range(0, len(shas), LOOKUP_BATCH):
+        batch = shas[i:i+LOOKUP_BATCH]
+        found = cache.lookup(batch)
+        new_entries = []
+        for sha in batch:
+            data = found.get(sha)
+            if data is not None:
+                recs, rule = _unpack(data, sha, repo_name, repo_owner)
+                # Only the commits with records had their messages
+                # classified
+                if classifier is not None and recs:
+                    classifier.replay(sha, rule)
+                for rec in recs:
+                    yield rec
+                continue
+            if sha in cached:
+                # Evicted, by another run, since it was checked
+                recs = list(extract([sha], 1))
+            else:
+                recs = []
+                if group is not None and group[0] == sha:
+                    recs = list(group[1])
+                    group = next(groups, None)
+            rule = (classifier.fired.get(sha) if classifier is not None
+                    else None)
+            new_entries.append((sha, _pack(recs, rule)))
+            for rec in recs:
+                yield rec
+        if new_entries:
+            cache.store(new_entries)
+    if group is not None:
+        raise ValueError("git log produced commit {0} out of order"
+                         .format(group[0]))
@@ -0,0 +1,342 @@
+"""partitions.py splits the JSON, CSV and text outputs into partitions, so
+downstream consumers can load them in parallel, or skip the ones that are
+outside the time window they're interested in.
+
+The records are partitioned either:
+
+    by time - one partition per day, week, month or year (UTC) of the
+              commit timestamps, named for it, e.g. "2015-11", "2015-W45"
+    by size - a new partition every N records, numbered from "00000".
+              A commit's records are never split across two partitions, so
+              a partition may hold a little more than N
+
+Each partition is written, in each of the formats, to:
+
+    <repo_name>-parts/<repo_name>-<partition><extension>
+
+and the partitions are listed in the manifest, <repo_name>-manifest.json:
+
+    { "repo": <repo_name>
+     ,"partition": <"day", "week", "month", "year" or N>
+     ,"rows": <number of records>
+     ,"partitions": [ { "name": <partition>
+                       ,"rows": <number of records>
+                       ,"commits": <number of commits>
+                       ,"min_timestamp": <timestamp of the oldest commit>
+                       ,"max_timestamp": <timestamp of the newest commit>
+                       ,"files": [ { "format": <"json", "ndjson", "csv" or
+                                                "text">
+                                    ,"path": <pathname, relative to the
+                                              manifest>
+                                    ,"bytes": <size of the file>
+                                   }, ...]
+                      }, ...]
+    }
+
+with the partitions in time order: sorted by name, or, for those by size,
+by number, as the names of partitions past "99999" grow longer.
+
+The records arrive in log order, which is only roughly time order, so any
+number of time partitions may be receiving records at once. At most
+MAX_OPEN_PARTITIONS are kept open, the least recently used is closed when
+another is needed, and reopened in append mode if more of its records turn
+up. When appending, in incremental runs, the manifest of the earlier run is
+loaded, and the partitions it lists are extended in the same way.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import json
+import collections
+
+from check_commits.writers import RecordSink
+from check_commits.rollups import time_buckets
+
+# Number of partitions whose files are kept open at the same time
+MAX_OPEN_PARTITIONS = 32
+
+PERIODS = ["day", "week", "month", "year"]
+
+# Selects the time bucket of a period from those of rollups.time_buckets()
+_PERIOD_KEYS = { "day":lambda b: b[0]
+                ,"week":lambda b: b[1]
+                ,"month":lambda b: b[2]
+                ,"year":lambda b: b[2][:4]
+               }
+
+
+def parse_partition(spec):
+    """Validates the specification of the partitions
+
+    Args:
+        spec - str or int, one of PERIODS, or the number of records in each
+                partition
+    Returns:
+        The period str, or the int number of records
+    Raises:
+        ValueError if the specification isn't valid
+    """
+    if spec in PERIODS:
+        return spec
+    try:
+        rows = int(spec)
+    except (TypeError, ValueError):
+        rows = 0
+    if rows <= 0:
+        raise ValueError("Partitions must be by {0}, or a positive number "
+                         "of records, not '{1}'"
+                         .format(", ".join(PERIODS), spec))
+    return rows
+
+
+def manifest_path(out_dir, repo_name):
+    """Builds the pathname of the manifest of a repo's partitions"""
+    return os.path.join(out_dir, repo_name + "-manifest.json")
+
+
+class PartitionSink(RecordSink):
+    """Writes each record to its partition, in every format, and the
+    manifest when closed
+
+    Attributes:
+        out_dir - str with the directory that holds the manifest
+        repo_name - str containing the name of the repo
+        partition - the period str, or the int number of records in each
+                partition, see parse_partition()
+        formats - list of (format, extension, sink class) tuples, where the
+                sink class is one of the writers.RecordSink classes that
+                takes the pathname, append flag and compression
+        compression - optional compress.Compression object passed to the
+                sinks
+        entries - dictionary that maps the name of each partition to its
+                manifest entry
+    """
+    __slots__ = [ "out_dir"
+                 ,"repo_name"
+                 ,"partition"
+                 ,"formats"
+                 ,"compression"
+                 ,"entries"
+                 ,"_open"
+                 ,"_commit"
+                 ,"_entry"
+                 ,"_writes"
+                 ,"_last"
+                ]
+
+    def __init__( self
+                 ,out_dir
+                 ,repo_name
+                 ,partition
+                 ,formats
+                 ,append=False
+                 ,compression=None
+                ):
+        """Prepares the partitions, loading the manifest when appending
+
+        Args:
+            out_dir - str with the directory that receives the outputs
+            repo_name - str containing the name of the repo
+            partition - str or int, see parse_partition()
+            formats - list of (format, extension, sink class) tuples
+            append - bool, if True, extend the partitions of an earlier run
+            compression - optional compress.Compression object
+        """
+        RecordSink.__init__(self, manifest_path(out_dir, repo_name), None)
+        self.out_dir = out_dir
+        self.repo_name = repo_name
+        self.partition = parse_partition(partition)
+        self.formats = formats
+        self.compression = compression
+        self.entries = {}
+        # The sinks of the open partitions, least recently used first
+        self._open = collections.OrderedDict()
+        self._commit = None
+        self._entry = None
+        self._writes = None
+        self._last = None
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                old = json.load(f)["partitions"]
+            if append:
+                for entry in old:
+                    self.entries[entry["name"]] = entry
+                if self.entries:
+                    self._last = max(self.entries, key=self._order)
+            else:
+                # The partitions of the earlier run are replaced
+                for entry in old:
+                    for f in entry["files"]:
+                        path = os.path.join(out_dir, f["path"])
+                        if os.path.exists(path):
+                            os.remove(path)
+        os.makedirs(os.path.join(out_dir, self._parts_dir()), exist_ok=True)
+
+    def _order(self, name):
+        """Returns the sort key of a partition's name, its number for the
+        partitions by size
+        """
+        return int(name) if isinstance(self.partition, int) else name
+
+    def _parts_dir(self):
+        """Returns the directory of the partitions, relative to out_dir"""
+        return self.repo_name + "-parts"
+
+    def _name(self, timestamp):
+        """Returns the name of the partition of the next commit"""
+        if not isinstance(self.partition, int):
+            key = _PERIOD_KEYS[self.partition]
+            return key(time_buckets(timestamp))
+        last = self.entries.get(self._last)
+        if last is None:
+            return "{0:05d}".format(0)
+        if last["rows"] < self.partition:
+            return self._last
+        return "{0:05d}".format(int(self._last) + 1)
+
+    def _select(self, name):
+        """Opens the sinks of a partition, if they aren't open, and makes
+        it the current one
+        """
+        entry = self.entries.get(name)
+        sinks = self._open.get(name)
+        if sinks is not None:
+            self._open.move_to_end(name)
+        else:
+            while len(self._open) >= MAX_OPEN_PARTITIONS:
+                for s in self._open.popitem(last=False)[1]:
+                    s.close()
+            append = entry is not None
+            if entry is None:
+                entry = self.entries[name] = { "name":name
+                                              ,"rows":0
+                                              ,"commits":0
+                                              ,"min_timestamp":None
+                                              ,"max_timestamp":None
+                                              ,"files":[]
+                                             }
+                for fmt, ext, sink_class in self.formats:
+                    path = os.path.join(self._parts_dir(), ''.join(
+                                        [self.repo_name, "-", name, ext]))
+                    entry["files"].append({ "format":fmt
+                                           ,"path":path
+                                           ,"bytes":0
+                                          })
+            sinks = []
+            try:
+                for f, (fmt, ext, sink_class) in zip(entry["files"],
+                                                      self.formats):
+                    path = os.path.join(self.out_dir, f["path"])
+                    sinks.append(sink_class(path, append, self.compression))
+            except:
+                for s in sinks:
+                    s.close()
+                raise
+            self._open[name] = sinks
+        if (self._last is None or
+                self._order(name) > self._order(self._last)):
+            self._last = name
+        self._entry = entry
+        self._writes = [s.write for s in sinks]
+
+    def write(self, vals):
+        commit = vals[3]
+        if commit != self._commit:
+            self._commit = commit
+            timestamp = vals[2]
+            self._select(self._name(timestamp))
+            entry = self._entry
+            entry["commits"] += 1
+            if (entry["min_timestamp"] is None or
+                    timestamp < entry["min_timestamp"]):
+                entry["min_timestamp"] = timestamp
+            if (entry["max_timestamp"] is None or
+                    timestamp > entry["max_timestamp"]):
+                entry["max_timestamp"] = timestamp
+        self._entry["rows"] += 1
+        for w in self._writes:
+            w(vals)
+
+    def close(self):
+        """Closes the partitions, and writes the manifest"""
+        try:
+            for sinks in self._open.values():
+                for s in sinks:
+                    s.close()
+        finally:
+            self._open.clear()
+            self._writes = None
+            self._write_manifest()
+
+    def _write_manifest(self):
+        """Writes the manifest, replacing the old one only once the new one
+        is complete
+        """
+        entries = [self.entries[name]
+                   for name in sorted(self.entries, key=self._order)]
+        for entry in entries:
+            for f in entry["files"]:
+                path = os.path.join(self.out_dir, f["path"])
+                f["bytes"] = (os.path.getsize(path) if os.path.exists(path)
+                              else 0)
+        manifest = { "repo":self.repo_name
+                    ,"partition":self.partition
+                    ,"rows":sum(e["rows"] for e in entries)
+                    ,"partitions":entries
+                   }
+        with open(self.path + ".tmp", 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def partition_files(path, fmt=None, start=None, end=None):
+    """Lists the partition files of a manifest, for loading them in
+    parallel
+
+    Args:
+        path - pathname of the manifest
+        fmt - optional str, "json", "ndjson", "csv" or "text", only the
+                files of the format are listed
+        start - optional timestamp, the partitions whose commits are all
+                older are left out
+        end - optional timestamp, the partitions whose commits are all
+                newer are left out
+    Returns:
+        List of the pathnames of the files, in partition order
+    """
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    base = os.path.dirname(path)
+    paths = []
+    for entry in manifest["partitions"]:
+        if not entry["rows"]:
+            continue
+        if start is not None and entry["max_timestamp"] < start:
+            continue
+        if end is not None and entry["min_timestamp"] > end:
+            continue
+        for f in entry["files"]:
+            if fmt is None or f["format"] == fmt:
+                paths.append(os.path.join(base, f["path"]))
+    return paths
@@ -0,0 +1,351 @@
+"""profiler.py breaks the time, and memory, of a run down by phase, so it's
+clear whether a slow run is waiting on git, decoding its output, parsing the
+commits, loading the defect commits or writing the outputs.
+
+Most of a run is a chain of generators: git's output is read, decoded and
+parsed as the writers ask for the next record. So rather than timing each
+phase from start to finish, the profile keeps a stack of the active phases
+and charges the wall and CPU time that elapses to the phase on top of it.
+Each generator in the chain is wrapped (see RunProfile.iterate()), so the
+time spent producing its next item is charged to its own phase, and not to
+the phases that consume its items. The times of the phases are therefore
+exclusive, and add up to the time of the run.
+
+The phases are:
+
+    setup           finding the repo and, when incremental, its refs
+    classifier      loading the classifier config
+    defect_commits  loading the defect commits file or index
+    git_log         waiting for, and reading, the output of git log
+    decode          decoding that output ("regex" engine only, the
+                    "machine" engine decodes as it parses)
+    find_commits    splitting the log into commit blocks ("regex" only)
+    parse           parsing the commits into records
+    store           collecting the records, when they're not streamed
+    extract_parallel
+                    waiting for the worker processes of a parallel run,
+                    whose own phases are reported separately
+    cache           looking up, unpacking and storing cached commits
+    writers         writing the output files
+    szz             blaming the lines changed by the defect commits
+    hunks           reading, and parsing, the patches of the commits
+    refs            finding the branches of every commit, for --all-refs
+    count_commits   counting the commits walked, for the counters below
+    finish          writing the classifier statistics and the state
+    other           anything outside the phases above, such as importing
+                    the modules the options need
+
+Along with its times, each phase records the process's memory high-water
+mark when the phase last finished. The high-water mark only ever rises, so
+the first phase with a large value is the one that needed the memory. The
+CPU time and high-water mark of git itself are reported separately.
+
+The counters cover the commits walked, the commits and file records that
+were written, the commits flagged as defect fixes, the commits skipped
+because they have no file changes (merges, mostly) and, when the parse
+cache is used, its hits and misses.
+
+Optionally, the run is also profiled with cProfile. The functions with the
+highest cumulative times are listed in the stats, and the complete profile
+is saved for pstats, or any tool that reads its format.
+
+The stats are written, as JSON, to:
+
+    <repo_name>-profile.json
+    <repo_name>-profile.pstats (with cProfile)
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import sys
+import time
+import json
+import pstats
+import cProfile
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the memory isn't reported
+    resource = None
+
+# Number of functions, by cumulative time, listed from the cProfile results
+TOP_FUNCTIONS = 25
+
+# Returned by next() once an iterator is exhausted
+_END = object()
+
+
+def peak_rss_mb(who=None):
+    """Returns the memory high-water mark, in MB, of this process or, with
+    who set to resource.RUSAGE_CHILDREN, of its largest finished child, or
+    None if it can't be determined
+    """
+    if resource is None:
+        return None
+    if who is None:
+        who = resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and KB elsewhere
+    if sys.platform == "darwin":
+        peak /= 1024.0
+    return peak / 1024.0
+
+
+def children_cpu_seconds():
+    """Returns the CPU time used by the finished children of this process,
+    or None if it can't be determined
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class RunProfile(object):
+    """The phase timings and counters of a run
+
+    Attributes:
+        phases - dictionary mapping each phase name to a list of its wall
+                    seconds, CPU seconds and peak RSS in MB (or None)
+        worker_phases - dictionary of the same form, with the totals of the
+                    phases of the worker processes of parallel runs
+        counters - dictionary mapping each counter name to its value
+        cprofile - cProfile.Profile object, when the run is also profiled
+                    with cProfile, else None
+    """
+    __slots__ = [ "phases"
+                 ,"worker_phases"
+                 ,"counters"
+                 ,"cprofile"
+                 ,"_stack"
+                 ,"_wall"
+                 ,"_cpu"
+                 ,"_start"
+                ]
+
+    def __init__(self, use_cprofile=False):
+        """Starts the clocks of the run
+
+        Args:
+            use_cprofile - bool, if True, also profile the run with cProfile,
+                    between calls to enable() and disable()
+        """
+        self.phases = {"other":[0.0, 0.0, None]}
+        self.worker_phases = {}
+        self.counters = {}
+        self.cprofile = cProfile.Profile() if use_cprofile else None
+        # The "other" phase is never popped
+        self._stack = ["other"]
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._start = (self._wall, self._cpu)
+
+    def enable(self):
+        """Starts cProfile, if used"""
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def disable(self):
+        """Stops cProfile, if used"""
+        if self.cprofile is not None:
+            self.cprofile.disable()
+
+    def _charge(self):
+        """Charges the time since the last change of phase to the phase on
+        top of the stack
+        """
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        stats = self.phases[self._stack[-1]]
+        stats[0] += wall - self._wall
+        stats[1] += cpu - self._cpu
+        self._wall = wall
+        self._cpu = cpu
+
+    def push(self, name):
+        """Makes name the active phase, until the matching pop()"""
+        self._charge()
+        if name not in self.phases:
+            self.phases[name] = [0.0, 0.0, None]
+        self._stack.append(name)
+
+    def pop(self, sample=True):
+        """Returns to the phase that was active before the last push()
+
+        Args:
+            sample - bool, if True, record the memory high-water mark as
+                    the phase's peak RSS
+        """
+        self._charge()
+        name = self._stack.pop()
+        if sample:
+            self.phases[name][2] = peak_rss_mb()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager that charges the time of its body to a phase"""
+        self.push(name)
+        try:
+            yield
+        finally:
+            self.pop()
+
+    def iterate(self, name, iterable):
+        """Generator that charges the time taken to produce each item of an
+        iterable to a phase
+
+        Args:
+            name - str with the name of the phase
+            iterable - the iterable, generally a generator
+        Yields:
+            The items of the iterable
+        """
+        it = iter(iterable)
+        while True:
+            self.push(name)
+            try:
+                item = next(it, _END)
+            finally:
+                # Sampling the memory for every item would cost more than
+                # the items, it's sampled once they've all been produced
+                self.pop(False)
+            if item is _END:
+                self.phases[name][2] = peak_rss_mb()
+                return
+            yield item
+
+    def count_records(self, recs):
+        """Generator that counts the records, commits and defect commits
+
+        Args:
+            recs - iterable of CommitRec objects, in log order
+        Yields:
+            The CommitRec objects
+        """
+        records = 0
+        commits = 0
+        defects = 0
+        last = None
+        for rec in recs:
+            records += 1
+            if rec.commit != last:
+                last = rec.commit
+                commits += 1
+                if rec.is_defect:
+                    defects += 1
+            yield rec
+        self.count("records", records)
+        self.count("commits", commits)
+        self.count("defect_commits", defects)
+
+    def count(self, name, n=1):
+        """Adds n to a counter"""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge_workers(self, other):
+        """Adds the phase times of a worker's RunProfile to worker_phases,
+        keeping the highest peak RSS
+        """
+        for name, (wall, cpu, peak) in other.phases.items():
+            stats = self.worker_phases.setdefault(name, [0.0, 0.0, None])
+            stats[0] += wall
+            stats[1] += cpu
+            if peak is not None and (stats[2] is None or peak > stats[2]):
+                stats[2] = peak
+
+    def to_dict(self):
+        """Returns the profile as a dictionary, for serialization"""
+        def phase_dict(phases):
+            return {name:{ "wall_seconds":wall
+                          ,"cpu_seconds":cpu
+                          ,"peak_rss_mb":peak
+                         } for name, (wall, cpu, peak) in phases.items()}
+
+        self._charge()
+        self.phases["other"][2] = peak_rss_mb()
+        od = { "wall_seconds":time.perf_counter() - self._start[0]
+              ,"cpu_seconds":time.process_time() - self._start[1]
+              ,"peak_rss_mb":peak_rss_mb()
+              ,"phases":phase_dict(self.phases)
+              ,"counters":self.counters
+             }
+        if resource is not None:
+            od["git"] = { "cpu_seconds":children_cpu_seconds()
+                         ,"peak_rss_mb":peak_rss_mb(resource.RUSAGE_CHILDREN)
+                        }
+        if self.worker_phases:
+            od["worker_phases"] = phase_dict(self.worker_phases)
+        if self.cprofile is not None:
+            od["functions"] = self.top_functions()
+        return od
+
+    def top_functions(self, limit=TOP_FUNCTIONS):
+        """Lists the functions with the highest cumulative times, from the
+        cProfile results
+
+        Returns:
+            List of dictionaries, each holding the function, its number of
+            calls and its own and cumulative times, in seconds
+        """
+        stats = pstats.Stats(self.cprofile)
+        rows = []
+        for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+            filename, line, fname = func
+            rows.append({ "function":"{0}:{1}({2})".format( filename
+                                                           ,line
+                                                           ,fname
+                                                          )
+                         ,"calls":nc
+                         ,"own_seconds":tt
+                         ,"cumulative_seconds":ct
+                        })
+        rows.sort(key=lambda r: r["cumulative_seconds"], reverse=True)
+        return rows[:limit]
+
+    def write(self, stats_path, pstats_path=None, extra=None):
+        """Writes the stats and, with cProfile, the complete profile
+
+        Args:
+            stats_path - pathname of the JSON file for the stats
+            pstats_path - optional pathname of the file that receives the
+                    cProfile results, in the format read by pstats
+            extra - optional dictionary of other values, such as the
+                    options of the run, added to the stats
+        """
+        od = self.to_dict()
+        if extra:
+            od.update(extra)
+        with open(stats_path, 'w') as f:
+            json.dump(od, f, indent=1, sort_keys=True)
+        if pstats_path is not None and self.cprofile is not None:
+            self.cprofile.dump_stats(pstats_path)
+
+    def __getstate__(self):
+        """Only the results are pickled, for sending back from a worker"""
+        return (self.phases, self.counters)
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.phases, self.counters = state
@@ -0,0 +1,412 @@
+"""rollups.py computes aggregate churn and defect statistics in the same pass
+that writes the records, so consumers don't have to recompute them from the
+raw per-file records.
+
+The records are grouped by file, by directory (each leading directory of the
+file's path, down to DIR_DEPTH levels, files at the top of the repo are
+grouped under "."), by author and by the UTC day, ISO week and month of the
+commit. For each group, the totals are:
+
+    lines_added    lines added by the changes in the group
+    lines_deleted  lines deleted by the changes in the group
+    churn          lines_added + lines_deleted
+    commits        number of distinct commits with changes in the group
+    defect_commits number of those commits that are associated with fixing
+                   a defect
+    defect_ratio   defect_commits / commits
+
+Each group only needs a handful of counters, however many records it has.
+The commits are counted without remembering them, since the records of a
+commit arrive together: a group only counts a commit if it differs from the
+last one it counted.
+
+Each grouping is written to its own CSV file, sorted by group:
+
+    <repo_name>-rollup-file.csv
+    <repo_name>-rollup-dir.csv
+    <repo_name>-rollup-author.csv
+    <repo_name>-rollup-day.csv
+    <repo_name>-rollup-week.csv
+    <repo_name>-rollup-month.csv
+
+When NumPy is available, the per-file and per-directory totals, which are
+updated for every record, are accumulated in chunks of records with
+vectorized operations. Otherwise, or if USE_NUMPY is False, every record
+updates them as it arrives. Both produce the same results.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import csv
+from array import array
+from datetime import datetime
+from datetime import timezone
+
+from check_commits.writers import RecordSink
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of leading directories of a path that are rolled up
+DIR_DEPTH = 2
+# Gates the vectorized path, when NumPy is available
+USE_NUMPY = True
+# Number of records accumulated before a vectorized update
+CHUNK_RECORDS = 1 << 16
+
+GROUPINGS = ["file", "dir", "author", "day", "week", "month"]
+COLUMNS = [ "lines_added"
+           ,"lines_deleted"
+           ,"churn"
+           ,"commits"
+           ,"defect_commits"
+           ,"defect_ratio"
+          ]
+
+# Indices of the counters of a group
+_ADDED = 0
+_DELETED = 1
+_COMMITS = 2
+_DEFECTS = 3
+_LAST = 4
+_SECONDS_PER_DAY = 86400
+
+
+def dir_prefixes(path, depth=DIR_DEPTH):
+    """Returns the leading directories of a pathname
+
+    Args:
+        path - str with the pathname of a file, using "/" separators
+        depth - int, the maximum number of directories returned
+    Returns:
+        Tuple of strs, e.g. ("src", "src/core") for "src/core/a/b.py", or
+        (".",) for a file at the top of the repo
+    """
+    parts = path.split("/")[:-1]
+    if not parts:
+        return (".",)
+    return tuple("/".join(parts[:n+1]) for n in range(min(depth, len(parts))))
+
+
+def time_buckets(timestamp):
+    """Returns the day, ISO week and month that contain a timestamp
+
+    Args:
+        timestamp - float, the timestamp of a commit
+    Returns:
+        Tuple of strs, such as ("2015-11-03", "2015-W45", "2015-11")
+    """
+    dt = datetime.fromtimestamp(timestamp, timezone.utc)
+    year, week, _ = dt.isocalendar()
+    return ( dt.strftime("%Y-%m-%d")
+            ,"{0:04d}-W{1:02d}".format(year, week)
+            ,dt.strftime("%Y-%m")
+           )
+
+
+def _bump(groups, key, added, deleted, seq, is_defect):
+    """Adds a change, from the commit numbered seq, to a group"""
+    g = groups.get(key)
+    if g is None:
+        g = groups[key] = [0, 0, 0, 0, -1]
+    g[_ADDED] += added
+    g[_DELETED] += deleted
+    if g[_LAST] != seq:
+        g[_LAST] = seq
+        g[_COMMITS] += 1
+        if is_defect:
+            g[_DEFECTS] += 1
+
+
+def rollup_path(out_dir, repo_name, grouping):
+    """Builds the pathname of the output file for a grouping"""
+    return os.path.join(out_dir, ''.join([repo_name, "-rollup-", grouping,
+                                          ".csv"]))
+
+
+class RollupSink(RecordSink):
+    """Accumulates the rollups and writes them when closed
+
+    When appending, the totals of the existing rollup files are loaded
+    first, and the new records are added to them.
+
+    Attributes:
+        groups - dictionary mapping each grouping to a dictionary of its
+                groups, each of which maps the group to a list of its
+                counters
+    """
+    __slots__ = [ "groups"
+                 ,"out_dir"
+                 ,"repo_name"
+                 ,"_use_numpy"
+                 ,"_seq"
+                 ,"_commit"
+                 ,"_author"
+                 ,"_timestamp"
+                 ,"_defect"
+                 ,"_added"
+                 ,"_deleted"
+                 ,"_dirs"
+                 ,"_buckets"
+                 ,"_file_idx"
+                 ,"_file_keys"
+                 ,"_dir_idx"
+                 ,"_dir_keys"
+                 ,"_file_dirs"
+                 ,"_chunk"
+                ]
+
+    def __init__(self, out_dir, repo_name, append=False):
+        """Prepares the groupings
+
+        Args:
+            out_dir - str with the directory that receives the rollup files
+            repo_name - str containing the name of the repo, used to name the
+                    rollup files
+            append - bool, if True, add to the totals of existing files
+        """
+        RecordSink.__init__(self, rollup_path(out_dir, repo_name, "file"),
+                            None)
+        self.out_dir = out_dir
+        self.repo_name = repo_name
+        self.groups = {g:{} for g in GROUPINGS}
+        self._use_numpy = USE_NUMPY and numpy is not None
+        self._seq = -1
+        self._commit = None
+        self._dirs = {}
+        self._buckets = {}
+        if self._use_numpy:
+            # Interned files and directories, with their totals in arrays
+            self._file_idx = {}
+            self._file_keys = []
+            self._dir_idx = {}
+            self._dir_keys = []
+            # For each level of directory, the index of each file's
+            # directory at that level, or -1
+            self._file_dirs = [array('q') for _ in range(DIR_DEPTH)]
+            self._chunk = self._new_chunk()
+        if append:
+            self._load()
+
+    def _new_chunk(self):
+        """Returns empty columns for a chunk of records: file index, commit
+        number, defect flag, lines added and lines deleted
+        """
+        return (array('q'), array('q'), array('b'), array('q'), array('q'))
+
+    def _load(self):
+        """Loads the totals of the existing rollup files"""
+        for grouping in GROUPINGS:
+            path = rollup_path(self.out_dir, self.repo_name, grouping)
+            if not os.path.exists(path):
+                continue
+            groups = self.groups[grouping]
+            with open(path, 'r', newline='') as f:
+                reader = csv.reader(f)
+                next(reader)
+                for row in reader:
+                    groups[row[0]] = [ int(row[1])
+                                      ,int(row[2])
+                                      ,int(row[4])
+                                      ,int(row[5])
+                                      ,-1
+                                     ]
+
+    def write(self, vals):
+        commit = vals[3]
+        if commit != self._commit:
+            self._end_commit()
+            self._commit = commit
+            self._seq += 1
+            self._timestamp = vals[2]
+            self._author = vals[7]
+            self._defect = vals[8]
+            self._added = 0
+            self._deleted = 0
+        path = vals[4]
+        added = vals[5]
+        deleted = vals[6]
+        self._added += added
+        self._deleted += deleted
+        if self._use_numpy:
+            idx = self._file_idx.get(path)
+            if idx is None:
+                idx = self._add_file(path)
+            chunk = self._chunk
+            chunk[0].append(idx)
+            chunk[1].append(self._seq)
+            chunk[2].append(1 if self._defect else 0)
+            chunk[3].append(added)
+            chunk[4].append(deleted)
+        else:
+            seq = self._seq
+            defect = self._defect
+            _bump(self.groups["file"], path, added, deleted, seq, defect)
+            dirs = self._dirs.get(path)
+            if dirs is None:
+                dirs = self._dirs[path] = dir_prefixes(path)
+            groups = self.groups["dir"]
+            for d in dirs:
+                _bump(groups, d, added, deleted, seq, defect)
+
+    def _end_commit(self):
+        """Adds the totals of the commit just completed to the per-commit
+        groupings, and, between commits, processes a full chunk
+        """
+        if self._commit is None:
+            return
+        seq = self._seq
+        defect = self._defect
+        added = self._added
+        deleted = self._deleted
+        _bump(self.groups["author"], self._author, added, deleted, seq,
+              defect)
+        day = int(self._timestamp // _SECONDS_PER_DAY)
+        buckets = self._buckets.get(day)
+        if buckets is None:
+            buckets = self._buckets[day] = time_buckets(self._timestamp)
+        for grouping, key in zip(("day", "week", "month"), buckets):
+            _bump(self.groups[grouping], key, added, deleted, seq, defect)
+        # Only process chunks on commit boundaries, so that no commit is
+        # split between chunks
+        if self._use_numpy and len(self._chunk[0]) >= CHUNK_RECORDS:
+            self._process_chunk()
+
+    def _add_file(self, path):
+        """Interns a file, and its directories, for the vectorized path"""
+        idx = self._file_idx[path] = len(self._file_keys)
+        self._file_keys.append(path)
+        dirs = dir_prefixes(path)
+        for level in range(DIR_DEPTH):
+            d_idx = -1
+            if level < len(dirs):
+                d = dirs[level]
+                d_idx = self._dir_idx.get(d)
+                if d_idx is None:
+                    d_idx = self._dir_idx[d] = len(self._dir_keys)
+                    self._dir_keys.append(d)
+            self._file_dirs[level].append(d_idx)
+        return idx
+
+    def _process_chunk(self):
+        """Adds the records of the current chunk to the file and directory
+        totals, using NumPy
+        """
+        files, seqs, defects, added, deleted = [
+            numpy.frombuffer(col, dtype=col.typecode) if len(col) else
+            numpy.zeros(0, dtype=col.typecode) for col in self._chunk]
+        self._chunk = self._new_chunk()
+        if not len(files):
+            return
+        self._accumulate( self.groups["file"], self._file_keys, files, seqs
+                         ,defects, added, deleted)
+        for level in range(DIR_DEPTH):
+            file_dirs = self._file_dirs[level]
+            dirs = numpy.frombuffer(file_dirs, dtype='q')[files]
+            keep = dirs >= 0
+            self._accumulate( self.groups["dir"], self._dir_keys, dirs[keep]
+                             ,seqs[keep], defects[keep], added[keep]
+                             ,deleted[keep])
+
+    def _accumulate(self, groups, keys, idx, seqs, defects, added, deleted):
+        """Adds a chunk of changes to the groups they belong to
+
+        Args:
+            groups - dictionary of the groups of the grouping
+            keys - list of the group names, by group index
+            idx - array of the index of the group of each change
+            seqs - array of the commit number of each change
+            defects - array of the defect flag of each change
+            added, deleted - arrays of the line counts of each change
+        """
+        n = len(keys)
+        added_tot = numpy.bincount(idx, weights=added, minlength=n)
+        deleted_tot = numpy.bincount(idx, weights=deleted, minlength=n)
+        # Count each (group, commit) pair once. No commit is split between
+        # chunks, so the counts of successive chunks can just be added up
+        pairs = numpy.unique(seqs * n + idx)
+        pair_idx = pairs % n
+        commits = numpy.bincount(pair_idx, minlength=n)
+        defect_seq = numpy.unique(seqs[defects == 1])
+        pair_defect = numpy.isin(pairs // n, defect_seq)
+        defect_tot = numpy.bincount(pair_idx[pair_defect], minlength=n)
+        for i in numpy.unique(idx).tolist():
+            key = keys[i]
+            g = groups.get(key)
+            if g is None:
+                g = groups[key] = [0, 0, 0, 0, -1]
+            g[_ADDED] += int(added_tot[i])
+            g[_DELETED] += int(deleted_tot[i])
+            g[_COMMITS] += int(commits[i])
+            g[_DEFECTS] += int(defect_tot[i])
+
+    def flush(self):
+        """Completes the totals of the records written so far, so they can
+        be read with rows(). More records may be written afterwards
+        """
+        self._end_commit()
+        self._commit = None
+        if self._use_numpy:
+            self._process_chunk()
+
+    def rows(self, grouping):
+        """Lists the totals of a grouping, as of the last flush()
+
+        Args:
+            grouping - str, one of GROUPINGS
+        Returns:
+            List with a list for each group, sorted by group, holding the
+            group and the values of COLUMNS
+        """
+        rows = []
+        groups = self.groups[grouping]
+        for key in sorted(groups):
+            g = groups[key]
+            ratio = (round(float(g[_DEFECTS]) / g[_COMMITS], 4)
+                     if g[_COMMITS] else 0.0)
+            rows.append([ key
+                         ,g[_ADDED]
+                         ,g[_DELETED]
+                         ,g[_ADDED] + g[_DELETED]
+                         ,g[_COMMITS]
+                         ,g[_DEFECTS]
+                         ,ratio
+                        ])
+        return rows
+
+    def close(self):
+        """Completes the rollups and writes their files"""
+        self.flush()
+        for grouping in GROUPINGS:
+            path = rollup_path(self.out_dir, self.repo_name, grouping)
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f, lineterminator=os.linesep)
+                writer.writerow([grouping] + COLUMNS)
+                writer.writerows(self.rows(grouping))
+
+    def abort(self):
+        """Leaves any existing rollup files as they were"""
+        pass
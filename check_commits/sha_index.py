@@ -0,0 +1,268 @@
+"""sha_index.py provides a compact, memory-mappable, index of the commits that
+are known to fix defects, as an alternative to the plain text defect commits
+(.dft) file.
+
+A .dft file with millions of SHA-1's takes hundreds of MB once it's loaded
+into a set of strs. The index holds each SHA-1 in 20 bytes of binary, sorted,
+so it can be memory-mapped and binary searched without being loaded at all.
+The index is built from a .dft file with:
+
+    check-commits --build-dft-index <name>.dft
+
+which writes <name>.dfx alongside it. check_commits uses <repo_name>.dfx, in
+place of <repo_name>.dft, when it exists.
+
+Entries shorter than 40 hex digits are abbreviated SHA-1's, which match any
+commit whose SHA-1 starts with them. Git only abbreviates to a prefix that's
+unique in the repo, but as a repo grows, a prefix may come to match several
+commits. DefectCommits reports such ambiguous prefixes when it finds them.
+
+The file starts with a fixed size header:
+
+    magic        8 bytes, MAGIC
+    full_count   unsigned 64 bit little endian int, number of full SHA-1's
+    prefix_count unsigned 64 bit little endian int, number of abbreviated
+                 SHA-1's
+    lengths      unsigned 64 bit little endian int, bit n is set if there is
+                 an abbreviated SHA-1 of n hex digits
+
+followed by the full SHA-1's, 20 bytes each, in ascending order, then the
+abbreviated ones, each of which is stored as 21 bytes: the hex digits padded
+to 40 with "0" and converted to binary, followed by the number of digits.
+These are also in ascending order.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import re
+import mmap
+import struct
+import binascii
+
+MAGIC = b"CCDFX\x00\x01\x00"
+HEADER = struct.Struct("<8sQQQ")
+
+SHA_LEN = 20
+SHA_HEX_LEN = 2 * SHA_LEN
+PREFIX_LEN = SHA_LEN + 1
+# Git won't abbreviate a SHA-1 to fewer hex digits than this
+MIN_ABBREV = 4
+
+HEX_REGEX = re.compile("[0-9a-f]+$")
+
+
+def is_abbrev(sha):
+    """Checks whether a str is an abbreviated SHA-1
+
+    Args:
+        sha - lower case str to check
+    Returns:
+        True if sha holds between MIN_ABBREV and 39 hex digits
+    """
+    return (MIN_ABBREV <= len(sha) < SHA_HEX_LEN
+            and HEX_REGEX.match(sha) is not None)
+
+
+def _prefix_key(prefix):
+    """Converts an abbreviated SHA-1 to the 21 bytes stored in the index"""
+    padded = prefix + "0" * (SHA_HEX_LEN - len(prefix))
+    return binascii.unhexlify(padded) + bytes([len(prefix)])
+
+
+def is_index(path):
+    """Checks whether a file is an index, rather than a text .dft file
+
+    Args:
+        path - pathname of the file
+    Returns:
+        True if the file starts with MAGIC
+    Raises:
+        OSError if the file can't be read
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def index_path(dft_path):
+    """Returns the pathname of the index built from a .dft file"""
+    return os.path.splitext(dft_path)[0] + ".dfx"
+
+
+def build_index(dft_path, dfx_path=None):
+    """Builds an index from a text file of SHA-1's, one per line
+
+    Blank lines, lines starting with "#" and lines that aren't a (possibly
+    abbreviated) SHA-1 are skipped. Duplicates are removed.
+
+    Args:
+        dft_path - pathname of the text file
+        dfx_path - pathname of the index to write, defaults to dft_path with
+                    its extension replaced by ".dfx"
+    Returns:
+        Tuple of the number of full SHA-1's, the number of abbreviated
+        SHA-1's and the number of lines skipped
+    """
+    if dfx_path is None:
+        dfx_path = index_path(dft_path)
+    full = set()
+    prefixes = set()
+    skipped = 0
+    with open(dft_path, 'r') as f:
+        for l in f:
+            sha = l.strip().lower()
+            if not sha or sha.startswith("#"):
+                continue
+            if len(sha) == SHA_HEX_LEN and HEX_REGEX.match(sha):
+                full.add(binascii.unhexlify(sha))
+            elif is_abbrev(sha):
+                prefixes.add(sha)
+            else:
+                skipped += 1
+    lengths = 0
+    for p in prefixes:
+        lengths |= 1 << len(p)
+    # Write to a temporary file, so a reader never sees a partial index
+    tmp_path = dfx_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(full), len(prefixes), lengths))
+        f.write(b"".join(sorted(full)))
+        f.write(b"".join(sorted(_prefix_key(p) for p in prefixes)))
+    os.replace(tmp_path, dfx_path)
+    return (len(full), len(prefixes), skipped)
+
+
+class ShaIndex(object):
+    """Memory-maps an index and looks SHA-1's up in it
+
+    Attributes:
+        path - pathname of the index
+        full_count - number of full SHA-1's in the index
+        prefix_count - number of abbreviated SHA-1's in the index
+        lengths - list of the lengths of the abbreviated SHA-1's
+    """
+    __slots__ = [ "path"
+                 ,"full_count"
+                 ,"prefix_count"
+                 ,"lengths"
+                 ,"_f"
+                 ,"_mm"
+                 ,"_prefix_off"
+                ]
+
+    def __init__(self, path):
+        """Opens and maps the index
+
+        Args:
+            path - pathname of the index
+        Raises:
+            ValueError if the file isn't an index
+        """
+        self.path = path
+        self._f = open(path, 'rb')
+        self._mm = None
+        try:
+            size = os.fstat(self._f.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError("Not a SHA-1 index: '{0}'".format(path))
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            (magic, self.full_count, self.prefix_count,
+             lengths) = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError("Not a SHA-1 index: '{0}'".format(path))
+            self._prefix_off = HEADER.size + self.full_count * SHA_LEN
+            if size != self._prefix_off + self.prefix_count * PREFIX_LEN:
+                raise ValueError("Truncated SHA-1 index: '{0}'"
+                                 .format(path))
+        except:
+            self.close()
+            raise
+        self.lengths = [n for n in range(SHA_HEX_LEN) if lengths & (1 << n)]
+
+    def _search(self, key, offset, count, width):
+        """Binary search for a record among count records of width bytes
+
+        Returns:
+            True if the record equal to key is present
+        """
+        mm = self._mm
+        lo = 0
+        hi = count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = offset + mid * width
+            rec = mm[start:start + width]
+            if rec < key:
+                lo = mid + 1
+            elif rec > key:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def lookup(self, commit):
+        """Finds the entry, if any, that matches a commit
+
+        Args:
+            commit - str with the full, 40 hex digit, SHA-1 of the commit
+        Returns:
+            commit if it's in the index, the abbreviated SHA-1 that matches
+            it if there is one, otherwise None
+        """
+        sha = binascii.unhexlify(commit)
+        if self._search(sha, HEADER.size, self.full_count, SHA_LEN):
+            return commit
+        for n in self.lengths:
+            prefix = commit[:n]
+            if self._search(_prefix_key(prefix), self._prefix_off,
+                            self.prefix_count, PREFIX_LEN):
+                return prefix
+        return None
+
+    def __contains__(self, commit):
+        return self.lookup(commit) is not None
+
+    def __len__(self):
+        return self.full_count + self.prefix_count
+
+    def close(self):
+        """Unmaps and closes the index"""
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        """Only the pathname is pickled, the index is mapped again when
+        unpickled, e.g. by a worker process
+        """
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
@@ -0,0 +1,249 @@
+"""sqlite_sink.py loads the records of a run into a normalized, indexed,
+SQLite database, so downstream queries (churn per file, defect commits per
+author per month, ...) don't have to scan the flat outputs.
+
+The database holds the following tables:
+
+    repos    id, name, owner
+    commits  id, repo_id, sha, timestamp, author, is_defect
+    files    id, repo_id, path
+    changes  commit_id, file_id, lines_added, lines_deleted
+
+with indexes on the file paths, the authors, the timestamps and the defect
+flags, and a view, "records", that joins them back into rows with the same
+columns as the CSV output.
+
+Any number of repos can be loaded into the same database. Loading a repo
+replaces the records it already has in the database, unless appending (for
+an incremental run), in which case the new records are added to them. Each
+load is a single transaction, so a reader never sees a partially loaded
+repo. When several processes load into the same database, e.g. in batch
+mode, their loads take turns.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import sqlite3
+
+from check_commits.writers import RecordSink
+
+# Number of changes accumulated before they're inserted
+INSERT_BATCH = 10000
+# Seconds to wait for another process that is loading the same database
+LOCK_TIMEOUT = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    UNIQUE (name, owner)
+);
+CREATE TABLE IF NOT EXISTS commits (
+    id INTEGER PRIMARY KEY,
+    repo_id INTEGER NOT NULL REFERENCES repos (id),
+    sha TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    author TEXT NOT NULL,
+    is_defect INTEGER NOT NULL,
+    UNIQUE (repo_id, sha)
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    repo_id INTEGER NOT NULL REFERENCES repos (id),
+    path TEXT NOT NULL,
+    UNIQUE (repo_id, path)
+);
+CREATE TABLE IF NOT EXISTS changes (
+    commit_id INTEGER NOT NULL REFERENCES commits (id),
+    file_id INTEGER NOT NULL REFERENCES files (id),
+    lines_added INTEGER NOT NULL,
+    lines_deleted INTEGER NOT NULL
+);
+CREATE VIEW IF NOT EXISTS records AS
+    SELECT r.name AS repo
+          ,r.owner AS owner
+          ,c.timestamp AS timestamp
+          ,c.sha AS "commit"
+          ,f.path AS file
+          ,ch.lines_added AS lines_added
+          ,ch.lines_deleted AS lines_deleted
+          ,c.author AS author
+          ,c.is_defect AS is_defect
+    FROM changes ch
+    JOIN commits c ON c.id = ch.commit_id
+    JOIN files f ON f.id = ch.file_id
+    JOIN repos r ON r.id = c.repo_id;
+"""
+
+# Created once the records are loaded, since it's quicker to build an
+# index in one go than to maintain it during the inserts
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE INDEX IF NOT EXISTS commits_author ON commits (author);
+CREATE INDEX IF NOT EXISTS commits_timestamp ON commits (timestamp);
+CREATE INDEX IF NOT EXISTS commits_is_defect ON commits (is_defect);
+CREATE INDEX IF NOT EXISTS changes_commit ON changes (commit_id);
+CREATE INDEX IF NOT EXISTS changes_file ON changes (file_id);
+"""
+
+
+class SqliteSink(RecordSink):
+    """Loads the records into an SQLite database
+
+    The load transaction starts with the first record. If there are no
+    records, the repo's rows are still cleared, unless appending, in which
+    case the database isn't changed.
+
+    Attributes:
+        repo_name - str containing the name of the repo
+        repo_owner - str specifying the owner of the repo
+        append - bool, whether the records the repo already has are kept
+    """
+    __slots__ = [ "repo_name"
+                 ,"repo_owner"
+                 ,"append"
+                 ,"_db"
+                 ,"_repo_id"
+                 ,"_last_commit"
+                 ,"_next_commit"
+                 ,"_next_file"
+                 ,"_file_ids"
+                 ,"_commits"
+                 ,"_files"
+                 ,"_changes"
+                ]
+
+    def __init__(self, path, repo_name, repo_owner, append=False):
+        """Opens, creating if need be, the database
+
+        Args:
+            path - pathname of the database, which may already hold other
+                    repos
+            repo_name - str containing the name of the repo
+            repo_owner - str specifying the owner of the repo
+            append - bool, if True, keep the records the repo already has
+                    in the database
+        """
+        RecordSink.__init__(self, path, None)
+        self.repo_name = repo_name
+        self.repo_owner = repo_owner
+        self.append = append
+        # Transactions are managed explicitly
+        self._db = sqlite3.connect( path
+                                   ,timeout=LOCK_TIMEOUT
+                                   ,isolation_level=None
+                                  )
+        self._db.executescript(_SCHEMA)
+        self._repo_id = None
+        self._last_commit = None
+        self._file_ids = {}
+        self._commits = []
+        self._files = []
+        self._changes = []
+
+    def _start(self):
+        """Starts the load transaction and prepares the repo's rows"""
+        db = self._db
+        repo, owner = self.repo_name, self.repo_owner
+        # Take the write lock now, so the ids we hand out stay unique
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("INSERT OR IGNORE INTO repos (name, owner) VALUES (?, ?)",
+                   (repo, owner))
+        self._repo_id = db.execute("SELECT id FROM repos "
+                                   "WHERE name = ? AND owner = ?",
+                                   (repo, owner)).fetchone()[0]
+        if self.append:
+            self._file_ids = dict(db.execute("SELECT path, id FROM files "
+                                             "WHERE repo_id = ?",
+                                             (self._repo_id,)))
+        else:
+            args = (self._repo_id,)
+            db.execute("DELETE FROM changes WHERE commit_id IN "
+                       "(SELECT id FROM commits WHERE repo_id = ?)", args)
+            db.execute("DELETE FROM commits WHERE repo_id = ?", args)
+            db.execute("DELETE FROM files WHERE repo_id = ?", args)
+        self._next_commit = db.execute("SELECT IFNULL(MAX(id), 0) + 1 "
+                                       "FROM commits").fetchone()[0]
+        self._next_file = db.execute("SELECT IFNULL(MAX(id), 0) + 1 "
+                                     "FROM files").fetchone()[0]
+
+    def write(self, vals):
+        (repo, owner, timestamp, commit, file, lines_added, lines_deleted,
+         author, is_defect) = vals
+        if self._repo_id is None:
+            self._start()
+        if commit != self._last_commit:
+            self._last_commit = commit
+            self._commits.append(( self._next_commit
+                                  ,self._repo_id
+                                  ,commit
+                                  ,timestamp
+                                  ,author
+                                  ,1 if is_defect else 0
+                                 ))
+            self._next_commit += 1
+        file_id = self._file_ids.get(file)
+        if file_id is None:
+            file_id = self._file_ids[file] = self._next_file
+            self._files.append((file_id, self._repo_id, file))
+            self._next_file += 1
+        self._changes.append(( self._next_commit - 1
+                              ,file_id
+                              ,lines_added
+                              ,lines_deleted
+                             ))
+        if len(self._changes) >= INSERT_BATCH:
+            self._flush()
+
+    def _flush(self):
+        """Inserts the rows accumulated so far"""
+        db = self._db
+        db.executemany("INSERT INTO files VALUES (?, ?, ?)", self._files)
+        db.executemany("INSERT INTO commits VALUES (?, ?, ?, ?, ?, ?)",
+                       self._commits)
+        db.executemany("INSERT INTO changes VALUES (?, ?, ?, ?)",
+                       self._changes)
+        self._files = []
+        self._commits = []
+        self._changes = []
+
+    def close(self):
+        """Commits the load and makes sure the indexes exist"""
+        db = self._db
+        try:
+            if self._repo_id is None and not self.append:
+                # Nothing was written, the repo's old rows are still replaced
+                self._start()
+            if db.in_transaction:
+                self._flush()
+                db.execute("COMMIT")
+            db.executescript(_INDEXES)
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Abandons the load, leaving the database as it was"""
+        if self._db.in_transaction:
+            self._db.execute("ROLLBACK")
+        self._db.close()
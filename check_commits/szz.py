@@ -0,0 +1,341 @@
+"""szz.py attributes the defects fixed by the defect commits to the commits
+that introduced them, following the SZZ algorithm (Sliwerski, Zimmermann and
+Zeller): the lines that a fix deletes or modifies are taken to be the faulty
+ones, and the commits that last changed them, before the fix, are taken to
+have introduced the defect.
+
+For each defect commit, the changes from its first parent are listed with
+git diff -U0 (with rename detection, so a renamed file is traced back under
+its old pathname). The old side of each hunk holds the lines that the fix
+deleted or modified. Each of these files is blamed at the parent revision,
+and the fix's lines are attributed to the commits that blame reports for
+them. Lines that the fix only adds can't be attributed, nor can the changes
+made by root commits, binary files and submodules.
+
+The defect commits are processed concurrently, by a pool of BLAME_JOBS
+threads (git does the work, in its own processes). The blame of a file at a
+revision never changes, so it's kept in a cache keyed by pathname and
+revision, and the fixes that touch the same file from the same parent only
+blame it once. The cache holds up to BLAME_CACHE_ENTRIES files, least
+recently used first out.
+
+The attributions are written to:
+
+    <repo_name>-szz.csv
+
+with one row for each fix, introducing commit and file, holding the number
+of lines attributed:
+
+    fix_commit,introducing_commit,file,lines
+
+The rows of each fix are sorted by file and introducing commit, and the
+fixes are in log order.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import re
+import csv
+import codecs
+import threading
+import subprocess
+import collections
+import concurrent.futures
+from array import array
+
+# Number of threads running blame jobs, 0 uses one per CPU core
+BLAME_JOBS = 0
+# Number of blamed files kept in the cache
+BLAME_CACHE_ENTRIES = 4096
+
+COLUMNS = ["fix_commit", "introducing_commit", "file", "lines"]
+
+# The old side of a hunk header, "@@ -<start>[,<count>] +..."
+_HUNK_RE = re.compile(br"^@@ -(\d+)(?:,(\d+))? ")
+
+
+def unquote_path(path):
+    """Decodes a pathname from git's diff headers, which quotes the names
+    that hold unusual characters, C style
+    """
+    if path.startswith(b'"') and path.endswith(b'"'):
+        path = codecs.escape_decode(path[1:-1])[0]
+    return path.decode("utf-8", "surrogateescape")
+
+
+def collect_defects(recs, fixes):
+    """Generator that passes records through, listing the defect commits
+
+    Args:
+        recs - iterable of CommitRec objects, in log order
+        fixes - list that receives the SHA-1 of each defect commit, in log
+                order
+    Yields:
+        The CommitRec objects
+    """
+    last = None
+    for rec in recs:
+        if rec.commit != last:
+            last = rec.commit
+            if rec.is_defect:
+                fixes.append(rec.commit)
+        yield rec
+
+
+def fix_parents(cmd_root, fixes):
+    """Finds the first parent of each of the defect commits
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                targets the repo
+        fixes - list of strs with the SHA-1's of the defect commits
+    Returns:
+        Dictionary that maps the SHA-1 of each fix to that of its first
+        parent, root commits are left out
+    """
+    cmd = cmd_root + ["rev-list", "--no-walk=unsorted", "--parents",
+                      "--stdin"]
+    out = subprocess.check_output(cmd, input=''.join(f + "\n" for f in fixes)
+                                  .encode("ascii"))
+    parents = {}
+    for line in out.decode("ascii").splitlines():
+        shas = line.split()
+        if len(shas) > 1:
+            parents[shas[0]] = shas[1]
+    return parents
+
+
+def deleted_lines(cmd_root, parent, fix, paths=None):
+    """Lists the lines of the parent revision that a fix deletes or
+    modifies
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                targets the repo
+        parent - str with the SHA-1 of the parent revision
+        fix - str with the SHA-1 of the defect commit
+        paths - optional list of strs with the pathspec arguments, starting
+                with "--", that limit the files
+    Returns:
+        Dictionary that maps the pathname of each file, in the parent, to a
+        list of (first line, number of lines) tuples
+    """
+    cmd = cmd_root + [ "-c", "core.quotePath=false"
+                      ,"diff", "-U0", "-M", "--no-prefix", "--no-color"
+                      ,"--no-ext-diff", parent, fix
+                     ] + (paths if paths else [])
+    out = subprocess.check_output(cmd)
+    ranges = {}
+    old_path = None
+    in_header = False
+    for line in out.split(b"\n"):
+        if line.startswith(b"diff --git "):
+            in_header = True
+            old_path = None
+        elif in_header and line.startswith(b"--- "):
+            # Files that were added have no old side. Names with spaces
+            # are followed by a tab
+            name = line[4:].rstrip(b"\t")
+            old_path = None if name == b"/dev/null" else unquote_path(name)
+        elif line.startswith(b"@@ "):
+            # Past the header, the content lines start with "-", "+" or " ",
+            # so can't be mistaken for one
+            in_header = False
+            m = _HUNK_RE.match(line)
+            count = 1 if m.group(2) is None else int(m.group(2))
+            if old_path is not None and count:
+                ranges.setdefault(old_path, []).append((int(m.group(1)),
+                                                        count))
+    return ranges
+
+
+def blame(cmd_root, path, rev):
+    """Blames every line of a file at a revision
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                targets the repo
+        path - str with the pathname of the file
+        rev - str with the SHA-1 of the revision
+    Returns:
+        Tuple of a list of the SHA-1's of the commits and an array, with one
+        entry for each line of the file (starting from line 0, which isn't
+        used), holding the index of the line's commit in the list. Or None
+        if the file can't be blamed, a submodule for example
+    """
+    cmd = cmd_root + ["blame", "--incremental", rev, "--", path]
+    try:
+        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return None
+    shas = []
+    sha_idx = {}
+    lines = array('I', [0])
+    # Each group of lines starts with "<sha> <orig line> <final line>
+    # <count>", followed by header lines, ending with "filename <path>"
+    group = True
+    for line in out.split(b"\n"):
+        if group:
+            fields = line.split(b" ")
+            if len(fields) != 4:
+                break
+            sha = fields[0].decode("ascii")
+            idx = sha_idx.get(sha)
+            if idx is None:
+                idx = sha_idx[sha] = len(shas)
+                shas.append(sha)
+            final = int(fields[2])
+            count = int(fields[3])
+            if len(lines) < final + count:
+                lines.extend([0] * (final + count - len(lines)))
+            for n in range(final, final + count):
+                lines[n] = idx
+            group = False
+        elif line.startswith(b"filename "):
+            group = True
+    return (shas, lines)
+
+
+class BlameCache(object):
+    """The blame of the files that have been blamed, by pathname and
+    revision, least recently used first
+
+    Attributes:
+        max_entries - int, the most files kept
+        hits - number of lookups answered from the cache
+        misses - number of lookups that ran git blame
+    """
+    __slots__ = [ "max_entries"
+                 ,"hits"
+                 ,"misses"
+                 ,"_entries"
+                 ,"_lock"
+                ]
+
+    def __init__(self, max_entries=BLAME_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cmd_root, path, rev):
+        """Returns the blame of a file at a revision, see blame()"""
+        key = (path, rev)
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+        # Another thread may blame the same file meanwhile, which only
+        # costs the time
+        result = blame(cmd_root, path, rev)
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+
+def attribute_fix(cmd_root, fix, parent, cache, paths=None):
+    """Attributes the lines that a fix deletes or modifies to the commits
+    that introduced them
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                targets the repo
+        fix - str with the SHA-1 of the defect commit
+        parent - str with the SHA-1 of its first parent
+        cache - BlameCache object
+        paths - optional list of pathspec arguments, see deleted_lines()
+    Returns:
+        List of [fix, introducing commit, file, lines] rows, sorted by file
+        and introducing commit
+    """
+    rows = []
+    for path, ranges in sorted(deleted_lines(cmd_root, parent, fix,
+                                             paths).items()):
+        result = cache.get(cmd_root, path, parent)
+        if result is None:
+            continue
+        shas, lines = result
+        counts = collections.Counter()
+        for start, count in ranges:
+            for n in range(start, min(start + count, len(lines))):
+                counts[lines[n]] += 1
+        rows.extend(sorted([fix, shas[idx], path, n]
+                           for idx, n in counts.items()))
+    return rows
+
+
+def write_szz( cmd_root
+              ,fixes
+              ,path
+              ,append=False
+              ,jobs=None
+              ,log_filter=None
+              ,cache=None
+             ):
+    """Attributes every fix, and writes the results
+
+    Args:
+        cmd_root - list of strs with the start of the git command that
+                targets the repo
+        fixes - list of strs with the SHA-1's of the defect commits, in log
+                order
+        path - pathname of the output file
+        append - bool, if True, add the rows to an existing file
+        jobs - int with the number of threads running blame jobs, 0 uses
+                one per CPU core. Defaults to the value of BLAME_JOBS
+        log_filter - optional check_commits.LogFilter object, whose
+                pathspecs limit the files that are attributed
+        cache - optional BlameCache object, a new one is used by default
+    Returns:
+        The BlameCache object, with its hit and miss counts
+    """
+    if jobs is None:
+        jobs = BLAME_JOBS
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    if cache is None:
+        cache = BlameCache()
+    paths = log_filter.path_args() if log_filter is not None else None
+    parents = fix_parents(cmd_root, fixes) if fixes else {}
+    todo = [f for f in fixes if f in parents]
+
+    with open(path, 'a' if append else 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        if not append:
+            writer.writerow(COLUMNS)
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            results = pool.map(lambda fix: attribute_fix( cmd_root
+                                                         ,fix
+                                                         ,parents[fix]
+                                                         ,cache
+                                                         ,paths
+                                                        ), todo)
+            for rows in results:
+                writer.writerows(rows)
+    return cache
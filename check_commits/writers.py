@@ -0,0 +1,361 @@
+"""writers.py serializes CommitRec objects to the output files as they are
+produced, in a single pass over the records.
+
+Each output format is handled by a "sink" object. The sinks are fed the
+field values of each record, as a tuple in the order of CommitRec.__slots__,
+so the attributes are only retrieved once per record, no matter how many
+sinks there are. The encoders for the JSON and text representations are
+prepared once, when the sink is created, rather than converting every record
+to a dictionary and handing it to a general purpose encoder.
+
+The supported sinks are:
+
+    JsonArraySink - a JSON array, byte for byte the same as json.dump()
+                    produces for a list of CommitRecs
+    NdjsonSink - newline delimited JSON, one record per line
+    CsvSink - CSV, the same as csv.DictWriter produces from to_dict()
+    TextSink - one line per record, the same as str(CommitRec)
+
+Each of them may write its output compressed, through a CompressedWriter
+(see compress.py), whose background thread compresses the output while the
+records are being produced. read_records() reads the records back from any
+of the JSON and CSV outputs, compressed or not.
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import io
+import csv
+import json
+import operator
+
+from json.encoder import encode_basestring_ascii
+
+from check_commits.check_commits import CommitRec
+from check_commits.compress import EXTENSIONS
+from check_commits.compress import open_text
+
+# The fields of a record, in output order
+FIELDS = CommitRec.__slots__
+
+# Retrieves the values of all of the fields of a record as a tuple
+get_values = operator.attrgetter(*FIELDS)
+
+_INFINITY = float("inf")
+
+
+def _json_float(v):
+    """Encodes a float the same way the json module does"""
+    if v != v:
+        return "NaN"
+    if v == _INFINITY:
+        return "Infinity"
+    if v == -_INFINITY:
+        return "-Infinity"
+    return float.__repr__(v)
+
+
+# Encoders for the JSON representation, selected by the type of the value.
+# Values of any other type are left to json.dumps()
+_JSON_ENCODERS = { str:encode_basestring_ascii
+                  ,int:int.__repr__
+                  ,float:_json_float
+                  ,bool:lambda v: "true" if v else "false"
+                  ,type(None):lambda v: "null"
+                 }
+
+# Encoders for the text representation, matching CommitRec.__repr__()
+_TEXT_ENCODERS = { str:lambda v: '"' + v + '"'
+                  ,int:str
+                  ,float:str
+                  ,bool:lambda v: "true" if v else "false"
+                 }
+
+
+class RecordEncoder(object):
+    """Converts the field values of a record into a JSON like str
+
+    The text that precedes each value (the brace or separator, and the
+    quoted field name) is built once, when the encoder is created.
+
+    Attributes:
+        prefixes - list of strs, the text that precedes each value
+        encoders - dictionary that maps the type of a value to the function
+                that encodes it
+        fallback - function used to encode values of any other type
+    """
+    __slots__ = ["prefixes", "encoders", "fallback"]
+
+    def __init__(self, encoders, fallback, key_sep, item_sep):
+        """Prepares the encoder
+
+        Args:
+            encoders - dictionary that maps the type of a value to the
+                    function that encodes it
+            fallback - function used to encode values of any other type
+            key_sep - str that separates a field name from its value
+            item_sep - str that separates one field from the next
+        """
+        self.encoders = encoders
+        self.fallback = fallback
+        self.prefixes = []
+        for i, k in enumerate(FIELDS):
+            lead = "{" if i == 0 else item_sep
+            self.prefixes.append(''.join([lead, json.dumps(k), key_sep]))
+
+    def encode(self, vals):
+        """Encodes the field values of one record
+
+        Args:
+            vals - tuple of the field values, in the order of FIELDS
+        Returns:
+            str holding the encoded record
+        """
+        encoders = self.encoders
+        parts = []
+        for prefix, v in zip(self.prefixes, vals):
+            enc = encoders.get(type(v), self.fallback)
+            parts.append(prefix)
+            parts.append(enc(v))
+        parts.append("}")
+        return ''.join(parts)
+
+
+def json_encoder():
+    """Returns a RecordEncoder for the same JSON that json.dumps() produces"""
+    return RecordEncoder(_JSON_ENCODERS, json.dumps, ": ", ", ")
+
+
+def text_encoder():
+    """Returns a RecordEncoder for the text that CommitRec.__repr__ produces"""
+    return RecordEncoder(_TEXT_ENCODERS, "{0}".format, ":", ",")
+
+
+def _open(path, append, compression, newline=None):
+    """Opens an output file, as a CompressedWriter if compression, a
+    compress.Compression object, is given
+    """
+    if compression is not None:
+        return compression.open(path, append, newline)
+    return open(path, 'a' if append else 'w', newline=newline)
+
+
+class RecordSink(object):
+    """Base class for the objects that write records to an output file
+
+    Sinks are used as context managers, or must be closed explicitly.
+
+    Attributes:
+        path - pathname of the output file
+        f - the open file object
+    """
+    __slots__ = ["path", "f"]
+
+    def __init__(self, path, f):
+        self.path = path
+        self.f = f
+
+    def write(self, vals):
+        """Writes one record
+
+        Args:
+            vals - tuple of the field values, in the order of FIELDS
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Completes, and closes, the output file"""
+        self.f.close()
+
+    def abort(self):
+        """Closes the output file after a failure, by default the same as
+        close(), so the output holds the records written until the failure
+        """
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class JsonArraySink(RecordSink):
+    """Writes the records as a JSON array
+
+    When appending, the array written by an earlier run is extended in
+    place, by overwriting its closing bracket. When compressed, the opening
+    and closing brackets are written as streams of their own, and the
+    closing one is dropped instead.
+    """
+    __slots__ = ["_enc", "_sep", "_compressed"]
+
+    def __init__(self, path, append=False, compression=None):
+        """Opens the output file
+
+        Args:
+            path - pathname of the output file
+            append - bool, if True, extend the array in an existing file
+            compression - optional compress.Compression object, with the
+                    settings for compressing the output
+        """
+        self._compressed = compression is not None
+        if append and self._compressed:
+            # Only the opening bracket is left if the array is empty
+            size = compression.strip_member(path, "]")
+            self._sep = "" if size == len(compression.member("[")) else ", "
+            f = compression.open(path, True)
+        elif append:
+            bf = open(path, 'r+b')
+            # Position ourselves on the closing bracket of the array, the
+            # character before it tells us whether the array is empty
+            bf.seek(-2, os.SEEK_END)
+            self._sep = "" if bf.read(1) == b"[" else ", "
+            f = io.TextIOWrapper(bf, encoding="ascii")
+        else:
+            f = _open(path, False, compression)
+            f.write("[")
+            if self._compressed:
+                f.end_member()
+            self._sep = ""
+        RecordSink.__init__(self, path, f)
+        self._enc = json_encoder()
+
+    def write(self, vals):
+        self.f.write(self._sep)
+        self.f.write(self._enc.encode(vals))
+        self._sep = ", "
+
+    def close(self):
+        if self._compressed:
+            self.f.end_member()
+            self.f.write("]")
+        else:
+            self.f.write("]")
+            self.f.truncate()
+        self.f.close()
+
+
+class NdjsonSink(RecordSink):
+    """Writes the records as newline delimited JSON, one record per line"""
+    __slots__ = ["_enc"]
+
+    def __init__(self, path, append=False, compression=None):
+        RecordSink.__init__(self, path, _open(path, append, compression))
+        self._enc = json_encoder()
+
+    def write(self, vals):
+        self.f.write(self._enc.encode(vals))
+        self.f.write("\n")
+
+
+class CsvSink(RecordSink):
+    """Writes the records as CSV, with a header unless appending"""
+    __slots__ = ["_writer"]
+
+    def __init__(self, path, append=False, compression=None):
+        f = _open(path, append, compression, newline='')
+        RecordSink.__init__(self, path, f)
+        self._writer = csv.writer(f, lineterminator=os.linesep)
+        if not append:
+            self._writer.writerow(FIELDS)
+
+    def write(self, vals):
+        self._writer.writerow(vals)
+
+
+class TextSink(RecordSink):
+    """Writes the records in their text representation, one per line"""
+    __slots__ = ["_enc"]
+
+    def __init__(self, path, append=False, compression=None):
+        RecordSink.__init__(self, path, _open(path, append, compression))
+        self._enc = text_encoder()
+
+    def write(self, vals):
+        self.f.write(self._enc.encode(vals))
+        self.f.write("\n")
+
+
+def write_records(recs, sinks):
+    """Feeds every record to every sink, in a single pass over the records
+
+    The sinks are closed once the records have been written. If an error
+    occurs, they're aborted instead, see RecordSink.abort().
+
+    Args:
+        recs - iterable of CommitRec objects, may be a generator that
+                produces the records as the log is parsed
+        sinks - list of RecordSink objects
+    Returns:
+        The number of records written
+    """
+    count = 0
+    try:
+        writes = [s.write for s in sinks]
+        for rec in recs:
+            vals = get_values(rec)
+            for w in writes:
+                w(vals)
+            count += 1
+    except:
+        for s in sinks:
+            s.abort()
+        raise
+    for s in sinks:
+        s.close()
+    return count
+
+
+def read_records(path):
+    """Generator that reads the records back from a JSON array, NDJSON or
+    CSV output, which may be compressed
+
+    The format is told by the file's extension, once any extension of a
+    compression codec is removed.
+
+    Args:
+        path - pathname of the output file
+    Yields:
+        A dictionary of the fields of each record. Those read from CSV hold
+        strs
+    """
+    name = path
+    for ext in EXTENSIONS.values():
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+            break
+    if name.endswith(".csv"):
+        with open_text(path, newline='') as f:
+            for row in csv.DictReader(f):
+                yield row
+    elif name.endswith(".ndjson"):
+        with open_text(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open_text(path) as f:
+            for rec in json.load(f):
+                yield rec
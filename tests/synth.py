@@ -0,0 +1,146 @@
+"""Helpers that build the synthetic repos the tests run against
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from check_commits import bench
+
+# Name of the synthetic repos, and so of their outputs
+REPO = "synth"
+OWNER = "synth_owner"
+
+# Shape of the synthetic histories, small enough to build in a moment
+PARAMS = { "commits":40
+          ,"files_per_commit":3
+          ,"msg_lines":3
+          ,"merge_ratio":0.1
+          ,"seed":7
+         }
+
+
+def make_repo(path, params=None):
+    """Builds a synthetic repo, see bench.synth_history()
+
+    Args:
+        path - str with the directory to create the repo in
+        params - optional dictionary with the shape of the history, whose
+                entries replace those of PARAMS
+    Returns:
+        List of the bench.SynthCommit objects of the history, newest first
+    """
+    p = dict(PARAMS)
+    p.update(params if params else {})
+    history = bench.synth_history(p)
+    bench.make_repo(path, history)
+    return history
+
+
+def commit(path, msg, files):
+    """Adds a commit to the master branch of a repo
+
+    Args:
+        path - str with the directory of the repo
+        msg - str with the commit message
+        files - dictionary mapping the paths of the files to write to their
+                contents
+    Returns:
+        str with the SHA-1 of the new commit
+    """
+    for name, text in files.items():
+        full = os.path.join(path, name)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, 'w') as f:
+            f.write(text)
+    git = ["git", "-C", path, "-c", "user.name=Dev",
+           "-c", "user.email=dev@example.com"]
+    subprocess.check_call(git + ["add"] + list(files))
+    subprocess.check_call(git + ["commit", "-q", "-m", msg])
+    return subprocess.check_output(git + ["rev-parse", "HEAD"]).decode(
+                                                        "ascii").strip()
+
+
+def rev_list(path, *args):
+    """Lists the SHA-1's of the commits of a repo, in log order
+
+    The SHA-1's of the SynthCommit objects are made up, these are git's.
+
+    Args:
+        path - str with the directory of the repo
+        args - strs with any other arguments for git rev-list
+    """
+    cmd = ["git", "-C", path, "rev-list"] + list(args) + ["HEAD"]
+    return subprocess.check_output(cmd).decode("ascii").split()
+
+
+class RepoTestCase(unittest.TestCase):
+    """Builds a synthetic repo, and an output directory, for each test
+
+    Attributes:
+        tmp_dir - str with the directory that holds everything
+        repo_path - str with the directory of the repo
+        out_dir - str with the directory that receives the outputs
+        defects_file - str with the pathname of an empty defect commits file
+        history - list of the bench.SynthCommit objects of the repo
+    """
+    params = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repo_path = os.path.join(self.tmp_dir, REPO)
+        self.history = make_repo(self.repo_path, self.params)
+        self.out_dir = os.path.join(self.tmp_dir, "out")
+        os.makedirs(self.out_dir)
+        self.defects_file = os.path.join(self.tmp_dir, REPO + ".dft")
+        open(self.defects_file, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def output(self, suffix, out_dir=None):
+        """Returns the pathname of one of the outputs"""
+        return os.path.join(out_dir if out_dir else self.out_dir,
+                            REPO + suffix)
+
+    def read_json(self, suffix, out_dir=None):
+        """Loads one of the JSON outputs"""
+        with open(self.output(suffix, out_dir), 'r') as f:
+            return json.load(f)
+
+    def read_text(self, suffix, out_dir=None):
+        """Reads one of the outputs as a str"""
+        with open(self.output(suffix, out_dir), 'r') as f:
+            return f.read()
+
+    def write_config(self, rules):
+        """Writes a classifier config, and returns its pathname"""
+        path = os.path.join(self.tmp_dir, "rules.json")
+        with open(path, 'w') as f:
+            json.dump({"rules":rules}, f)
+        return path
@@ -0,0 +1,61 @@
+"""Tests of the defect message classifier
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import unittest
+
+from check_commits.classifier import DefectClassifier
+
+
+class ClassifierTest(unittest.TestCase):
+
+    def test_overlapping_regex_rules(self):
+        """A rule whose text was taken by a later rule's match still fires,
+        since it comes first
+        """
+        clf = DefectClassifier([ {"name":"crash", "regex":"fix crash"}
+                                ,{"name":"hot", "regex":"hot ?fix"}
+                               ])
+        self.assertEqual(clf.classify("hotfix crash in parser", "c1"),
+                         "crash")
+        crash, hot = clf.stats[0], clf.stats[1]
+        self.assertEqual((crash.matches, crash.hits), (1, 1))
+        self.assertEqual((hot.matches, hot.hits), (1, 0))
+        self.assertEqual(clf.fired, {"c1":"crash"})
+
+    def test_priority(self):
+        """The first rule in the config is reported, whatever the kind"""
+        clf = DefectClassifier([ {"name":"words", "keywords":["fix"]}
+                                ,{"name":"jira", "regex":"JIRA-\\d+"}
+                                ,{"name":"keys", "keys":["CORE"]}
+                               ])
+        self.assertEqual(clf.classify("CORE-12 JIRA-3"), "jira")
+        self.assertEqual(clf.classify("Fix JIRA-3"), "words")
+        self.assertEqual(clf.classify("CORE-12"), "keys")
+        self.assertIsNone(clf.classify("refactor the parser"))
+        self.assertEqual([s.matches for s in clf.stats], [1, 2, 2, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
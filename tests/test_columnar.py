@@ -0,0 +1,87 @@
+"""Tests of the columnar output
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from check_commits.columnar import ColumnarSink
+from check_commits.columnar import ColumnarReader
+
+
+def _record(n):
+    """Builds the field values of the n-th record, the authors repeat so
+    their column holds fewer values than rows
+    """
+    return ( "repo", "owner", 1420070400.5 + n, "sha{0}".format(n)
+            ,"dir/file{0}.py".format(n), n, 2*n
+            ,"author{0}@é.com".format(n % 2), n % 3 == 0)
+
+
+class ColumnarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "recs.col")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, recs, append=False):
+        with ColumnarSink(self.path, append) as sink:
+            for vals in recs:
+                sink.write(vals)
+
+    def test_round_trip(self):
+        """The rows are read back, with the types they were written with,
+        and the rows of an appending run follow the earlier ones
+        """
+        recs = [_record(n) for n in range(7)]
+        self._write(recs[:4])
+        self._write(recs[4:], append=True)
+        with ColumnarReader(self.path) as reader:
+            self.assertEqual(len(reader), len(recs))
+            self.assertEqual(list(reader.rows()), recs)
+
+    def test_columns(self):
+        recs = [_record(n) for n in range(5)]
+        self._write(recs)
+        with ColumnarReader(self.path) as reader:
+            added = reader.column("lines_added")
+            self.assertEqual(added.tolist(), [v[5] for v in recs])
+            authors = reader.column("author")
+            self.assertEqual(len(authors.values), 2)
+            self.assertEqual([authors[i] for i in range(len(authors))],
+                             [v[7] for v in recs])
+
+    def test_not_columnar(self):
+        with open(self.path, 'w') as f:
+            f.write("[]" * 20)
+        self.assertRaises(ValueError, ColumnarReader, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Tests of the results held by the daemon
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import unittest
+
+import synth
+
+from check_commits.daemon import ResultCache
+
+
+class ResultCacheTest(synth.RepoTestCase):
+
+    def test_classifier_per_repo(self):
+        """Each repo's messages are classified by a classifier of its own,
+        which is dropped along with its results
+        """
+        other = os.path.join(self.tmp_dir, "other")
+        synth.make_repo(other, {"seed":8})
+        results = ResultCache(options={"classifier_config":""})
+        first = results.get(self.repo_path)
+        second = results.get(other)
+        classifiers = [e.defect_commits.classifier for e in [first, second]]
+        self.assertIsNot(classifiers[0], classifiers[1])
+        for c in classifiers:
+            self.assertGreater(c.messages, 0)
+            self.assertTrue(c.fired)
+        self.assertTrue(set(classifiers[0].fired).isdisjoint(
+                                                    classifiers[1].fired))
+        self.assertEqual(results.classifier.messages, 0)
+        self.assertEqual(results.classifier.fired, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
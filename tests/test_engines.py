@@ -0,0 +1,85 @@
+"""Tests that both log engines produce the same outputs
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+
+import os
+import unittest
+
+import synth
+
+from check_commits.check_commits import process_commits
+
+
+class EnginesTest(synth.RepoTestCase):
+
+    def _run(self, engine, config=None):
+        out_dir = os.path.join(self.tmp_dir, engine)
+        os.makedirs(out_dir)
+        process_commits( self.repo_path
+                        ,synth.OWNER
+                        ,out_dir=out_dir
+                        ,defects_file=self.defects_file
+                        ,classifier_config=config
+                        ,engine=engine
+                       )
+        return out_dir
+
+    def test_outputs(self):
+        """The records are the same, whichever engine parsed the log"""
+        outs = [self._run(e) for e in ["regex", "machine"]]
+        for suffix in [".json", ".csv", "-commit-recs.txt"]:
+            self.assertEqual(self.read_text(suffix, outs[1]),
+                             self.read_text(suffix, outs[0]))
+
+    def test_message_lines(self):
+        """The rules see the message lines as git log shows them, with
+        either engine
+        """
+        sha = synth.commit(self.repo_path,
+                           "Tidy up\n\n\tfix:\tcrash   \nin the parser\n",
+                           {"src/parser.py":"a\n"})
+        # Each rule only matches the message, once indented, with its
+        # tabs expanded and its trailing spaces stripped
+        config = self.write_config(
+                        [ {"name":"tabs", "regex":"fix: +crash\\n"}
+                         ,{"name":"indent", "regex":"\\n {4}in the parser"}
+                         ,{"name":"date", "regex":"Date: "}
+                        ])
+        outs = [self._run(e, config) for e in ["regex", "machine"]]
+        stats = []
+        for out_dir in outs:
+            s = self.read_json("-classifier.json", out_dir)
+            for r in s["rules"]:
+                del r["seconds"]
+            stats.append(s)
+            self.assertIn("{0},tabs".format(sha),
+                          self.read_text("-defect-rules.csv", out_dir))
+        self.assertEqual(stats[1], stats[0])
+        hits = dict((r["name"], r["hits"]) for r in stats[0]["rules"])
+        self.assertEqual(hits["date"], 0)
+        self.assertEqual(self.read_text(".json", outs[1]),
+                         self.read_text(".json", outs[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
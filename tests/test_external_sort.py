@@ -0,0 +1,131 @@
+"""Tests of the external sort of the records
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import unittest
+
+from check_commits import external_sort
+from check_commits.writers import FIELDS
+from check_commits.writers import RecordSink
+
+
+class ListSink(RecordSink):
+    """Collects the records it is fed"""
+    __slots__ = ["recs", "closed"]
+
+    def __init__(self):
+        RecordSink.__init__(self, None, None)
+        self.recs = []
+        self.closed = False
+
+    def write(self, vals):
+        self.recs.append(vals)
+
+    def close(self):
+        self.closed = True
+
+
+def _record(n):
+    """Builds the field values of the n-th record, the file names repeat so
+    many records have the same key
+    """
+    return ( "repo", "owner", float(n), "sha{0}".format(n)
+            ,"dir/file{0}".format(n % 7), 1, 1, "author", False)
+
+
+class SortSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self._fan_in = external_sort.MERGE_FAN_IN
+        external_sort.MERGE_FAN_IN = 4
+
+    def tearDown(self):
+        external_sort.MERGE_FAN_IN = self._fan_in
+
+    def test_many_runs(self):
+        """More runs than MERGE_FAN_IN are spilled, without more of them
+        being open at once per level, and the order is stable
+        """
+        self.assertEqual(len(_record(0)), len(FIELDS))
+        recs = [_record(n) for n in range(500)]
+        out = ListSink()
+        # Every record is spilled as a run of its own
+        sink = external_sort.SortSink([out], "file", memory_limit=1)
+        fan_in = external_sort.MERGE_FAN_IN
+        for vals in recs:
+            sink.write(vals)
+            for n, level in enumerate(sink.runs):
+                self.assertLess(len(level), fan_in)
+                # Only runs of the same size are merged
+                for r in level:
+                    self.assertEqual(r.count, fan_in ** n)
+        # 500 is 13310 in base 4, level n holds its n-th digit
+        self.assertEqual([len(level) for level in sink.runs],
+                         [0, 1, 3, 3, 1])
+        sink.close()
+        self.assertTrue(out.closed)
+        self.assertEqual(sink.runs, [])
+        key = FIELDS.index("file")
+        self.assertEqual(out.recs, sorted(recs, key=lambda v: v[key]))
+
+    def test_merge_io(self):
+        """Each record is rewritten once per level, rather than once per
+        merge
+        """
+        written = []
+        run_class = external_sort.SortRun
+
+        class CountingRun(run_class):
+            __slots__ = []
+
+            def __init__(self, vals, spill_dir=None):
+                run_class.__init__(self, vals, spill_dir)
+                written.append(self.count)
+
+        external_sort.SortRun = CountingRun
+        try:
+            sink = external_sort.SortSink([ListSink()], "timestamp",
+                                          memory_limit=1)
+            for n in range(4 ** 4):
+                sink.write(_record(n))
+            sink.close()
+        finally:
+            external_sort.SortRun = run_class
+        # Spilled once, and rewritten on each of the 4 levels above
+        self.assertEqual(sum(written), 4 ** 4 * 5)
+
+    def test_in_memory(self):
+        """Records that fit in the budget are sorted without spilling"""
+        recs = [_record(n) for n in range(100, 0, -1)]
+        out = ListSink()
+        sink = external_sort.SortSink([out], "timestamp")
+        for vals in recs:
+            sink.write(vals)
+        self.assertEqual(sink.runs, [])
+        sink.close()
+        self.assertEqual(out.recs, recs[::-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Tests of incremental runs, which append the records of the new commits
+to the outputs of an earlier run
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import unittest
+
+import synth
+
+from check_commits.check_commits import process_commits
+from check_commits.writers import read_records
+
+
+class IncrementalTest(synth.RepoTestCase):
+
+    def _run(self, out_dir, config=None, incremental=True, compress=None):
+        os.makedirs(out_dir, exist_ok=True)
+        process_commits( self.repo_path
+                        ,synth.OWNER
+                        ,incremental=incremental
+                        ,out_dir=out_dir
+                        ,defects_file=self.defects_file
+                        ,classifier_config=config
+                        ,compress=compress
+                       )
+
+    def _add_commits(self):
+        synth.commit(self.repo_path, "Fix JIRA-1 in the parser",
+                     {"src/new1.py":"a\nb\n"})
+        synth.commit(self.repo_path, "Update the docs",
+                     {"src/new2.py":"c\n"})
+
+    def test_append(self):
+        """The records of the new commits are appended"""
+        inc = os.path.join(self.tmp_dir, "inc")
+        full = os.path.join(self.tmp_dir, "full")
+        self._run(inc)
+        self._add_commits()
+        self._run(inc)
+        self._run(full, incremental=False)
+        recs = self.read_json(".json", inc)
+        key = lambda r: (r["commit"], r["file"])
+        self.assertEqual(sorted(recs, key=key),
+                         sorted(self.read_json(".json", full), key=key))
+        # The new records follow the older ones
+        self.assertEqual(sorted(r["file"] for r in recs[-2:]),
+                         ["src/new1.py", "src/new2.py"])
+
+    def test_compressed_append(self):
+        """The records of the new commits are appended to compressed
+        outputs too
+        """
+        inc = os.path.join(self.tmp_dir, "inc")
+        full = os.path.join(self.tmp_dir, "full")
+        self._run(inc, compress="gzip")
+        self._add_commits()
+        self._run(inc, compress="gzip")
+        self._run(full, incremental=False)
+        key = lambda r: (r["commit"], r["file"])
+        for suffix in [".json", ".csv"]:
+            recs = read_records(self.output(suffix + ".gz", inc))
+            self.assertEqual(
+                    sorted(recs, key=key),
+                    sorted(read_records(self.output(suffix, full)), key=key))
+
+    def test_defects_file(self):
+        """Changing the defect commits file rebuilds the outputs, so the
+        earlier records are flagged by it too
+        """
+        inc = os.path.join(self.tmp_dir, "inc")
+        self._run(inc)
+        tagged = synth.rev_list(self.repo_path, "--no-merges")[5]
+        with open(self.defects_file, 'w') as f:
+            f.write(tagged + "\n")
+        self._run(inc)
+        recs = [r for r in self.read_json(".json", inc)
+                if r["commit"] == tagged]
+        self.assertTrue(recs)
+        self.assertTrue(all(r["is_defect"] for r in recs))
+
+    def test_classifier_stats(self):
+        """The classifier statistics cover the commits of both runs"""
+        config = self.write_config([ {"name":"jira", "regex":"JIRA-\\d+"}
+                                    ,{"name":"docs", "keywords":["docs"]}
+                                   ])
+        inc = os.path.join(self.tmp_dir, "inc")
+        full = os.path.join(self.tmp_dir, "full")
+        self._run(inc, config)
+        before = self.read_text("-defect-rules.csv", inc).splitlines()
+        self._add_commits()
+        self._run(inc, config)
+        self._run(full, config, incremental=False)
+        stats = self.read_json("-classifier.json", inc)
+        full_stats = self.read_json("-classifier.json", full)
+        for s in [stats, full_stats]:
+            for r in s["rules"]:
+                del r["seconds"]
+        self.assertEqual(stats, full_stats)
+        rows = self.read_text("-defect-rules.csv", inc).splitlines()
+        self.assertEqual(rows[:len(before)], before)
+        self.assertEqual(sorted(rows),
+                         sorted(self.read_text("-defect-rules.csv",
+                                               full).splitlines()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""Tests of the persistent parse cache
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import unittest
+
+import synth
+
+from check_commits.check_commits import process_commits
+
+
+class ParseCacheTest(synth.RepoTestCase):
+
+    def _run(self, out_dir, config):
+        os.makedirs(out_dir, exist_ok=True)
+        process_commits( self.repo_path
+                        ,synth.OWNER
+                        ,out_dir=out_dir
+                        ,defects_file=self.defects_file
+                        ,classifier_config=config
+                        ,cache_dir=os.path.join(self.tmp_dir, "cache")
+                       )
+
+    def test_warm_stats(self):
+        """A run that takes every commit from the cache reports the same
+        classifier statistics as the run that parsed them
+        """
+        # One of the commits is tagged by the defects file
+        with open(self.defects_file, 'w') as f:
+            f.write(synth.rev_list(self.repo_path, "--no-merges")[3] + "\n")
+        config = self.write_config([ {"name":"jira", "regex":"JIRA-\\d+"}
+                                    ,{"name":"docs", "keywords":["docs"]}
+                                   ])
+        cold = os.path.join(self.tmp_dir, "cold")
+        warm = os.path.join(self.tmp_dir, "warm")
+        self._run(cold, config)
+        self._run(warm, config)
+        stats = self.read_json("-classifier.json", cold)
+        self.assertGreater(stats["messages"], 0)
+        hits = dict((r["name"], r["hits"]) for r in stats["rules"])
+        self.assertGreater(hits["jira"], 0)
+        self.assertEqual(hits["<dft>"], 1)
+        warm_stats = self.read_json("-classifier.json", warm)
+        for s in [stats, warm_stats]:
+            for r in s["rules"]:
+                # The time, and the matches of the rules that didn't fire,
+                # aren't replayed
+                del r["seconds"], r["matches"]
+        self.assertEqual(warm_stats, stats)
+        self.assertEqual(
+                sorted(self.read_text("-defect-rules.csv", warm).splitlines()),
+                sorted(self.read_text("-defect-rules.csv", cold).splitlines()))
+        self.assertEqual(self.read_text(".json", warm),
+                         self.read_text(".json", cold))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Tests of the partitioned outputs
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from check_commits import partitions
+from check_commits.writers import NdjsonSink
+from check_commits.writers import read_records
+
+FORMATS = [("ndjson", ".ndjson", NdjsonSink)]
+
+# 2015-01-01T00:00:00Z
+_JAN = 1420070400.0
+_DAY = 86400.0
+
+
+def _record(n, timestamp):
+    """Builds the field values of the only record of the n-th commit"""
+    return ( "repo", "owner", timestamp, "sha{0}".format(n)
+            ,"file{0}".format(n), 1, 2, "author", False)
+
+
+class PartitionSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, partition, recs, append=False):
+        sink = partitions.PartitionSink(self.tmp_dir, "repo", partition,
+                                        FORMATS, append)
+        with sink:
+            for vals in recs:
+                sink.write(vals)
+        path = partitions.manifest_path(self.tmp_dir, "repo")
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def test_months(self):
+        """The records are split by month, in and out of time order"""
+        days = [40, 3, 70, 35, 5]
+        recs = [_record(n, _JAN + d * _DAY) for n, d in enumerate(days)]
+        manifest = self._write("month", recs)
+        self.assertEqual([p["name"] for p in manifest["partitions"]],
+                         ["2015-01", "2015-02", "2015-03"])
+        self.assertEqual([p["rows"] for p in manifest["partitions"]],
+                         [2, 2, 1])
+        path = partitions.manifest_path(self.tmp_dir, "repo")
+        read = [r["commit"] for f in partitions.partition_files(path)
+                for r in read_records(f)]
+        self.assertEqual(read, ["sha1", "sha4", "sha0", "sha3", "sha2"])
+
+    def test_size_names(self):
+        """Partitions by size past "99999" are still found in order, so an
+        append continues the last one
+        """
+        names = ["99998", "99999", "100000"]
+        entries = []
+        for n, name in enumerate(names):
+            entries.append({ "name":name
+                            ,"rows":1 if name == "100000" else 2
+                            ,"commits":1
+                            ,"min_timestamp":_JAN
+                            ,"max_timestamp":_JAN
+                            ,"files":[{ "format":"ndjson"
+                                       ,"path":os.path.join("repo-parts",
+                                              "repo-" + name + ".ndjson")
+                                       ,"bytes":0
+                                      }]
+                           })
+        os.makedirs(os.path.join(self.tmp_dir, "repo-parts"))
+        path = partitions.manifest_path(self.tmp_dir, "repo")
+        with open(path, 'w') as f:
+            json.dump({ "repo":"repo"
+                       ,"partition":2
+                       ,"rows":5
+                       ,"partitions":entries
+                      }, f)
+        manifest = self._write(2, [_record(n, _JAN) for n in range(3)],
+                               append=True)
+        self.assertEqual([(p["name"], p["rows"])
+                          for p in manifest["partitions"]],
+                         [ ("99998", 2), ("99999", 2), ("100000", 2)
+                          ,("100001", 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Tests of the SQLite database output
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from check_commits.sqlite_sink import SqliteSink
+
+
+def _record(repo, n):
+    """Builds the field values of the n-th record of a repo"""
+    return ( repo, "owner", float(n), "sha{0}".format(n)
+            ,"file{0}".format(n), 1, 2, "author", False)
+
+
+class SqliteSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "recs.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _load(self, repo, count, append=False, first=0):
+        with SqliteSink(self.path, repo, "owner", append) as sink:
+            for n in range(first, first + count):
+                sink.write(_record(repo, n))
+
+    def _rows(self, repo):
+        db = sqlite3.connect(self.path)
+        try:
+            return db.execute("SELECT COUNT(*) FROM records "
+                              "WHERE repo = ?", (repo,)).fetchone()[0]
+        finally:
+            db.close()
+
+    def test_append(self):
+        self._load("a", 3)
+        self._load("a", 2, append=True, first=3)
+        self.assertEqual(self._rows("a"), 5)
+
+    def test_empty_rebuild(self):
+        """A rebuild without records clears the repo's old rows, and leaves
+        the other repos alone
+        """
+        self._load("a", 3)
+        self._load("b", 2)
+        self._load("a", 0, append=True)
+        self.assertEqual(self._rows("a"), 3)
+        self._load("a", 0)
+        self.assertEqual(self._rows("a"), 0)
+        self.assertEqual(self._rows("b"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""Tests of the record sinks, and of reading their outputs back
+
+
+Copyright 2015 Grip QA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+__author__ = "Dean Stevens"
+__copyright__ = "Copyright 2015, Grip QA"
+__license__ = "Apache License, Version 2.0"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from check_commits import writers
+from check_commits.compress import Compression
+
+
+def _record(n):
+    """Builds the field values of the n-th record"""
+    return ( "repo", "owner", 1420070400.0 + n, "sha{0}".format(n)
+            ,"dir/file \"{0}\",é".format(n), n, 2*n, "author", n % 3 == 0)
+
+
+def _as_strs(vals):
+    """The field values, as they're read back from CSV"""
+    return dict((k, str(v)) for k, v in zip(writers.FIELDS, vals))
+
+
+class WritersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, sink_class, name, recs, append=False, codec=None):
+        path = os.path.join(self.tmp_dir, name)
+        compression = None
+        if codec is not None:
+            compression = Compression(codec)
+            path += compression.ext
+        with sink_class(path, append, compression) as sink:
+            for vals in recs:
+                sink.write(vals)
+        return path
+
+    def _round_trip(self, sink_class, name, codec=None):
+        """Writes the records in two runs, the second appending, and reads
+        them back
+        """
+        recs = [_record(n) for n in range(5)]
+        self._write(sink_class, name, recs[:3], codec=codec)
+        path = self._write(sink_class, name, recs[3:], True, codec)
+        return recs, list(writers.read_records(path))
+
+    def test_json(self):
+        for codec in [None, "gzip", "bz2", "lzma"]:
+            recs, read = self._round_trip(writers.JsonArraySink,
+                                          "recs.json", codec)
+            self.assertEqual(read, [dict(zip(writers.FIELDS, v))
+                                    for v in recs])
+
+    def test_ndjson(self):
+        for codec in [None, "gzip"]:
+            recs, read = self._round_trip(writers.NdjsonSink,
+                                          "recs.ndjson", codec)
+            self.assertEqual(read, [dict(zip(writers.FIELDS, v))
+                                    for v in recs])
+
+    def test_csv(self):
+        for codec in [None, "gzip"]:
+            recs, read = self._round_trip(writers.CsvSink,
+                                          "recs.csv", codec)
+            self.assertEqual(read, [_as_strs(v) for v in recs])
+
+    def test_empty_json(self):
+        """Appending to, and with, no records leaves an empty array"""
+        for codec in [None, "gzip"]:
+            self._write(writers.JsonArraySink, "empty.json", [],
+                        codec=codec)
+            path = self._write(writers.JsonArraySink, "empty.json", [],
+                               True, codec)
+            self.assertEqual(list(writers.read_records(path)), [])
+
+    def test_text(self):
+        """The text output holds the representation of each record"""
+        recs = [_record(n) for n in range(3)]
+        path = self._write(writers.TextSink, "recs.txt", recs)
+        with open(path, 'r') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), len(recs))
+        for line, vals in zip(lines, recs):
+            self.assertIn(vals[3], line)
+
+
+if __name__ == "__main__":
+    unittest.main()